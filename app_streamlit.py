@@ -2,12 +2,19 @@ import streamlit as st
 from datetime import datetime, timedelta, date
 from datetime import datetime as dt, timedelta, date
 from backend import database_operations as db_ops
+from backend import migraciones
+from backend import instrumentacion
+from backend import mapa_identidad
 from backend.database_operations import generar_siguiente_id_lote
 import pandas as pd
 import sys
 import os
 from utils.io_utils import export_df_to_csv
 from utils.io_utils import generar_reporte_carga_masiva
+from utils.df_utils import process_factura_for_display_df, resaltar_filas
+from utils import cache_facturas
+from utils.cache_facturas import CacheIncrementalFacturas
+from utils.perf_utils import perfilar, seccion, perfilar_rerun, mostrar_panel_perfilado
 from dateutil.rrule import rrule, DAILY
 from utils.date_utils import sumar_dias_habiles, calcular_dias_habiles_entre_fechas, parse_date, validate_future_date
 from config.constants import (
@@ -17,8 +24,24 @@ from config.constants import (
 import numpy as np
 
 st.set_page_config(layout="wide")
-db_ops.crear_tablas()
-db_ops.reparar_secuencia_ids()
+
+@st.cache_resource
+def inicializar_esquema():
+    # Una vez por proceso; en despliegues que ya corren `python -m backend.migraciones`
+    # se puede desactivar con DB_MIGRAR_AL_INICIAR=0.
+    return migraciones.aplicar_migraciones()
+
+if os.environ.get("DB_MIGRAR_AL_INICIAR", "1") == "1" and not inicializar_esquema():
+    # Un fallo (bloqueo ocupado, base caída) no se guarda en caché: el próximo rerun reintenta.
+    inicializar_esquema.clear()
+    st.warning("No se pudieron aplicar las migraciones del esquema; se reintentará en la próxima interacción.")
+
+@st.cache_resource
+def iniciar_servidor_metricas(puerto):
+    return instrumentacion.iniciar_servidor_metricas(puerto)
+
+if os.environ.get("METRICAS_PUERTO"):
+    iniciar_servidor_metricas(os.environ["METRICAS_PUERTO"])
 
 if not os.path.exists('data'):
     os.makedirs('data')
@@ -40,6 +63,8 @@ def initialize_session_state():
         st.session_state.refacturar_mode = False
     if 'current_invoice_data' not in st.session_state:
         st.session_state.current_invoice_data = None
+    if 'edicion_original' not in st.session_state:
+        st.session_state.edicion_original = None
     if 'form_key' not in st.session_state:
         st.session_state.form_key = 0
     if 'confirm_delete_id' not in st.session_state:
@@ -53,27 +78,100 @@ def initialize_session_state():
 
 initialize_session_state()
 
+@st.cache_resource(ttl=3600, max_entries=32)
+def get_cache_facturas(search_term, search_column):
+    # Compartido entre sesiones: se refresca con el feed de cambios, no se recarga completo.
+    return CacheIncrementalFacturas(search_term, search_column)
+
+def get_cached_facturas_crudas():
+    cache = get_cache_facturas("", None)
+    cache.obtener()
+    return cache.crudo
+
+FILAS_POR_PAGINA_FACTURAS = 15
+
+@perfilar(categoria="cache")
 @st.cache_data(ttl=60)
-def get_cached_facturas(search_term, search_column):
-    return db_ops.cargar_facturas(search_term, search_column)
+def get_cached_pagina_facturas(search_term, search_column, pagina, filas_por_pagina):
+    return db_ops.cargar_pagina_facturas_por_urgencia(pagina, filas_por_pagina, search_term, search_column)
 
+@perfilar(categoria="cache")
+@st.cache_data(ttl=60)
+def get_cached_ids_pendientes_radicador(search_term, search_column):
+    return db_ops.obtener_ids_pendientes_radicador(search_term, search_column)
+
+@perfilar(categoria="cache")
+@st.cache_data(ttl=600)
+def get_cached_facturas_historico(search_term, search_column):
+    # El histórico solo cambia cuando corre el archivo (backend/archivo.py), no con las escrituras de la app.
+    return db_ops.cargar_facturas_historico(search_term, search_column)
+
+@perfilar(categoria="cache")
 @st.cache_data(ttl=300)
 def get_cached_statistics():
+    conteos = db_ops.ejecutar_en_paralelo({
+        "total_pendientes": db_ops.obtener_conteo_facturas_pendientes_global,
+        "total_lista_para_radicar": db_ops.obtener_conteo_facturas_lista_para_radicar,
+        "total_en_radicador": db_ops.obtener_conteo_facturas_en_radicador,
+        "total_errores": db_ops.obtener_conteo_facturas_con_errores,
+        "total_general": db_ops.obtener_conteo_total_facturas,
+        "total_vencidas": db_ops.obtener_conteo_facturas_vencidas,
+        "stats_por_legalizador_eps": db_ops.obtener_conteo_facturas_por_legalizador_y_eps,
+    })
     return {
-        "total_pendientes": db_ops.obtener_conteo_facturas_pendientes_global() or 0,
-        "total_lista_para_radicar": db_ops.obtener_conteo_facturas_lista_para_radicar() or 0,
-        "total_en_radicador": db_ops.obtener_conteo_facturas_en_radicador() or 0,
-        "total_errores": db_ops.obtener_conteo_facturas_con_errores() or 0,
-        "total_general": db_ops.obtener_conteo_total_facturas() or 0,
-        "stats_por_legalizador_eps": db_ops.obtener_conteo_facturas_por_legalizador_y_eps() or []
+        "total_pendientes": conteos["total_pendientes"] or 0,
+        "total_lista_para_radicar": conteos["total_lista_para_radicar"] or 0,
+        "total_en_radicador": conteos["total_en_radicador"] or 0,
+        "total_errores": conteos["total_errores"] or 0,
+        "total_general": conteos["total_general"] or 0,
+        "total_vencidas": conteos["total_vencidas"] or 0,
+        "stats_por_legalizador_eps": conteos["stats_por_legalizador_eps"] or []
     }
 
+@perfilar(categoria="cache")
+@st.cache_data(ttl=60)
+def get_cached_bandeja(user_role, facturador):
+    return db_ops.cargar_bandeja_trabajo(user_role, facturador)
+
+@perfilar(categoria="cache")
+@st.cache_data(ttl=3600, max_entries=16)
+def get_cached_pareto_tipo_error(desde, hasta, version_datos):
+    # version_datos solo forma parte de la llave: el resultado se reutiliza mientras facturas no cambie.
+    return db_ops.cargar_pareto_tipo_error(desde, hasta)
+
+@perfilar(categoria="cache")
+@st.cache_data(ttl=300)
+def get_cached_sla_auditoria(desde, hasta):
+    return db_ops.cargar_sla_auditoria(desde, hasta)
+
+@perfilar(categoria="cache")
+@st.cache_data(ttl=300)
+def get_cached_resumen_diario(desde, hasta, periodo, dimension):
+    return db_ops.cargar_resumen_diario(desde, hasta, periodo, dimension)
+
+@st.cache_data(ttl=60)
+def get_cached_lotes():
+    return db_ops.obtener_lotes_unicos()
+
+FILAS_POR_PAGINA_AUDITORIA = 50
+COLUMNAS_GRILLA_AUDITORIA = ['ID', 'Número de Factura', 'Área de Servicio', 'Fecha Generación',
+                             'Días Restantes', 'Estado Auditoria']
+
+@perfilar(categoria="cache")
+@st.cache_data(ttl=60)
+def get_cached_lote_auditoria(numero_lote):
+    # Un solo procesamiento por lote; los reruns de la grilla reutilizan el resultado.
+    return _process_factura_for_display_df(db_ops.cargar_facturas_por_lote(numero_lote))
+
 def invalidate_all_caches():
-    get_cached_facturas.clear()
+    cache_facturas.marcar_cambios()
+    get_cached_pagina_facturas.clear()
+    get_cached_ids_pendientes_radicador.clear()
     get_cached_statistics.clear()
-    keys_to_remove = [key for key in st.session_state.keys() if key.startswith('df_cache_')]
-    for key in keys_to_remove:
-        del st.session_state[key]
+    get_cached_resumen_diario.clear()
+    get_cached_lotes.clear()
+    get_cached_bandeja.clear()
+    get_cached_lote_auditoria.clear()
     if 'last_search_tuple' in st.session_state:
         del st.session_state['last_search_tuple']
 
@@ -85,134 +183,8 @@ def get_selectbox_default_index(options_list, current_value):
             pass
     return 0
 
-def _process_factura_for_display_df(df_raw):
-    if df_raw is None or len(df_raw) == 0:
-        return pd.DataFrame(columns=[
-            'ID', 'Lote', 'Área de Servicio', 'Facturador', 'EPS', 'Número de Factura',
-            'Número Reemplazo Factura', 'Fecha Generación', 'Fecha Reemplazo Factura',
-            'Fecha de Entrega', 'Días Restantes', 'Estado', 'Estado Auditoria',
-            'Tipo de Error', 'Observación Auditor', 'Fecha Entrega Radicador'
-        ])
-
-    if not isinstance(df_raw, pd.DataFrame):
-        df = pd.DataFrame(df_raw)
-    else:
-        df = df_raw.copy()
-
-    hoy = pd.Timestamp('today').normalize()
-
-    date_columns = ['fecha_generacion', 'fecha_reemplazo', 'fecha_hora_entrega', 'fecha_entrega_radicador', 'fecha_gen_original_linked']
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce').dt.normalize()
-
-    df['fecha_base_calculo'] = df['fecha_reemplazo'].combine_first(df['fecha_generacion'])
-
-    df['fecha_limite_liquidacion_obj'] = df['fecha_base_calculo'].apply(
-        lambda x: sumar_dias_habiles(x, 21) if not pd.isnull(x) else None
-    )
-
-    def calcular_dias_para_fila(fecha_limite):
-        if pd.isnull(fecha_limite):
-            return None
-
-        print(f"DEBUG: fecha_limite={fecha_limite}, hoy={hoy}")
-
-        try:
-            fecha_limite_date = fecha_limite.date() if hasattr(fecha_limite, 'date') else fecha_limite
-            hoy_date = hoy.date()
-            
-            dias = calcular_dias_habiles_entre_fechas(hoy_date, fecha_limite_date)
-
-            if fecha_limite_date < hoy_date:
-                return -abs(dias)
-            return dias
-
-        except Exception as e:
-            print(f"ERROR en cálculo: {e}")
-            return None
-
-    df['Días Restantes'] = df['fecha_limite_liquidacion_obj'].apply(calcular_dias_para_fila)
-
-    cond_vencidas = (
-        (df['Días Restantes'] < 0) |  # Cualquier valor negativo
-        (df['Días Restantes'].astype(str).str.contains('Refacturar', na=False))  # Incluir textos existentes
-    )
-
-    cond_hoy_vence = (df['Días Restantes'] == 0)
-
-    df.loc[cond_vencidas, 'Días Restantes'] = "Refacturar"
-    df.loc[cond_hoy_vence, 'Días Restantes'] = "Hoy Vence"
-
-    cond_estado_vencidas = (df['Días Restantes'].isin(["Refacturar", "Hoy Vence"]))
-    df.loc[cond_estado_vencidas, 'Estado'] = "Vencidas"
-
-    df['Número de Factura'] = np.where(
-        df['factura_original_id'].notnull(),
-        df['num_fact_original_linked'],
-        df['numero_factura']
-    )
-
-    df['Número Reemplazo Factura'] = np.where(
-        df['factura_original_id'].notnull(),
-        df['numero_factura'],
-        np.where(
-            df['estado'] == 'Reemplazada',
-            df['reemplazada_por_numero_factura'],
-            ""
-        )
-    )
-
-    df['Fecha Generación'] = np.where(
-        df['factura_original_id'].notnull(),
-        df['fecha_gen_original_linked'],
-        df['fecha_generacion']
-    )
-
-    df['Fecha Reemplazo Factura'] = np.where(
-        df['factura_original_id'].notnull(),
-        df['fecha_generacion'].dt.strftime('%Y-%m-%d'),
-        np.where(
-            df['estado'] == 'Reemplazada',
-            df['fecha_reemplazo'].dt.strftime('%Y-%m-%d'),
-            ""
-        )
-    )
-
-    df['Estado'] = np.where(df['factura_original_id'].notnull(), "Reemplazada", df['estado'])
-    df.loc[cond_estado_vencidas, 'Estado'] = "Vencidas"
-
-    df['Fecha Generación'] = df['Fecha Generación'].dt.strftime('%Y-%m-%d').fillna('')
-    df['Fecha de Entrega'] = df['fecha_hora_entrega'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
-    df['Fecha Entrega Radicador'] = df['fecha_entrega_radicador'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
-
-    if 'lote_carga_masiva' in df.columns:
-        df['Lote'] = df['lote_carga_masiva']
-    else:
-        df['Lote'] = None
-
-    df = df.rename(columns={
-        'id': 'ID',
-        'area_servicio': 'Área de Servicio',
-        'facturador': 'Facturador',
-        'eps': 'EPS',
-        'estado_auditoria': 'Estado Auditoria',
-        'tipo_error': 'Tipo de Error',
-        'observacion_auditor': 'Observación Auditor'
-    })
-
-    columnas_finales = [
-        'ID', 'Lote', 'Área de Servicio', 'Facturador', 'EPS', 'Número de Factura',
-        'Número Reemplazo Factura', 'Fecha Generación', 'Fecha Reemplazo Factura',
-        'Fecha de Entrega', 'Días Restantes', 'Estado', 'Estado Auditoria',
-        'Tipo de Error', 'Observación Auditor', 'Fecha Entrega Radicador'
-    ]
-
-    for col in columnas_finales:
-        if col not in df.columns:
-            df[col] = None
-
-    return df[columnas_finales]
+# La transformación vive en utils/df_utils.py para poder medirla fuera de Streamlit (benchmarks/).
+_process_factura_for_display_df = perfilar("_process_factura_for_display_df", "transformacion")(process_factura_for_display_df)
 
 def login_page():
     st.title("Iniciar Sesión - Trazabilidad de Facturas")
@@ -223,11 +195,12 @@ def login_page():
         if submitted:
             user_data = db_ops.obtener_credenciales_usuario(username)
             if user_data:
-                db_password, user_role = user_data
+                db_password, user_role, facturador_usuario = user_data
                 if password == db_password:
                     st.session_state['logged_in'] = True
                     st.session_state['username'] = username
                     st.session_state['user_role'] = user_role
+                    st.session_state['facturador_usuario'] = facturador_usuario
                     st.success(f"Bienvenido, {username}! Tu rol es: {user_role}")
                     st.rerun()
                 else:
@@ -243,10 +216,17 @@ def main_app_page():
         st.session_state.logged_in = False
         st.session_state.username = None
         st.session_state.user_role = None
+        st.session_state.facturador_usuario = None
         st.rerun()
 
-    tab1, tab2, tab3, tab4 = st.tabs(["Ingreso Individual", "Carga Masiva", "Estadísticas", "Auditoría por Lotes"])
+    precargar_consultas_pagina()
 
+    tab_bandeja, tab1, tab2, tab3, tab_analitica, tab4 = st.tabs(
+        ["Mi Bandeja", "Ingreso Individual", "Carga Masiva", "Estadísticas", "Analítica", "Auditoría por Lotes"])
+
+    with tab_bandeja:
+        st.header("Mi Bandeja de Trabajo")
+        display_worklist(user_role)
     with tab1:
         st.header("Ingreso de Factura Individual")
         display_invoice_entry_form(user_role)
@@ -256,6 +236,9 @@ def main_app_page():
     with tab3:
         st.header("Estadísticas por Legalizador y EPS")
         display_statistics()
+    with tab_analitica:
+        st.header("Rendimiento Diario y Tiempos de Entrega")
+        display_analytics()
     with tab4:
         st.header("Auditoría Masiva por Lotes")
         if user_role == 'auditor':
@@ -266,6 +249,33 @@ def main_app_page():
     st.header("Facturas Registradas")
     display_invoice_table(user_role)
 
+def obtener_busqueda_actual():
+    current_search_term = st.session_state.get(f'search_input_widget_{st.session_state.filter_text_key}', '').strip()
+    current_search_criterion = st.session_state.get(f'search_criteria_widget_{st.session_state.filter_select_key}', 'Numero de Factura')
+    db_column_name = {
+        "Numero de Factura": "numero_factura",
+        "Legalizador": "facturador",
+        "EPS": "eps",
+        "Area de Servicio": "area_servicio",
+        "Estado Auditoria": "estado_auditoria"
+    }.get(current_search_criterion)
+    return current_search_term, db_column_name
+
+@perfilar(categoria="cache")
+def precargar_consultas_pagina():
+    # Estadísticas, lotes y página de facturas no dependen entre sí: se calientan sus cachés
+    # a la vez y las secciones de la página las leen después sin esperar a la base.
+    tareas = {"estadisticas": get_cached_statistics, "lotes": get_cached_lotes,
+              "bandeja": (get_cached_bandeja, st.session_state.get('user_role'), st.session_state.get('facturador_usuario'))}
+    current_search_term, db_column_name = obtener_busqueda_actual()
+    # Con la búsqueda sin cambios se conserva la página actual (si cambia, la tabla vuelve a la primera).
+    pagina = (st.session_state.get('current_page', 0)
+              if st.session_state.get('last_search_tuple') == (current_search_term, db_column_name) else 0)
+    tareas["pagina"] = (get_cached_pagina_facturas, current_search_term, db_column_name,
+                        pagina, FILAS_POR_PAGINA_FACTURAS)
+    db_ops.ejecutar_en_paralelo(tareas)
+
+@perfilar()
 def display_invoice_entry_form(user_role):
     current_data = st.session_state.current_invoice_data
     fecha_generacion_val = current_data['fecha_generacion'].strftime('%Y-%m-%d') if current_data and isinstance(current_data.get('fecha_generacion'), date) else ""
@@ -315,30 +325,14 @@ def display_invoice_entry_form(user_role):
             if st.session_state.refacturar_mode:
                 result = guardar_factura_reemplazo_action(st.session_state.editing_factura_id, new_numero_factura, fecha_reemplazo_factura, facturador, eps, area_servicio)
             elif st.session_state.edit_mode:
-                original_data = db_ops.obtener_factura_por_id(st.session_state.editing_factura_id)
-                if original_data:
-                    result = actualizar_factura_action(
-                        st.session_state.editing_factura_id,
-                        numero_factura,
-                        area_servicio,
-                        facturador,
-                        fecha_generacion,
-                        eps,
-                        original_data.get('fecha_hora_entrega'),
-                        original_data.get('tiene_correccion'),
-                        original_data.get('descripcion_devolucion'),
-                        original_data.get('fecha_devolucion_lider'),
-                        original_data.get('revisado'),
-                        original_data.get('factura_original_id'),
-                        original_data.get('estado'),
-                        original_data.get('reemplazada_por_numero_factura'),
-                        original_data.get('estado_auditoria'),
-                        original_data.get('observacion_auditor'),
-                        original_data.get('tipo_error'),
-                        original_data.get('fecha_reemplazo')
-                    )
-                else:
-                    st.error("Error: No se pudo recuperar la factura original para actualizar.")
+                result = actualizar_factura_action(
+                    st.session_state.editing_factura_id,
+                    numero_factura,
+                    area_servicio,
+                    facturador,
+                    fecha_generacion,
+                    eps
+                )
             else:
                 result = guardar_factura_action(facturador, eps, numero_factura, fecha_generacion, area_servicio)
             if result and 'reporte_data' in result:
@@ -369,6 +363,7 @@ def display_invoice_entry_form(user_role):
             del st.session_state.reporte_individual_data
             st.rerun()
 
+@perfilar()
 def display_bulk_load_section():
     if 'reporte_generado' not in st.session_state:
         st.session_state.reporte_generado = None
@@ -379,7 +374,7 @@ def display_bulk_load_section():
     st.subheader("🖨️ Reimprimir Relación por Lote Existente")
 
     try:
-        lotes_existentes = db_ops.obtener_lotes_unicos()
+        lotes_existentes = get_cached_lotes()
     except:
         lotes_existentes = []
 
@@ -462,10 +457,22 @@ def display_bulk_load_section():
             st.write(f"Iniciando carga masiva desde: {uploaded_file.name}")
             st.write(f"Facturador global: {facturador_bulk}, EPS global: {eps_bulk}, Área de Servicio global: {area_servicio_bulk}")
 
-            df_original_para_reporte = df.copy()
+            if area_servicio_bulk in ["Hospitalizacion", "Urgencias"]:
+                estado_auditoria_automatico_masivo = "Lista para Radicar"
+            else:
+                estado_auditoria_automatico_masivo = "Pendiente"
 
-            ids_facturas_creadas = []
+            numeros_csv = [str(numero).strip() for numero in df['Numero de Factura']]
+            try:
+                numeros_existentes = db_ops.obtener_numeros_factura_existentes(
+                    [numero for numero in numeros_csv if numero.isdigit()])
+            except Exception as e:
+                st.error(f"❌ No se pudo verificar duplicados en la base de datos. Motivo: `{e}`")
+                return
 
+            facturas_validas = []
+            indices_validos = []
+            numeros_en_carga = set()
             for index, row in df.iterrows():
                 total_rows += 1
                 numero_factura_csv = str(row['Numero de Factura']).strip()
@@ -475,8 +482,7 @@ def display_bulk_load_section():
                     skipped_count += 1
                     continue
 
-                factura_existente = db_ops.obtener_factura_por_numero(numero_factura_csv)
-                if factura_existente:
+                if numero_factura_csv in numeros_existentes or numero_factura_csv in numeros_en_carga:
                     st.info(f"Fila {index+2}: Factura '{numero_factura_csv}' ya existe. Saltando para evitar duplicados.")
                     skipped_count += 1
                     continue
@@ -485,39 +491,39 @@ def display_bulk_load_section():
                 if fecha_generacion_csv_obj is None or not validate_future_date(fecha_generacion_csv_obj, f"Fecha de Generación (Fila {index+2})"):
                     skipped_count += 1
                     continue
-                fecha_generacion_db = fecha_generacion_csv_obj
-                fecha_hora_entrega_db = datetime.now()
 
-                if area_servicio_bulk in ["Hospitalizacion", "Urgencias"]:
-                    estado_auditoria_automatico_masivo = "Lista para Radicar"
-                else:
-                    estado_auditoria_automatico_masivo = "Pendiente"
-
-                try:
-                    factura_id = db_ops.guardar_factura(
-                        numero_factura=numero_factura_csv,
-                        area_servicio=area_servicio_bulk,
-                        facturador=facturador_bulk,
-                        fecha_generacion=fecha_generacion_db,
-                        eps=eps_bulk,
-                        fecha_hora_entrega=fecha_hora_entrega_db,
-                        estado_auditoria=estado_auditoria_automatico_masivo,
-                        lote_carga_masiva=numero_lote
-                    )
+                numeros_en_carga.add(numero_factura_csv)
+                facturas_validas.append((numero_factura_csv, fecha_generacion_csv_obj))
+                indices_validos.append(index)
 
-                    if factura_id:
-                        ids_facturas_creadas.append(factura_id)
-                        if area_servicio_bulk == "SOAT":
-                            db_ops.guardar_detalles_soat(factura_id, fecha_generacion_db)
-                        inserted_count += 1
-                    else:
-                        skipped_count += 1
-                        st.error(f"Fila {index+2}: Error desconocido al insertar la factura '{numero_factura_csv}'. Saltando.")
+            ids_por_numero = {}
+            error_insercion = False
+            try:
+                ids_por_numero = db_ops.guardar_facturas_masivo(
+                    facturas_validas,
+                    area_servicio=area_servicio_bulk,
+                    facturador=facturador_bulk,
+                    eps=eps_bulk,
+                    estado_auditoria=estado_auditoria_automatico_masivo,
+                    lote_carga_masiva=numero_lote,
+                    fecha_hora_entrega=datetime.now()
+                )
+            except Exception as e:
+                error_insercion = True
+                st.error(f"❌ Error AL INSERTAR las facturas del lote **'{numero_lote}'**. Motivo: `{e}`")
 
-                except Exception as e:
+            ids_facturas_creadas = []
+            indices_insertados = []
+            for index, (numero_factura_csv, _) in zip(indices_validos, facturas_validas):
+                if numero_factura_csv in ids_por_numero:
+                    ids_facturas_creadas.append(ids_por_numero[numero_factura_csv])
+                    indices_insertados.append(index)
+                else:
                     skipped_count += 1
-                    st.error(f"❌ Fila {index+2}: Error AL INSERTAR la factura **'{numero_factura_csv}'**. Motivo: `{e}`")
-                    continue
+                    if not error_insercion:
+                        st.error(f"Fila {index+2}: La factura '{numero_factura_csv}' ya existe con la misma combinación de Legalizador, EPS y Área. Saltando.")
+            inserted_count = len(ids_facturas_creadas)
+            df_original_para_reporte = df.loc[indices_insertados].copy()
 
             if inserted_count > 0:
                 st.success(f"Carga masiva finalizada.\nTotal de filas procesadas: {total_rows}\nFacturas insertadas: {inserted_count}\nFacturas omitidas (duplicadas/errores): {skipped_count}")
@@ -571,11 +577,12 @@ def display_bulk_load_section():
         except Exception as e:
             st.error(f"Error al generar el reporte: {e}")
 
+@perfilar()
 def display_batch_audit_section():
     st.subheader("Seleccionar Lote para Auditar")
 
     try:
-        lotes = db_ops.obtener_lotes_unicos()
+        lotes = get_cached_lotes()
     except Exception as e:
         st.error(f"Error al cargar los lotes: {e}")
         lotes = []
@@ -588,106 +595,121 @@ def display_batch_audit_section():
 
     if lote_seleccionado:
         try:
-            facturas_del_lote = db_ops.cargar_facturas_por_lote(lote_seleccionado)
+            df_lote = get_cached_lote_auditoria(lote_seleccionado)
         except Exception as e:
             st.error(f"Error al cargar las facturas del lote: {e}")
             return
 
-        df_lote = _process_factura_for_display_df(facturas_del_lote)
-
-        if not df_lote.empty:
-            st.success(f"📦 Mostrando {len(df_lote)} facturas del lote: `{lote_seleccionado}`")
-
-            st.write("**🔍 Debug: Estados de Auditoría en este lote:**")
-            conteo_estados = df_lote['Estado Auditoria'].value_counts()
-            st.dataframe(conteo_estados.rename('Cantidad de Facturas'))
-            
-            with st.expander("Ver detalle completo de facturas en el lote"):
-                st.dataframe(df_lote[['ID', 'Número de Factura', 'Estado Auditoria']])
-
-            st.dataframe(df_lote.style.apply(highlight_rows, axis=1), use_container_width=True, hide_index=True)
-
-            st.markdown("---")
-            st.subheader("Acciones de Auditoría Masiva")
-
-            ids_facturas = df_lote['ID'].tolist()
-
-            st.write("**✅ Seleccione las facturas CORRECTAS para marcar como 'Lista para Radicar':**")
-            facturas_para_aprobar = st.multiselect(
-                "Facturas a Aprobar:",
-                options=ids_facturas,
-                format_func=lambda x: f"ID {x} - {df_lote[df_lote['ID']==x]['Número de Factura'].iloc[0]}",
-                key="ms_aprobar"
-            )
+        if df_lote.empty:
+            st.warning("No se encontraron facturas para este lote.")
+            return
 
-            st.write("**❌ Seleccione las facturas con ERRORES para marcar como 'Devuelta por Auditor':**")
-            facturas_para_devolver = st.multiselect(
-                "Facturas a Devolver:",
-                options=[f for f in ids_facturas if f not in facturas_para_aprobar],
-                format_func=lambda x: f"ID {x} - {df_lote[df_lote['ID']==x]['Número de Factura'].iloc[0]}",
-                key="ms_devolver"
+        # Decisiones del auditor por factura: {id: {'Acción', 'Tipo de Error', 'Observación'}}.
+        decisiones = st.session_state.setdefault('auditoria_decisiones', {}).setdefault(lote_seleccionado, {})
+        ids_aprobar = {fid for fid, d in decisiones.items() if d['Acción'] == 'Aprobar'}
+        ids_devolver = {fid for fid, d in decisiones.items() if d['Acción'] == 'Devolver'}
+
+        st.success(f"📦 Lote `{lote_seleccionado}`: {len(df_lote)} facturas")
+        conteo_estados = df_lote['Estado Auditoria'].value_counts()
+        st.caption(" · ".join(f"{estado}: {cantidad}" for estado, cantidad in conteo_estados.items()))
+        # Se llena después de la grilla, para contar también lo editado en este rerun.
+        col_aprobar, col_devolver, col_sin_decision = st.columns(3)
+
+        filtro = st.radio("Mostrar:", ["Todas", "Sin decisión", "Para aprobar", "Para devolver"],
+                          horizontal=True, key=f"filtro_auditoria_{lote_seleccionado}")
+        con_decision = df_lote['ID'].isin(ids_aprobar | ids_devolver)
+        vista = {
+            "Todas": df_lote,
+            "Sin decisión": df_lote[~con_decision],
+            "Para aprobar": df_lote[df_lote['ID'].isin(ids_aprobar)],
+            "Para devolver": df_lote[df_lote['ID'].isin(ids_devolver)],
+        }[filtro]
+
+        clave_pagina = f"pagina_auditoria_{lote_seleccionado}_{filtro}"
+        total_paginas = max(1, (len(vista) + FILAS_POR_PAGINA_AUDITORIA - 1) // FILAS_POR_PAGINA_AUDITORIA)
+        pagina = min(st.session_state.get(clave_pagina, 0), total_paginas - 1)
+        inicio = pagina * FILAS_POR_PAGINA_AUDITORIA
+        pagina_df = vista.iloc[inicio:inicio + FILAS_POR_PAGINA_AUDITORIA][COLUMNAS_GRILLA_AUDITORIA].copy()
+        for columna in ('Acción', 'Tipo de Error', 'Observación'):
+            pagina_df[columna] = [decisiones.get(fid, {}).get(columna) for fid in pagina_df['ID']]
+
+        with seccion("grilla auditoría lote", "styler"):
+            editado = st.data_editor(
+                pagina_df,
+                key=f"editor_auditoria_{lote_seleccionado}_{filtro}_{pagina}_{st.session_state.get('auditoria_version', 0)}",
+                hide_index=True,
+                use_container_width=True,
+                disabled=COLUMNAS_GRILLA_AUDITORIA,
+                column_config={
+                    'Acción': st.column_config.SelectboxColumn("Acción", options=["Aprobar", "Devolver"]),
+                    'Tipo de Error': st.column_config.SelectboxColumn("Tipo de Error", options=TIPO_ERROR_OPCIONES[1:]),
+                    'Observación': st.column_config.TextColumn("Observación", max_chars=500),
+                },
             )
+        for fila in editado.itertuples(index=False):
+            factura_id, accion, tipo_error, observacion = int(fila[0]), fila[-3], fila[-2], fila[-1]
+            if accion or tipo_error or observacion:
+                decisiones[factura_id] = {'Acción': accion, 'Tipo de Error': tipo_error, 'Observación': observacion}
+            else:
+                decisiones.pop(factura_id, None)
+        acciones = [d['Acción'] for d in decisiones.values()]
+        col_aprobar.metric("✅ Para aprobar", acciones.count('Aprobar'))
+        col_devolver.metric("❌ Para devolver", acciones.count('Devolver'))
+        col_sin_decision.metric("Sin decisión", len(df_lote) - acciones.count('Aprobar') - acciones.count('Devolver'))
 
-            st.write(f"Facturas seleccionadas para devolver: {facturas_para_devolver}")
-            st.write(f"Longitud de facturas_para_devolver: {len(facturas_para_devolver)}")
+        col_prev, col_info, col_next = st.columns([1, 3, 1])
+        with col_prev:
+            if st.button("⏪ Anterior", key="auditoria_anterior", disabled=pagina == 0):
+                st.session_state[clave_pagina] = pagina - 1
+                st.rerun()
+        with col_info:
+            st.markdown(f"**Página {pagina + 1} de {total_paginas}** | {len(vista)} facturas")
+        with col_next:
+            if st.button("Siguiente ⏩", key="auditoria_siguiente", disabled=pagina >= total_paginas - 1):
+                st.session_state[clave_pagina] = pagina + 1
+                st.rerun()
 
-            observaciones_individuales = {}
-            tipos_error_individuales = {}
+        col_pagina, col_limpiar = st.columns(2)
+        with col_pagina:
+            if st.button("✅ Aprobar las facturas sin decisión de esta página", use_container_width=True):
+                for fid in pagina_df['ID'].tolist():
+                    decisiones.setdefault(fid, {'Acción': 'Aprobar', 'Tipo de Error': None, 'Observación': None})
+                st.session_state['auditoria_version'] = st.session_state.get('auditoria_version', 0) + 1
+                st.rerun()
+        with col_limpiar:
+            if st.button("🧹 Limpiar decisiones del lote", use_container_width=True):
+                decisiones.clear()
+                st.session_state['auditoria_version'] = st.session_state.get('auditoria_version', 0) + 1
+                st.rerun()
 
-            if facturas_para_devolver:
-                st.markdown("---")
-                st.write("**📝 Especificar motivo de devolución por factura:**")
-
-                for factura_id in facturas_para_devolver:
-                    factura_info = df_lote[df_lote['ID'] == factura_id].iloc[0]
-                    with st.expander(f"🚨 Factura ID: {factura_id} - {factura_info['Número de Factura']}", expanded=False):
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            tipos_error_individuales[factura_id] = st.selectbox(
-                                "Tipo de Error:",
-                                options=TIPO_ERROR_OPCIONES[1:],
-                                key=f"tipo_error_{factura_id}"
-                            )
-                        with col2:
-                            observaciones_individuales[factura_id] = st.text_area(
-                                "Observación específica:",
-                                value="",
-                                placeholder="Describa el error específico de esta factura...",
-                                key=f"obs_individual_{factura_id}"
-                            )
-
-            if st.button("🔥 Aplicar Auditoría Masiva", type="primary", use_container_width=True):
-                if facturas_para_aprobar or facturas_para_devolver:
-                    if facturas_para_aprobar:
-                        for fid in facturas_para_aprobar:
-                            db_ops.actualizar_estado_auditoria_factura(fid, "Lista para Radicar", None, None)
-                        st.success(f"✅ {len(facturas_para_aprobar)} facturas aprobadas.")
-
-                    if facturas_para_devolver:
-                        devueltas_exitosas = 0
-                        for fid in facturas_para_devolver:
-                            if not tipos_error_individuales.get(fid):
-                                st.error(f"Debe seleccionar un tipo de error para la factura ID: {fid}")
-                                continue
-
-                            observacion = observaciones_individuales.get(fid) or "Revisión masiva - Error detectado"
-                            success = db_ops.actualizar_estado_auditoria_factura(
-                                fid, 
-                                "Devuelta por Auditor", 
-                                observacion,
-                                tipos_error_individuales.get(fid)
-                            )
-                            if success:
-                                devueltas_exitosas += 1
-                        st.success(f"❌ {devueltas_exitosas} facturas devueltas.")
-                    st.balloons()
-                    invalidate_all_caches()
-                    st.rerun()
-                else:
-                    st.warning("Selecciona al menos una factura para aprobar o devolver.")
-        else:
-            st.warning("No se encontraron facturas para este lote.")
+        st.markdown("---")
+        if st.button("🔥 Aplicar Auditoría Masiva", type="primary", use_container_width=True):
+            ids_aprobar = [fid for fid, d in decisiones.items() if d['Acción'] == 'Aprobar']
+            por_devolver = {fid: d for fid, d in decisiones.items() if d['Acción'] == 'Devolver'}
+            if not ids_aprobar and not por_devolver:
+                st.warning("Marque al menos una factura para aprobar o devolver.")
+                return
+            sin_tipo = [fid for fid, d in por_devolver.items() if not d['Tipo de Error']]
+            if sin_tipo:
+                indice_lote = df_lote.set_index('ID')
+                numeros = ", ".join(str(indice_lote.at[fid, 'Número de Factura']) for fid in sin_tipo[:20])
+                st.error(f"Seleccione el tipo de error de las {len(sin_tipo)} facturas a devolver que no lo tienen: {numeros}")
+                return
+            devoluciones = [(fid, d['Tipo de Error'], d['Observación'] or "Revisión masiva - Error detectado")
+                            for fid, d in por_devolver.items()]
+
+            aprobadas, devueltas_exitosas = db_ops.aplicar_auditoria_masiva(ids_aprobar, devoluciones)
+            if ids_aprobar:
+                st.success(f"✅ {aprobadas} facturas aprobadas.")
+            if devoluciones:
+                st.success(f"❌ {devueltas_exitosas} facturas devueltas.")
+            st.balloons()
+            st.session_state['auditoria_decisiones'].pop(lote_seleccionado, None)
+            st.session_state['auditoria_version'] = st.session_state.get('auditoria_version', 0) + 1
+            invalidate_all_caches()
+            st.rerun()
 
+@perfilar()
 def display_statistics():
     st.subheader("Estadísticas Generales de Facturas")
     stats_data = get_cached_statistics()
@@ -706,10 +728,7 @@ def display_statistics():
         st.metric(label="Facturas Lista para Radicar", value=total_lista_para_radicar)
         st.metric(label="Facturas con Errores", value=total_errores)
     with col3:
-        facturas_raw_for_vencidas = get_cached_facturas(search_term="", search_column="")
-        processed_facturas_df = _process_factura_for_display_df(facturas_raw_for_vencidas)
-        total_vencidas = (processed_facturas_df["Días Restantes"] == "Refacturar").sum()
-        st.metric(label="Facturas Vencidas (Refacturar)", value=total_vencidas)
+        st.metric(label="Facturas Vencidas (Refacturar)", value=stats_data["total_vencidas"])
     st.metric(label="Total General de Facturas", value=total_general)
     st.markdown("---")
     st.subheader("Conteo por Legalizador y EPS (Facturas Pendientes)")
@@ -718,39 +737,156 @@ def display_statistics():
     else:
         st.info("No hay estadísticas disponibles de facturas pendientes.")
 
-def highlight_rows(row):
-    columns_to_colorize = [
-        'Días Restantes',
-        'Estado',
-        'Estado Auditoria',
-        'Tipo de Error',
-        'Observación Auditor'
-    ]
-    styles_list = [''] * len(row)
-
-    base_color = ''
-    if row["Estado Auditoria"] == 'Devuelta por Auditor':
-        base_color = 'background-color: lightblue'
-    elif row["Estado Auditoria"] == 'Corregida por Legalizador':
-        base_color = 'background-color: lightsalmon'
-    elif row["Días Restantes"] == "Refacturar":
-        base_color = 'background-color: salmon'
+PERIODOS_ANALITICA = {"Día": "day", "Semana": "week", "Mes": "month", "Año": "year"}
+DIMENSIONES_ANALITICA = {"Total": None, "Legalizador": "facturador", "EPS": "eps", "Área de Servicio": "area_servicio"}
+METRICAS_ANALITICA = {"Ingresadas": "ingresadas", "Auditadas": "auditadas", "Devueltas": "devueltas",
+                      "Entregadas al Radicador": "entregadas", "Días promedio hasta entrega": "dias_promedio"}
+
+@perfilar()
+def display_analytics():
+    # Se lee del resumen diario (mantenido por triggers), no de facturas: años de rango son pocas filas.
+    col_rango, col_periodo, col_dimension, col_metrica = st.columns([2, 1, 1, 2])
+    with col_rango:
+        rango = st.date_input("Rango de fechas:", value=(date.today() - timedelta(days=365), date.today()),
+                              key="analitica_rango")
+    with col_periodo:
+        periodo = st.selectbox("Agrupar por:", options=list(PERIODOS_ANALITICA), index=2, key="analitica_periodo")
+    with col_dimension:
+        dimension = st.selectbox("Desglose:", options=list(DIMENSIONES_ANALITICA), key="analitica_dimension")
+    with col_metrica:
+        metrica = st.selectbox("Indicador:", options=list(METRICAS_ANALITICA), key="analitica_metrica")
+
+    if not isinstance(rango, (tuple, list)) or len(rango) != 2:
+        st.info("Seleccione la fecha inicial y final del rango.")
+        return
+    display_sla_auditoria(rango[0], rango[1])
+    st.markdown("---")
+    display_pareto_tipo_error(rango[0], rango[1])
+    st.markdown("---")
+
+    filas = get_cached_resumen_diario(rango[0], rango[1], PERIODOS_ANALITICA[periodo], DIMENSIONES_ANALITICA[dimension])
+    if not filas:
+        st.info("No hay actividad registrada en el rango seleccionado.")
+        return
+
+    df_resumen = pd.DataFrame(filas)
+    totales = df_resumen[['ingresadas', 'auditadas', 'devueltas', 'entregadas', 'dias_entrega_suma']].sum()
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Ingresadas", int(totales['ingresadas']))
+    col2.metric("Auditadas", int(totales['auditadas']))
+    col3.metric("Devueltas", int(totales['devueltas']))
+    col4.metric("Entregadas", int(totales['entregadas']))
+    promedio_total = totales['dias_entrega_suma'] / totales['entregadas'] if totales['entregadas'] else 0
+    col5.metric("Días promedio a entrega", f"{promedio_total:.1f}")
+
+    columna = METRICAS_ANALITICA[metrica]
+    if columna == 'dias_promedio':
+        sumas = df_resumen.pivot_table(index='periodo', columns='grupo', values='dias_entrega_suma', aggfunc='sum')
+        entregadas = df_resumen.pivot_table(index='periodo', columns='grupo', values='entregadas', aggfunc='sum')
+        serie = (sumas / entregadas.where(entregadas > 0)).round(1)
     else:
-        try:
-            dias_restantes_num = int(row["Días Restantes"])
-            if 1 <= dias_restantes_num <= 3:
-                base_color = 'background-color: yellow'
-            elif dias_restantes_num > 3:
-                base_color = 'background-color: lightgreen'
-        except (ValueError, TypeError):
-            pass
+        serie = df_resumen.pivot_table(index='periodo', columns='grupo', values=columna, aggfunc='sum').fillna(0)
+    serie.index = pd.to_datetime(serie.index)
+    st.line_chart(serie)
+
+    with st.expander("Ver datos"):
+        st.dataframe(df_resumen.rename(columns={
+            'periodo': 'Período', 'grupo': dimension, 'ingresadas': 'Ingresadas', 'auditadas': 'Auditadas',
+            'devueltas': 'Devueltas', 'entregadas': 'Entregadas', 'dias_entrega_suma': 'Días hasta entrega (suma)'}),
+            use_container_width=True, hide_index=True)
+
+AGRUPACIONES_PARETO = {"Total": "total", "EPS": "eps", "Legalizador": "facturador",
+                       "Área de Servicio": "area_servicio", "Mes de Generación": "mes"}
+
+def _grafico_pareto(df_grupo):
+    df_grafico = df_grupo.set_index('tipo_error')[['devoluciones']].rename(columns={'devoluciones': 'Devoluciones'})
+    st.bar_chart(df_grafico)
+    st.dataframe(df_grupo[['tipo_error', 'devoluciones', 'participacion', 'acumulado']].rename(columns={
+        'tipo_error': 'Tipo de Error', 'devoluciones': 'Devoluciones',
+        'participacion': 'Participación', 'acumulado': 'Acumulado'}).style.format(
+        {'Participación': '{:.1%}', 'Acumulado': '{:.1%}'}), use_container_width=True, hide_index=True)
+
+def display_pareto_tipo_error(desde, hasta):
+    st.subheader("Devoluciones por Tipo de Error (Pareto)")
+    st.caption("Facturas activas y archivadas con tipo de error registrado, por mes de generación.")
+    filas = get_cached_pareto_tipo_error(desde, hasta, db_ops.obtener_version_datos_facturas())
+    if not filas:
+        st.info("No hay devoluciones con tipo de error en el rango seleccionado.")
+        return
+    df_pareto = pd.DataFrame(filas)
+    df_pareto[['participacion', 'acumulado']] = df_pareto[['participacion', 'acumulado']].astype(float)
+
+    col_agrupacion, col_valor, col_detalle = st.columns(3)
+    with col_agrupacion:
+        etiqueta = st.selectbox("Ver por:", options=list(AGRUPACIONES_PARETO), key="pareto_agrupacion")
+    agrupacion = AGRUPACIONES_PARETO[etiqueta]
+    df_grupo = df_pareto[df_pareto['agrupacion'] == agrupacion]
+    if agrupacion == 'total':
+        _grafico_pareto(df_grupo)
+        return
 
-    for i, col_name in enumerate(row.index):
-        if col_name in columns_to_colorize:
-            styles_list[i] = base_color
-            
-    return styles_list
+    # Qué EPS, legalizadores, áreas o meses acumulan más devoluciones, de mayor a menor.
+    totales = (df_grupo.fillna({agrupacion: '(sin dato)'})
+               .groupby(agrupacion)['devoluciones'].sum().sort_values(ascending=False))
+    st.bar_chart(totales.rename("Devoluciones"))
+    with col_valor:
+        valor = st.selectbox(f"{etiqueta}:", options=totales.index.tolist(), key="pareto_valor")
+    df_grupo = df_grupo.fillna({agrupacion: '(sin dato)'})
+    df_valor = df_grupo[df_grupo[agrupacion] == valor]
+
+    if agrupacion == 'eps':
+        # Detalle: legalizadores de la EPS elegida (conjunto eps + legalizador de la misma consulta).
+        df_detalle = df_pareto[(df_pareto['agrupacion'] == 'eps_facturador')].fillna(
+            {'eps': '(sin dato)', 'facturador': '(sin dato)'})
+        df_detalle = df_detalle[df_detalle['eps'] == valor]
+        legalizadores = ["Todos"] + sorted(df_detalle['facturador'].unique().tolist())
+        with col_detalle:
+            legalizador = st.selectbox("Legalizador:", options=legalizadores, key="pareto_detalle")
+        if legalizador != "Todos":
+            df_valor = df_detalle[df_detalle['facturador'] == legalizador]
+
+    _grafico_pareto(df_valor)
+
+def display_sla_auditoria(desde, hasta):
+    st.subheader("Tiempos de Ciclo de Auditoría (horas)")
+    st.caption("Tramos iniciados en el rango; los abiertos aún no llegan a su hito final.")
+    tramos = get_cached_sla_auditoria(desde, hasta + timedelta(days=1))
+    if not tramos:
+        st.info("No hay eventos de auditoría registrados en el rango seleccionado.")
+        return
+    df_sla = pd.DataFrame(tramos).rename(columns={
+        'tramo': 'Tramo', 'completados': 'Completados', 'abiertos': 'Abiertos', 'p50_horas': 'Mediana',
+        'p90_horas': 'P90', 'p95_horas': 'P95', 'max_horas': 'Máximo'})
+    st.dataframe(df_sla.round(1), use_container_width=True, hide_index=True)
+
+@perfilar()
+def display_worklist(user_role):
+    facturador_usuario = st.session_state.get('facturador_usuario')
+    if user_role == 'legalizador':
+        alcance = facturador_usuario or "todos los legalizadores"
+        st.caption(f"Facturas devueltas por auditoría y facturas que vencen en los próximos "
+                   f"{db_ops.DIAS_HABILES_ALERTA_VENCIMIENTO} días hábiles ({alcance}).")
+    elif user_role == 'auditor':
+        st.caption("Facturas pendientes de auditoría y corregidas por el legalizador, más urgentes primero.")
+    else:
+        st.info("Su rol no tiene bandeja de trabajo.")
+        return
 
+    facturas_bandeja = get_cached_bandeja(user_role, facturador_usuario)
+    if not facturas_bandeja:
+        st.success("🎉 No tiene facturas pendientes de acción.")
+        return
+
+    df_bandeja = _process_factura_for_display_df(facturas_bandeja)
+    if len(df_bandeja) >= db_ops.LIMITE_BANDEJA:
+        st.warning(f"Se muestran las {db_ops.LIMITE_BANDEJA} facturas más urgentes; atiéndalas para ver las siguientes.")
+    else:
+        st.write(f"**{len(df_bandeja)} facturas requieren su atención.**")
+    with seccion("estilos bandeja", "styler"):
+        st.dataframe(resaltar_filas(df_bandeja), use_container_width=True, hide_index=True)
+    st.caption("Use el ID en \"Facturas Registradas\" para cargar una factura y actuar sobre ella.")
+
+@perfilar()
 def display_invoice_table(user_role):
     col_search, col_criteria = st.columns([3, 2])
     with col_search:
@@ -758,56 +894,35 @@ def display_invoice_table(user_role):
     with col_criteria:
         options_criteria = ["Numero de Factura", "Legalizador", "EPS", "Area de Servicio", "Estado Auditoria"]
         search_criterion_selectbox = st.selectbox("Buscar por:", options=options_criteria, index=0, key=f"search_criteria_widget_{st.session_state.filter_select_key}")
+    incluir_historico = st.checkbox("Incluir histórico (facturas radicadas archivadas)", key="incluir_historico")
 
-    current_search_term = st.session_state.get(f'search_input_widget_{st.session_state.filter_text_key}', '').strip()
-    current_search_criterion = st.session_state.get(f'search_criteria_widget_{st.session_state.filter_select_key}', 'Numero de Factura')
-    db_column_name = {
-        "Numero de Factura": "numero_factura",
-        "Legalizador": "facturador",
-        "EPS": "eps",
-        "Area de Servicio": "area_servicio",
-        "Estado Auditoria": "estado_auditoria"
-    }.get(current_search_criterion)
+    current_search_term, db_column_name = obtener_busqueda_actual()
 
-    cache_key = f"df_cache_{current_search_term}_{db_column_name}"
     current_search_tuple = (current_search_term, db_column_name)
-
-    if (cache_key not in st.session_state or
-        st.session_state.get('last_search_tuple') != current_search_tuple):
-
-        facturas_raw = get_cached_facturas(search_term=current_search_term,
-                                           search_column=db_column_name)
-        st.session_state[cache_key] = _process_factura_for_display_df(facturas_raw.copy())
+    if st.session_state.get('last_search_tuple') != current_search_tuple:
         st.session_state['last_search_tuple'] = current_search_tuple
         st.session_state['current_page'] = 0  # Resetear a primera página al buscar nuevo término
 
-    df_facturas = st.session_state[cache_key]
-
-    rows_per_page = 15
-    total_rows = len(df_facturas)
-    total_pages = max(1, (total_rows + rows_per_page - 1) // rows_per_page)
-
+    # La página se pide ya ordenada por urgencia global: lo más urgente está siempre en la primera página.
+    rows_per_page = FILAS_POR_PAGINA_FACTURAS
     if 'current_page' not in st.session_state:
         st.session_state.current_page = 0
-    else:
-        st.session_state.current_page = max(0, min(st.session_state.current_page, total_pages - 1))
+    facturas_pagina, total_rows = get_cached_pagina_facturas(current_search_term, db_column_name,
+                                                             st.session_state.current_page, rows_per_page)
+    total_pages = max(1, (total_rows + rows_per_page - 1) // rows_per_page)
+    if st.session_state.current_page > total_pages - 1:
+        st.session_state.current_page = total_pages - 1
+        facturas_pagina, total_rows = get_cached_pagina_facturas(current_search_term, db_column_name,
+                                                                 st.session_state.current_page, rows_per_page)
 
-    if not df_facturas.empty:
+    if facturas_pagina:
         start_idx = st.session_state.current_page * rows_per_page
         end_idx = min(start_idx + rows_per_page, total_rows)
-        df_page = df_facturas.iloc[start_idx:end_idx].copy()
+        df_page = _process_factura_for_display_df(facturas_pagina)
 
-        df_page['sort_key'] = df_page.apply(
-            lambda row: 1 if row["Estado Auditoria"] == 'Devuelta por Auditor'
-            else 2 if row["Estado Auditoria"] == 'Corregida por Legalizador'
-            else 3 if row["Días Restantes"] == "Refacturar"
-            else 4, axis=1
-        )
-        df_page = df_page.sort_values(by=['sort_key', 'Fecha Generación'], ascending=[True, False])
-        df_page = df_page.drop(columns=['sort_key'])
-
-        st.dataframe(df_page.style.apply(highlight_rows, axis=1),
-                     use_container_width=True, hide_index=True)
+        with seccion("estilos tabla", "styler"):
+            st.dataframe(resaltar_filas(df_page),
+                         use_container_width=True, hide_index=True)
 
         col_prev, col_page_info, col_next = st.columns([1, 3, 1])
         with col_prev:
@@ -816,6 +931,9 @@ def display_invoice_table(user_role):
                 st.rerun()
         with col_page_info:
             st.markdown(f"**Página {st.session_state.current_page + 1} de {total_pages}** | **Filas: {start_idx + 1}-{end_idx} de {total_rows}**")
+            inicio_periodo = db_ops.inicio_periodo_activo()
+            if not current_search_term and inicio_periodo:
+                st.caption(f"Facturas generadas desde el {inicio_periodo:%d/%m/%Y}; use la búsqueda para encontrar las anteriores.")
         with col_next:
             if st.button("Siguiente ⏩", disabled=(st.session_state.current_page >= total_pages - 1)):
                 st.session_state.current_page += 1
@@ -823,14 +941,19 @@ def display_invoice_table(user_role):
     else:
         st.info("No hay facturas registradas que coincidan con los criterios de búsqueda.")
 
-    if not df_facturas.empty and user_role == 'auditor':
+    if incluir_historico:
+        facturas_historico = get_cached_facturas_historico(current_search_term, db_column_name)
+        st.markdown(f"### 🗄️ Histórico ({len(facturas_historico)} facturas archivadas)")
+        if facturas_historico:
+            st.dataframe(_process_factura_for_display_df(facturas_historico),
+                         use_container_width=True, hide_index=True)
+        else:
+            st.info("No hay facturas archivadas que coincidan con los criterios de búsqueda.")
+
+    if total_rows and user_role == 'auditor':
         st.markdown("### 📦 Entrega Masiva al Radicador")
 
-        selectable_ids = df_facturas.loc[
-            (df_facturas['Estado Auditoria'].isin(['Lista para Radicar', 'En Radicador'])) &
-            (df_facturas['Fecha Entrega Radicador'].isna() | (df_facturas['Fecha Entrega Radicador'] == '')),
-            'ID'
-        ].tolist()
+        selectable_ids = get_cached_ids_pendientes_radicador(current_search_term, db_column_name)
 
         if selectable_ids:
             with st.form("entrega_masiva_form"):
@@ -844,17 +967,11 @@ def display_invoice_table(user_role):
 
                 if submitted and selected_ids:
                     fecha_entrega = datetime.now()
-                    entregadas_count = 0
-                    for factura_id in selected_ids:
-                        success = db_ops.actualizar_fecha_entrega_radicador(factura_id, fecha_entrega)
-                        if success:
-                            entregadas_count += 1
+                    entregadas_count = db_ops.entregar_facturas_radicador(selected_ids, fecha_entrega)
 
                     if entregadas_count > 0:
                         st.success(f"✅ {entregadas_count} facturas entregadas al radicador!")
                         invalidate_all_caches()
-                        if cache_key in st.session_state:
-                            del st.session_state[cache_key]
                         st.rerun()
                     else:
                         st.error("❌ No se pudieron entregar las facturas.")
@@ -865,9 +982,13 @@ def display_invoice_table(user_role):
     with col_export:
         if st.button("Exportar a CSV"):
             try:
-                facturas_originales = get_cached_facturas("", "")
+                facturas_originales = get_cached_facturas_crudas()
 
                 df_compatible = pd.DataFrame(facturas_originales)
+                if incluir_historico:
+                    # Como el listado activo, la exportación incluye todo el histórico sin filtrar.
+                    df_compatible = pd.concat([df_compatible, pd.DataFrame(get_cached_facturas_historico("", None))],
+                                              ignore_index=True)
 
                 columnas_compatibles = [
                     'id', 'numero_factura', 'area_servicio', 'facturador', 'fecha_generacion', 
@@ -908,12 +1029,20 @@ def display_invoice_table(user_role):
                     st.rerun()
                     
             with col_refacturar:
-                if selected_invoice_id in df_facturas['ID'].values:
-                    dias_restantes_df = df_facturas[df_facturas['ID'] == selected_invoice_id]['Días Restantes'].iloc[0]
-                    if dias_restantes_df == "Refacturar":
-                        if st.button("Refacturar", key="refacturar_button"):
-                            cargar_factura_para_refacturar_action(selected_invoice_id)
-                            st.rerun()
+                dias_restantes = _process_factura_for_display_df([factura_data_for_action])['Días Restantes'].iloc[0]
+                if dias_restantes == "Refacturar":
+                    if st.button("Refacturar", key="refacturar_button"):
+                        cargar_factura_para_refacturar_action(selected_invoice_id)
+                        st.rerun()
+
+            with st.expander("Historial de la factura"):
+                eventos = db_ops.obtener_eventos_factura(selected_invoice_id)
+                if eventos:
+                    st.dataframe(pd.DataFrame(eventos).rename(columns={
+                        'tipo': 'Evento', 'estado_anterior': 'Estado Anterior', 'estado_nuevo': 'Estado Nuevo',
+                        'ocurrido_en': 'Fecha', 'usuario': 'Usuario'}), use_container_width=True, hide_index=True)
+                else:
+                    st.info("No hay eventos registrados para esta factura.")
 
             if user_role == 'auditor':
                 st.markdown("---")
@@ -985,8 +1114,6 @@ def display_invoice_table(user_role):
                                 st.success(f"Factura ID: {selected_invoice_id} eliminada correctamente.")
                                 st.session_state.confirm_delete_id = None
                                 invalidate_all_caches()
-                                if cache_key in st.session_state:
-                                    del st.session_state[cache_key]
                                 cancelar_edicion_action()
                             else: 
                                 st.error("No se pudo eliminar la factura.")
@@ -1012,11 +1139,6 @@ def guardar_factura_action(facturador, eps, numero_factura, fecha_generacion_str
         st.error("El campo 'Número de Factura' debe contener solo números.")
         return None
     
-    factura_existente = db_ops.obtener_factura_por_numero(numero_factura)
-    if factura_existente:
-        st.error(f"Error: La factura con el número '{numero_factura}' ya existe en la base de datos.")
-        return None
-
     fecha_generacion_obj = parse_date(fecha_generacion_str, "Fecha de Generación")
     if fecha_generacion_obj is None:
         return None
@@ -1030,7 +1152,7 @@ def guardar_factura_action(facturador, eps, numero_factura, fecha_generacion_str
     else:
         estado_auditoria_automatico = "Pendiente"
 
-    factura_id = db_ops.guardar_factura(
+    resultado, factura_data = db_ops.crear_factura(
         numero_factura=numero_factura,
         area_servicio=area_servicio,
         facturador=facturador,
@@ -1040,36 +1162,29 @@ def guardar_factura_action(facturador, eps, numero_factura, fecha_generacion_str
         estado_auditoria=estado_auditoria_automatico
     )
 
-    if factura_id:
-        if area_servicio == "SOAT":
-            db_ops.guardar_detalles_soat(factura_id, fecha_generacion_db)
-        factura_data = db_ops.obtener_factura_por_id(factura_id)
-        if factura_data:
-            reporte_data = {
-                'facturador': facturador,
-                'eps': eps,
-                'area_servicio': area_servicio,
-                'factura_data': factura_data,
-                'numero_factura': numero_factura,
-                'factura_id': factura_id
-            }
-
-            st.success(f"Factura guardada correctamente. Estado: {estado_auditoria_automatico}")
-            invalidate_all_caches()
-            cancelar_edicion_action()
+    if resultado == 'creada':
+        reporte_data = {
+            'facturador': facturador,
+            'eps': eps,
+            'area_servicio': area_servicio,
+            'factura_data': factura_data,
+            'numero_factura': numero_factura,
+            'factura_id': factura_data['id']
+        }
+
+        st.success(f"Factura guardada correctamente. Estado: {estado_auditoria_automatico}")
+        invalidate_all_caches()
+        cancelar_edicion_action()
 
-            return {'success': True, 'reporte_data': reporte_data}
-        else:
-            st.error("Error: No se pudieron obtener los datos de la factura guardada.")
-            return None
+        return {'success': True, 'reporte_data': reporte_data}
+    elif resultado == 'duplicada':
+        st.error(f"Error: La factura con el número '{numero_factura}' ya existe en la base de datos.")
+        return None
     else:
-        st.error(f"Error al guardar la factura. Esto puede ocurrir si el número de factura ya existe. Por favor, verifique y vuelva a intentarlo.")
+        st.error("Error al guardar la factura. Por favor, verifique los datos y vuelva a intentarlo.")
         return None
 
-def actualizar_factura_action(factura_id, numero_factura, area_servicio, facturador, fecha_generacion_str, eps,
-                             fecha_hora_entrega, tiene_correccion, descripcion_devolucion,
-                             fecha_devolucion_lider, revisado, factura_original_id, estado,
-                             reemplazada_por_numero_factura, estado_auditoria, observacion_auditor, tipo_error, fecha_reemplazo):
+def actualizar_factura_action(factura_id, numero_factura, area_servicio, facturador, fecha_generacion_str, eps):
     if not all([factura_id, numero_factura, area_servicio, facturador, fecha_generacion_str, eps]):
         st.error("Todos los campos son obligatorios para la actualización.")
         return None
@@ -1081,37 +1196,61 @@ def actualizar_factura_action(factura_id, numero_factura, area_servicio, factura
         return None
     if not validate_future_date(fecha_generacion_obj, "Fecha de Generación"): 
         return None
-    fecha_generacion_db = fecha_generacion_obj
-    success = db_ops.actualizar_factura(
-        factura_id, numero_factura, area_servicio, facturador, fecha_generacion_db, eps,
-        fecha_hora_entrega, tiene_correccion, descripcion_devolucion,
-        fecha_devolucion_lider, revisado, factura_original_id, estado,
-        reemplazada_por_numero_factura, estado_auditoria, observacion_auditor, tipo_error, fecha_reemplazo
-    )
-    if success:
-        factura_data = db_ops.obtener_factura_por_id(factura_id)
-        
-        if factura_data:
-            reporte_data = {
-                'facturador': facturador,
-                'eps': eps,
-                'area_servicio': area_servicio,
-                'factura_data': factura_data,
-                'numero_factura': numero_factura,
-                'factura_id': factura_id,
-                'tipo': 'actualizacion'
-            }
-            
-            st.success("Factura actualizada correctamente.")
-            invalidate_all_caches()
-            cancelar_edicion_action()
-            
-            return {'success': True, 'reporte_data': reporte_data}
-        else:
-            st.error("Error: No se pudieron obtener los datos actualizados de la factura.")
-            return None
+    original_data = st.session_state.get('edicion_original')
+    if not original_data or original_data.get('id') != factura_id:
+        st.error("Error: No se encontraron los datos con los que se cargó la factura. Vuelva a cargarla para edición.")
+        return None
+
+    # Solo se envían los campos del formulario que cambiaron respecto a lo que se cargó.
+    valores_formulario = {
+        'numero_factura': numero_factura,
+        'area_servicio': area_servicio,
+        'facturador': facturador,
+        'fecha_generacion': fecha_generacion_obj,
+        'eps': eps,
+    }
+    cambios = {columna: valor for columna, valor in valores_formulario.items() if original_data.get(columna) != valor}
+    if not cambios:
+        st.info("No hay cambios para guardar.")
+        return None
+
+    resultado, factura_data = db_ops.actualizar_factura_parcial(factura_id, original_data['version'], cambios)
+    if resultado == 'actualizada':
+        reporte_data = {
+            'facturador': facturador,
+            'eps': eps,
+            'area_servicio': area_servicio,
+            'factura_data': factura_data,
+            'numero_factura': numero_factura,
+            'factura_id': factura_id,
+            'tipo': 'actualizacion'
+        }
+
+        st.success("Factura actualizada correctamente.")
+        invalidate_all_caches()
+        cancelar_edicion_action()
+
+        return {'success': True, 'reporte_data': reporte_data}
+    elif resultado == 'conflicto':
+        # Otra persona modificó la factura después de cargarla: se muestran sus datos vigentes
+        # y se pide repetir la edición en lugar de sobrescribir ese cambio.
+        st.session_state.edicion_original = factura_data
+        st.session_state.current_invoice_data = factura_data
+        st.session_state.form_key += 1
+        st.warning("La factura fue modificada por otro usuario mientras la editaba (por ejemplo, una auditoría). "
+                   "Se cargaron los datos actuales; revise y vuelva a aplicar sus cambios.")
+        invalidate_all_caches()
+        return None
+    elif resultado == 'no_encontrada':
+        st.error("La factura ya no existe; pudo haber sido eliminada.")
+        invalidate_all_caches()
+        cancelar_edicion_action()
+        return None
+    elif resultado == 'duplicada':
+        st.error(f"No se pudo actualizar la factura. El número de factura '{numero_factura}' ya existe con la misma combinación de Legalizador, EPS y Área de Servicio.")
+        return None
     else:
-        st.error(f"No se pudo actualizar la factura. El número de factura '{numero_factura}' ya podría existir con la misma combinación de Legalizador, EPS y Área de Servicio.")
+        st.error("No se pudo actualizar la factura. Intente de nuevo.")
         return None
 
 def cargar_factura_para_edicion_action(factura_id):
@@ -1121,6 +1260,8 @@ def cargar_factura_para_edicion_action(factura_id):
         st.session_state.edit_mode = True
         st.session_state.refacturar_mode = False
         st.session_state.current_invoice_data = factura_data
+        # Versión con la que se cargó: la actualización solo se aplica si nadie la cambió después.
+        st.session_state.edicion_original = factura_data
         st.session_state.form_key += 1
         st.success(f"Factura {factura_data['numero_factura']} cargada para edición.")
     else:
@@ -1170,7 +1311,12 @@ def guardar_factura_reemplazo_action(old_factura_id, new_numero_factura, fecha_r
         st.error("El 'Nuevo Número de Factura' debe contener solo números.")
         return None
 
-    factura_existente = db_ops.obtener_factura_por_numero(new_numero_factura)
+    # También en el histórico: un número archivado sigue ocupado.
+    try:
+        factura_existente = db_ops.obtener_numeros_factura_existentes([new_numero_factura])
+    except Exception as e:
+        st.error(f"❌ No se pudo verificar duplicados en la base de datos. Motivo: `{e}`")
+        return None
     if factura_existente:
         st.error(f"Error: El nuevo número de factura '{new_numero_factura}' ya existe en la base de datos. Por favor, ingrese un número diferente.")
         return None
@@ -1237,6 +1383,7 @@ def cancelar_edicion_action():
     st.session_state.edit_mode = False
     st.session_state.refacturar_mode = False
     st.session_state.current_invoice_data = None
+    st.session_state.edicion_original = None
     st.session_state.form_key += 1
     if 'confirm_delete_id' in st.session_state:
         st.session_state.confirm_delete_id = None
@@ -1244,7 +1391,27 @@ def cancelar_edicion_action():
     st.session_state.filter_text_key += 1
     st.session_state.filter_select_key += 1
 
-if st.session_state['logged_in']:
-    main_app_page()
-else:
-    login_page()
+def reportar_consultas_repetidas(peticion_bd):
+    resumen = peticion_bd.resumen()
+    st.session_state['_resumen_bd_rerun'] = resumen
+    if os.environ.get("DB_AVISAR_N_MAS_1") == "1" and resumen['repetidas']:
+        with st.sidebar.expander(f"⚠️ Posible N+1: {len(resumen['repetidas'])} consultas repetidas", expanded=True):
+            for repetida in resumen['repetidas']:
+                st.caption(f"{repetida['repeticiones']}x · {', '.join(repetida['operaciones'])}")
+                st.code(repetida['forma'], language="sql")
+
+def acumular_viajes_bd(peticion_bd):
+    # Incluye los reruns interrumpidos por st.rerun(); lo leen los arneses de carga de benchmarks/.
+    st.session_state['_viajes_bd_acumulados'] = st.session_state.get('_viajes_bd_acumulados', 0) + peticion_bd.total
+
+with instrumentacion.ambito_peticion() as peticion_bd, mapa_identidad.ambito_rerun():
+    try:
+        with perfilar_rerun():
+            if st.session_state['logged_in']:
+                main_app_page()
+            else:
+                login_page()
+    finally:
+        acumular_viajes_bd(peticion_bd)
+reportar_consultas_repetidas(peticion_bd)
+mostrar_panel_perfilado()
@@ -0,0 +1,65 @@
+"""
+Archivo de facturas ya radicadas.
+
+Mueve a facturas_historico (y sus detalles SOAT a detalles_soat_historico) las facturas
+'En Radicador' entregadas hace más de FACTURAS_EDAD_ARCHIVO_DIAS días, en lotes de
+FACTURAS_TAMANO_LOTE_ARCHIVO facturas por transacción para no retener bloqueos largos.
+Se programa fuera de la aplicación (cron o similar):
+
+    python -m backend.archivo [--edad-dias 180] [--tamano-lote 500] [--max-lotes N]
+
+La aplicación sigue encontrando las facturas archivadas con la opción "Incluir histórico"
+de la búsqueda y la exportación.
+"""
+import argparse
+import logging
+import sys
+from datetime import date, timedelta
+from psycopg2 import Error
+
+from backend import database_operations as db_ops
+
+def archivar_facturas(edad_dias=None, tamano_lote=None, max_lotes=None, dsn=None):
+    """Archiva por lotes hasta que no queden facturas elegibles. Retorna cuántas movió, o None si falla."""
+    edad_dias = db_ops.EDAD_ARCHIVO_DIAS if edad_dias is None else edad_dias
+    tamano_lote = tamano_lote or db_ops.TAMANO_LOTE_ARCHIVO
+    limite = date.today() - timedelta(days=edad_dias)
+
+    conn = db_ops.abrir_conexion_dedicada(dsn)
+    if conn is None:
+        logging.error("No se pudo obtener una conexión para archivar facturas.")
+        return None
+    total = 0
+    lotes = 0
+    try:
+        while max_lotes is None or lotes < max_lotes:
+            with conn.cursor() as cursor:
+                cursor.execute(db_ops.SQL_ARCHIVAR_FACTURAS, {'limite': limite, 'tamano_lote': tamano_lote})
+                archivadas = cursor.rowcount
+            conn.commit()
+            lotes += 1
+            total += archivadas
+            logging.info(f"Lote {lotes}: {archivadas} facturas archivadas (entregadas antes de {limite}).")
+            if archivadas < tamano_lote:
+                break
+        logging.info(f"Archivo terminado: {total} facturas movidas al histórico en {lotes} lotes.")
+        return total
+    except Error as e:
+        conn.rollback()
+        logging.error(f"Error al archivar facturas (se conservan las {total} ya archivadas): {e}")
+        return None
+    finally:
+        conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archiva en el histórico las facturas radicadas antiguas.")
+    parser.add_argument("--edad-dias", type=int, default=None,
+                        help=f"Días desde la entrega al radicador (por defecto {db_ops.EDAD_ARCHIVO_DIAS}).")
+    parser.add_argument("--tamano-lote", type=int, default=None,
+                        help=f"Facturas por transacción (por defecto {db_ops.TAMANO_LOTE_ARCHIVO}).")
+    parser.add_argument("--max-lotes", type=int, default=None, help="Detiene el archivo tras N lotes.")
+    args = parser.parse_args(argv)
+    return 0 if archivar_facturas(args.edad_dias, args.tamano_lote, args.max_lotes) is not None else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,32 @@
 import os
+import sys
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
 import psycopg2
 from psycopg2 import Error
 from psycopg2 import errors
-from datetime import datetime
+from psycopg2 import extensions
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from datetime import date, datetime, timedelta
 import logging
 import streamlit as st
+from backend import instrumentacion
+from backend import grabacion
+from backend import sentencias_preparadas
+from backend import replica
+from backend import mapa_identidad
+from utils.date_utils import dia_habil_anterior
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-@st.cache_resource(ttl=3600)
-def get_db_connection():
+def obtener_parametros_conexion():
+    # DB_DSN tiene prioridad; lo usan los benchmarks para apuntar a una base local de pruebas.
+    if os.environ.get("DB_DSN"):
+        return {"dsn": os.environ["DB_DSN"]}
+
     db_host = os.environ.get("DB_HOST", "localhost")
     db_name = os.environ.get("DB_NAME")
     db_user = os.environ.get("DB_USER")
@@ -19,109 +36,693 @@ def get_db_connection():
     if not all([db_host, db_name, db_user, db_password]):
         logging.warning("ADVERTENCIA: Una o más variables de entorno de la base de datos no están configuradas. Intentando conectar con valores predeterminados o vacíos.")
 
+    return {"host": db_host, "database": db_name, "user": db_user, "password": db_password, "port": db_port}
+
+def abrir_conexion_dedicada(dsn=None):
+    """Conexión propia (fuera de la caché), para migraciones y herramientas de línea de comandos."""
     try:
-        conn = psycopg2.connect(host=db_host, database=db_name, user=db_user, password=db_password, port=db_port)
+        if dsn:
+            return psycopg2.connect(dsn)
+        return psycopg2.connect(**obtener_parametros_conexion())
+    except Error as e:
+        logging.error(f"Error al abrir conexión dedicada a PostgreSQL: {e}")
+        return None
+
+@st.cache_resource(ttl=3600)
+def get_db_connection():
+    try:
+        conn = psycopg2.connect(cursor_factory=instrumentacion.CursorInstrumentado, **obtener_parametros_conexion())
         logging.info("Conexión a la DB establecida exitosamente (usando caché).")
         return conn
     except Error as e:
         logging.error(f"Error al conectar a la base de datos PostgreSQL: {e}")
         return None
 
+# Consultas independientes en paralelo (tablero, selectores, tabla): cada tarea toma
+# una conexión propia del pool y la latencia de la página es la de la consulta más lenta.
+POOL_MAX_CONEXIONES = int(os.environ.get("DB_POOL_MAX", "4"))
+TIEMPO_LIMITE_PARALELO_MS = int(os.environ.get("DB_TIEMPO_LIMITE_PARALELO_MS", "10000"))
+
+_conexion_prestada = contextvars.ContextVar('conexion_prestada', default=None)
+_ejecutor_paralelo = None
+_bloqueo_ejecutor = threading.Lock()
+
+@st.cache_resource(ttl=3600)
+def get_db_connection_replica():
+    try:
+        conn = psycopg2.connect(replica.REPLICA_DSN, cursor_factory=instrumentacion.CursorInstrumentado)
+        logging.info("Conexión a la réplica de lectura establecida (usando caché).")
+        return conn
+    except Error as e:
+        logging.error(f"Error al conectar a la réplica de lectura: {e}")
+        return None
+
+@st.cache_resource(ttl=3600)
+def get_pool_conexiones(destino="primaria"):
+    try:
+        parametros = {"dsn": replica.REPLICA_DSN} if destino == "replica" else obtener_parametros_conexion()
+        pool = ThreadedConnectionPool(1, POOL_MAX_CONEXIONES, cursor_factory=instrumentacion.CursorInstrumentado,
+                                      **parametros)
+        logging.info(f"Pool de conexiones ({destino}) para consultas en paralelo creado (máximo {POOL_MAX_CONEXIONES}).")
+        return pool
+    except Error as e:
+        logging.error(f"Error al crear el pool de conexiones ({destino}): {e}")
+        return None
+
+def leer_de_replica():
+    """Las lecturas van a la réplica si existe, está al día y la sesión no acaba de escribir."""
+    return replica.debe_leer_de_replica() and replica.replica_utilizable(get_pool_conexiones("replica"))
+
+def _obtener_ejecutor():
+    global _ejecutor_paralelo
+    with _bloqueo_ejecutor:
+        if _ejecutor_paralelo is None:
+            _ejecutor_paralelo = ThreadPoolExecutor(max_workers=POOL_MAX_CONEXIONES, thread_name_prefix="bd-paralelo")
+        return _ejecutor_paralelo
+
+def _contexto_streamlit():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return get_script_run_ctx()
+    except ImportError:
+        return None
+
+def _usuario_sesion():
+    """Usuario de la sesión de Streamlit en curso; None fuera de la app."""
+    if _contexto_streamlit() is None:
+        return None
+    return st.session_state.get('username')
+
+def _con_usuario(cursor, sql):
+    """
+    Antepone a una escritura sobre facturas la fijación de app.usuario, que los triggers de
+    facturas_eventos registran como autor. Viaja en la misma llamada que la escritura (el resultado
+    del cursor es el de la última sentencia); sin usuario de sesión retorna `sql` tal cual.
+    """
+    usuario = _usuario_sesion()
+    if not usuario:
+        return sql
+    fijar = cursor.mogrify("SELECT set_config('app.usuario', %s, true);", (usuario,))
+    fijar = fijar.decode(extensions.encodings[cursor.connection.encoding])
+    return fijar.replace('%', '%%') + "\n" + sql
+
+def _ejecutar_con_conexion_prestada(funcion, args, tiempo_limite_ms, contexto_streamlit, destino):
+    if contexto_streamlit is not None:
+        # Permite que las funciones con st.cache_data se ejecuten en el hilo del pool.
+        from streamlit.runtime.scriptrunner import add_script_run_ctx
+        add_script_run_ctx(threading.current_thread(), contexto_streamlit)
+    pool = get_pool_conexiones(destino)
+    if pool is None:
+        return funcion(*args)
+    conn = pool.getconn()
+    token = _conexion_prestada.set((conn, int(tiempo_limite_ms)))
+    try:
+        return funcion(*args)
+    finally:
+        _conexion_prestada.reset(token)
+        if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        pool.putconn(conn, close=bool(conn.closed))
+
+def ejecutar_en_paralelo(tareas, tiempo_limite_ms=None):
+    """
+    Ejecuta lecturas independientes a la vez, cada una con su conexión del pool.
+    `tareas` es un dict nombre -> función o (función, *args). Retorna nombre -> resultado;
+    las tareas que fallan o superan el tiempo límite quedan en None.
+    Dentro de una tarea (llamada anidada) se ejecuta en serie sobre la conexión ya prestada.
+    """
+    tiempo_limite_ms = tiempo_limite_ms or TIEMPO_LIMITE_PARALELO_MS
+    normalizadas = {nombre: (tarea[0], tarea[1:]) if isinstance(tarea, tuple) else (tarea, ())
+                    for nombre, tarea in tareas.items()}
+
+    if _conexion_prestada.get() is not None or len(normalizadas) < 2:
+        return {nombre: funcion(*args) for nombre, (funcion, args) in normalizadas.items()}
+
+    ejecutor = _obtener_ejecutor()
+    contexto_streamlit = _contexto_streamlit()
+    # Las tareas en paralelo son lecturas por contrato: se decide el destino una vez para todas.
+    destino = "replica" if leer_de_replica() else "primaria"
+    futuros = {
+        # Cada tarea corre en una copia del contexto para que la instrumentación la atribuya a esta petición.
+        nombre: ejecutor.submit(contextvars.copy_context().run, _ejecutar_con_conexion_prestada,
+                                funcion, args, tiempo_limite_ms, contexto_streamlit, destino)
+        for nombre, (funcion, args) in normalizadas.items()
+    }
+    wait(futuros.values(), timeout=tiempo_limite_ms / 1000 + 1)
+
+    resultados = {}
+    for nombre, futuro in futuros.items():
+        if not futuro.done():
+            logging.warning(f"La consulta en paralelo '{nombre}' superó {tiempo_limite_ms} ms; se omite su resultado.")
+            resultados[nombre] = None
+            continue
+        try:
+            resultados[nombre] = futuro.result()
+        except Exception as e:
+            logging.error(f"Error en la consulta en paralelo '{nombre}': {e}")
+            resultados[nombre] = None
+    return resultados
+
 class DatabaseConnection:
-    def __init__(self):
+    def __init__(self, solo_lectura=False):
         self.conn = None
+        # Las operaciones de solo lectura pueden servirse desde la réplica (DB_REPLICA_DSN).
+        self.solo_lectura = solo_lectura
+        # Las métricas se agrupan por la función de este módulo que abre la conexión.
+        self.operacion = sys._getframe(1).f_code.co_name
+        self._token_operacion = None
+        self._inicio = None
 
     def __enter__(self):
+        self._inicio = time.perf_counter()
+        self._token_operacion = instrumentacion.iniciar_operacion(self.operacion)
+        prestada = _conexion_prestada.get()
+        if prestada is not None:
+            self.conn, tiempo_limite_ms = prestada
+            # SET LOCAL dura solo esta transacción; es seguro también detrás de pgbouncer en modo transacción.
+            # Cursor sin instrumentar: no es una consulta de la operación ni debe contar como N+1.
+            with self.conn.cursor(cursor_factory=extensions.cursor) as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s;", (tiempo_limite_ms,))
+            instrumentacion.metricas.registrar_espera_conexion(self.operacion, (time.perf_counter() - self._inicio) * 1000)
+            return self.conn
+        if self.solo_lectura and leer_de_replica():
+            self.conn = get_db_connection_replica()
+            if self.conn is not None and self.conn.closed != 0:
+                sentencias_preparadas.registro.olvidar_conexion(self.conn)
+                get_db_connection_replica.clear()
+                self.conn = get_db_connection_replica()
+            if self.conn is not None:
+                replica.registrar_lectura("replica")
+                instrumentacion.metricas.registrar_espera_conexion(self.operacion, (time.perf_counter() - self._inicio) * 1000)
+                return self.conn
+        if self.solo_lectura:
+            replica.registrar_lectura("primaria")
         self.conn = get_db_connection()
         
         if self.conn and self.conn.closed != 0:
             logging.warning("Conexión en caché encontrada, pero está cerrada. Recreando la conexión.")
+            sentencias_preparadas.registro.olvidar_conexion(self.conn)
             get_db_connection.clear()
             self.conn = get_db_connection()
+        instrumentacion.metricas.registrar_espera_conexion(self.operacion, (time.perf_counter() - self._inicio) * 1000)
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.conn:
-            if exc_type is None:
-                self.conn.commit()
-            else:
-                self.conn.rollback()
-                logging.error(f"Transacción revertida debido a un error: {exc_val}")
+        try:
+            if self.conn:
+                instrumentacion.metricas.registrar_viaje(self.operacion)
+                if exc_type is None:
+                    self.conn.commit()
+                    if not self.solo_lectura and replica.replica_configurada():
+                        # Lectura de las propias escrituras: esta sesión lee de la primaria por un tiempo.
+                        replica.registrar_escritura()
+                else:
+                    self.conn.rollback()
+                    logging.error(f"Transacción revertida debido a un error: {exc_val}")
+        finally:
+            duracion_ms = (time.perf_counter() - self._inicio) * 1000
+            instrumentacion.finalizar_operacion(self._token_operacion, self.operacion, duracion_ms, exc_type is not None)
+
+# Sentencias SQL de cada operación. Se mantienen a nivel de módulo para que las
+# herramientas de análisis (benchmarks/asesor_indices.py) evalúen exactamente lo que ejecuta la app.
+SQL_OBTENER_CREDENCIALES_USUARIO = "SELECT password, role, facturador FROM usuarios WHERE username = %s;"
+
+# Fila completa de una factura (con los datos de la original si es un reemplazo), tal como la usa el formulario.
+COLUMNAS_FACTURA_DETALLE = """
+        f.id, f.numero_factura, f.area_servicio, f.facturador, f.fecha_generacion, f.eps,
+        f.fecha_hora_entrega, f.tiene_correccion, f.descripcion_devolucion,
+        f.fecha_devolucion_lider, f.revisado, f.factura_original_id, f.estado,
+        f.reemplazada_por_numero_factura, f.estado_auditoria, f.observacion_auditor,
+        f.tipo_error, f.fecha_reemplazo, f.fecha_entrega_radicador, f.version, f.updated_at,
+        fo.numero_factura AS num_fact_original_linked,
+        fo.fecha_generacion AS fecha_gen_original_linked
+"""
+
+SQL_OBTENER_FACTURA_POR_ID = f"""
+    SELECT {COLUMNAS_FACTURA_DETALLE}
+    FROM facturas f
+    LEFT JOIN facturas fo ON f.factura_original_id = fo.id
+    WHERE f.id = %s;
+"""
+
+# Alta individual en un solo viaje: el número no debe existir (con ningún legalizador/EPS, como
+# validaba el formulario, ni en el histórico), el detalle SOAT se inserta en la misma sentencia y se
+# retorna la fila completa.
+SQL_CREAR_FACTURA = f"""
+    WITH nueva AS (
+        INSERT INTO facturas (numero_factura, area_servicio, facturador, fecha_generacion, eps, fecha_hora_entrega, estado_auditoria)
+        SELECT %(numero_factura)s, %(area_servicio)s, %(facturador)s, %(fecha_generacion)s, %(eps)s,
+               %(fecha_hora_entrega)s, %(estado_auditoria)s
+        WHERE NOT EXISTS (SELECT 1 FROM facturas WHERE numero_factura = %(numero_factura)s)
+          AND NOT EXISTS (SELECT 1 FROM facturas_historico WHERE numero_factura = %(numero_factura)s)
+        ON CONFLICT ON CONSTRAINT unique_factura_details DO NOTHING
+        RETURNING *
+    ), soat AS (
+        INSERT INTO detalles_soat (factura_id, fecha_generacion_soat)
+        SELECT id, fecha_generacion FROM nueva WHERE area_servicio = 'SOAT'
+    )
+    SELECT {COLUMNAS_FACTURA_DETALLE}
+    FROM nueva f
+    LEFT JOIN facturas fo ON f.factura_original_id = fo.id;
+"""
+
+SQL_OBTENER_FACTURA_POR_NUMERO = """
+    SELECT
+        id, numero_factura, area_servicio, facturador, fecha_generacion, eps,
+        fecha_hora_entrega, tiene_correccion, descripcion_devolucion,
+        fecha_devolucion_lider, revisado, factura_original_id, estado,
+        reemplazada_por_numero_factura, estado_auditoria, observacion_auditor,
+        tipo_error, fecha_reemplazo, fecha_entrega_radicador
+    FROM facturas
+    WHERE numero_factura = %s;
+"""
+
+SQL_OBTENER_DETALLES_SOAT_POR_FACTURA_ID = """
+    SELECT id, factura_id, fecha_generacion_soat
+    FROM detalles_soat
+    WHERE factura_id = %s;
+"""
+
+COLUMNAS_EDITABLES_FACTURA = (
+    'numero_factura', 'area_servicio', 'facturador', 'fecha_generacion', 'eps',
+    'fecha_hora_entrega', 'tiene_correccion', 'descripcion_devolucion',
+    'fecha_devolucion_lider', 'revisado', 'factura_original_id', 'estado',
+    'reemplazada_por_numero_factura', 'estado_auditoria', 'observacion_auditor',
+    'tipo_error', 'fecha_reemplazo'
+)
+
+# {asignaciones} se arma solo con nombres de COLUMNAS_EDITABLES_FACTURA; los valores van como parámetros.
+SQL_ACTUALIZAR_FACTURA_PARCIAL = f"""
+    WITH f AS (
+        UPDATE facturas SET {{asignaciones}}
+        WHERE id = %s AND version = %s
+        RETURNING *
+    )
+    SELECT {COLUMNAS_FACTURA_DETALLE}
+    FROM f
+    LEFT JOIN facturas fo ON f.factura_original_id = fo.id;
+"""
+
+SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURA = """
+    UPDATE facturas SET
+        estado_auditoria = %s, observacion_auditor = %s, tipo_error = %s
+    WHERE id = %s;
+"""
+
+SQL_ACTUALIZAR_FECHA_ENTREGA_RADICADOR = """
+    UPDATE facturas SET fecha_entrega_radicador = %s, estado_auditoria = %s WHERE id = %s;
+"""
+
+SQL_ENTREGAR_FACTURAS_RADICADOR = """
+    UPDATE facturas SET
+        fecha_entrega_radicador = %s,
+        estado_auditoria = CASE
+            WHEN estado_auditoria = 'Lista para Radicar' AND %s IS NOT NULL THEN 'En Radicador'
+            WHEN estado_auditoria = 'En Radicador' AND %s IS NULL THEN 'Lista para Radicar'
+            ELSE estado_auditoria
+        END
+    WHERE id = ANY(%s);
+"""
+
+SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURAS = """
+    UPDATE facturas SET
+        estado_auditoria = %s, observacion_auditor = %s, tipo_error = %s
+    WHERE id = ANY(%s);
+"""
+
+SQL_DEVOLVER_FACTURAS = """
+    UPDATE facturas AS f SET
+        estado_auditoria = 'Devuelta por Auditor', tipo_error = v.tipo_error, observacion_auditor = v.observacion
+    FROM (VALUES %s) AS v(id, tipo_error, observacion)
+    WHERE f.id = v.id;
+"""
+
+SQL_ELIMINAR_FACTURA = "DELETE FROM facturas WHERE id = %s;"
+
+SQL_GUARDAR_FACTURA_REEMPLAZO = """
+    UPDATE facturas SET
+        estado = 'Reemplazada',
+        reemplazada_por_numero_factura = %s,
+        fecha_reemplazo = %s,
+        estado_auditoria = 'Pendiente'
+    WHERE id = %s;
+"""
+
+SQL_GUARDAR_FACTURAS_MASIVO = """
+    INSERT INTO facturas (numero_factura, area_servicio, facturador, fecha_generacion, eps, fecha_hora_entrega, estado_auditoria, lote_carga_masiva)
+    VALUES %s
+    ON CONFLICT ON CONSTRAINT unique_factura_details DO NOTHING
+    RETURNING id, numero_factura;
+"""
+
+SQL_GUARDAR_DETALLES_SOAT_MASIVO = """
+    INSERT INTO detalles_soat (factura_id, fecha_generacion_soat)
+    VALUES %s;
+"""
+
+SQL_OBTENER_NUMEROS_FACTURA_EXISTENTES = """
+    SELECT numero_factura FROM facturas WHERE numero_factura = ANY(%(numeros)s)
+    UNION
+    SELECT numero_factura FROM facturas_historico WHERE numero_factura = ANY(%(numeros)s);
+"""
+
+SQL_OBTENER_ESTADOS_AUDITORIA_POR_IDS = "SELECT id, estado_auditoria FROM facturas WHERE id = ANY(%s);"
+
+SQL_CARGAR_FACTURAS = """
+    SELECT
+        f.id, f.numero_factura, f.area_servicio, f.facturador, f.fecha_generacion, f.eps,
+        f.fecha_hora_entrega, f.tiene_correccion, f.descripcion_devolucion,
+        f.fecha_devolucion_lider, f.revisado, f.factura_original_id, f.estado,
+        f.reemplazada_por_numero_factura, f.estado_auditoria, f.observacion_auditor,
+        f.tipo_error, f.fecha_reemplazo, f.fecha_entrega_radicador, f.fecha_limite_liquidacion,
+        fo.numero_factura AS num_fact_original_linked,
+        fo.fecha_generacion AS fecha_gen_original_linked
+    FROM facturas f
+    LEFT JOIN facturas fo ON f.factura_original_id = fo.id
+"""
+
+# Período activo: con MESES_PERIODO_ACTIVO > 0 la grilla por urgencia sin búsqueda solo considera
+# las facturas generadas desde el primer día del mes de hace esos meses. Pensado para facturas
+# particionadas por año (backend/particionado.py), donde el predicado descarta las particiones
+# anteriores; sin particiones no ahorra nada y oculta facturas abiertas antiguas, por eso viene
+# desactivado (0). Las bandejas nunca lo aplican: una factura por atender aparece sin importar su edad.
+MESES_PERIODO_ACTIVO = int(os.environ.get("DB_MESES_PERIODO_ACTIVO", "0"))
+FILTRO_PERIODO_ACTIVO = "f.fecha_generacion >= %s"
+
+def inicio_periodo_activo(hoy=None):
+    """Primer fecha_generacion del período activo, o None si no hay límite."""
+    if MESES_PERIODO_ACTIVO <= 0:
+        return None
+    hoy = hoy or date.today()
+    meses = hoy.year * 12 + hoy.month - 1 - MESES_PERIODO_ACTIVO
+    return date(meses // 12, meses % 12 + 1, 1)
+
+# Página de la bandeja en orden de urgencia global (devueltas, corregidas, luego por fecha límite),
+# servida por idx_facturas_urgencia. {filtro} es vacío o el WHERE de la búsqueda o del período activo.
+SQL_CARGAR_PAGINA_FACTURAS_POR_URGENCIA = SQL_CARGAR_FACTURAS + """ {filtro}
+    ORDER BY f.prioridad_urgencia, f.fecha_limite_liquidacion, f.id
+    LIMIT %s OFFSET %s;
+"""
+
+SQL_CONTAR_FACTURAS = "SELECT COUNT(f.id) FROM facturas f {filtro};"
+
+# Feed de cambios para los cachés incrementales. La marca es la hora del servidor al empezar la
+# lectura; se relee con MARGEN_CAMBIOS_S de solape para no perder transacciones que confirmaron tarde.
+MARGEN_CAMBIOS_S = int(os.environ.get("DB_MARGEN_CAMBIOS_S", "30"))
+
+SQL_MARCA_TIEMPO_SERVIDOR = "SELECT LOCALTIMESTAMP;"
+
+# Facturas cambiadas desde la marca y los reemplazos de facturas originales cambiadas
+# (idx_facturas_updated_at; idx_facturas_factura_original_id, parcial, de la migración 3).
+SQL_CARGAR_FACTURAS_CAMBIADAS = SQL_CARGAR_FACTURAS + """
+    WHERE f.id IN (
+        SELECT id FROM facturas WHERE updated_at > %(desde)s
+        UNION
+        SELECT r.id FROM facturas r JOIN facturas c ON r.factura_original_id = c.id
+        WHERE c.updated_at > %(desde)s
+    )
+    ORDER BY f.id DESC;
+"""
+
+SQL_OBTENER_FACTURAS_ELIMINADAS = "SELECT factura_id FROM facturas_eliminadas WHERE eliminada_en > %s;"
+
+# Archivo de facturas radicadas (backend/archivo.py): las entregadas al radicador hace más de
+# EDAD_ARCHIVO_DIAS días pasan, con sus detalles SOAT, a las tablas *_historico.
+EDAD_ARCHIVO_DIAS = int(os.environ.get("FACTURAS_EDAD_ARCHIVO_DIAS", "180"))
+TAMANO_LOTE_ARCHIVO = int(os.environ.get("FACTURAS_TAMANO_LOTE_ARCHIVO", "500"))
+
+# Columnas copiadas al histórico, por nombre: una columna nueva en facturas o detalles_soat debe
+# agregarse aquí y a su tabla de histórico (tests/test_archivo.py compara las tres).
+COLUMNAS_FACTURAS_ARCHIVO = (
+    "id, numero_factura, area_servicio, facturador, fecha_generacion, eps, fecha_hora_entrega, "
+    "tiene_correccion, descripcion_devolucion, fecha_devolucion_lider, revisado, factura_original_id, "
+    "estado, reemplazada_por_numero_factura, estado_auditoria, observacion_auditor, tipo_error, "
+    "fecha_reemplazo, fecha_entrega_radicador, lote_carga_masiva, version, updated_at, "
+    "prioridad_urgencia, fecha_limite_liquidacion"
+)
+COLUMNAS_DETALLES_SOAT_ARCHIVO = "id, factura_id, fecha_generacion_soat"
+
+# Un lote por transacción (idx_facturas_archivables). Se recorre de mayor a menor ID para que un
+# reemplazo salga antes o junto con su original; una original con reemplazos aún activos se queda.
+# El DELETE borra en cascada detalles_soat y deja la marca en facturas_eliminadas para los cachés.
+SQL_ARCHIVAR_FACTURAS = f"""
+    WITH archivables AS (
+        SELECT f.id FROM facturas f
+        WHERE f.estado_auditoria = 'En Radicador' AND f.fecha_entrega_radicador < %(limite)s
+          AND NOT EXISTS (
+              SELECT 1 FROM facturas r
+              WHERE r.factura_original_id = f.id
+                AND NOT (r.estado_auditoria = 'En Radicador' AND r.fecha_entrega_radicador < %(limite)s))
+        ORDER BY f.id DESC
+        LIMIT %(tamano_lote)s
+        FOR UPDATE OF f
+    ), copia AS (
+        INSERT INTO facturas_historico ({COLUMNAS_FACTURAS_ARCHIVO})
+        SELECT {COLUMNAS_FACTURAS_ARCHIVO} FROM facturas WHERE id IN (SELECT id FROM archivables)
+    ), copia_soat AS (
+        INSERT INTO detalles_soat_historico ({COLUMNAS_DETALLES_SOAT_ARCHIVO})
+        SELECT {COLUMNAS_DETALLES_SOAT_ARCHIVO} FROM detalles_soat WHERE factura_id IN (SELECT id FROM archivables)
+    )
+    DELETE FROM facturas f USING archivables a
+    WHERE f.id = a.id
+    RETURNING f.id;
+"""
+
+# Búsqueda en el histórico con las columnas de SQL_CARGAR_FACTURAS; la original de un reemplazo
+# archivado puede seguir activa o estar también en el histórico.
+SQL_CARGAR_FACTURAS_HISTORICO = """
+    SELECT
+        f.id, f.numero_factura, f.area_servicio, f.facturador, f.fecha_generacion, f.eps,
+        f.fecha_hora_entrega, f.tiene_correccion, f.descripcion_devolucion,
+        f.fecha_devolucion_lider, f.revisado, f.factura_original_id, f.estado,
+        f.reemplazada_por_numero_factura, f.estado_auditoria, f.observacion_auditor,
+        f.tipo_error, f.fecha_reemplazo, f.fecha_entrega_radicador, f.fecha_limite_liquidacion,
+        COALESCE(fo.numero_factura, foh.numero_factura) AS num_fact_original_linked,
+        COALESCE(fo.fecha_generacion, foh.fecha_generacion) AS fecha_gen_original_linked
+    FROM facturas_historico f
+    LEFT JOIN facturas fo ON f.factura_original_id = fo.id
+    LEFT JOIN facturas_historico foh ON f.factura_original_id = foh.id
+"""
+
+# Bandejas de trabajo: solo las facturas sobre las que el rol tiene que actuar, más urgentes primero.
+DIAS_HABILES_ALERTA_VENCIMIENTO = 3
+LIMITE_BANDEJA = 200
+
+# Devueltas del legalizador y sus facturas que vencen en los próximos días hábiles
+# (idx_facturas_bandeja_devueltas e idx_facturas_bandeja_por_vencer). {filtro_facturador}: vacío o "AND f.facturador = %s".
+SQL_BANDEJA_LEGALIZADOR = SQL_CARGAR_FACTURAS + """
+    WHERE ((f.estado_auditoria = 'Devuelta por Auditor' {filtro_facturador})
+           OR (f.estado_auditoria IN ('Pendiente', 'Corregida por Legalizador', 'Lista para Radicar')
+               AND f.fecha_limite_liquidacion <= sumar_dias_habiles(CURRENT_DATE, %s) {filtro_facturador}))
+    ORDER BY f.prioridad_urgencia, f.fecha_limite_liquidacion, f.id
+    LIMIT %s;
+"""
+
+# Pendientes y corregidas por revisar (idx_facturas_bandeja_auditor).
+SQL_BANDEJA_AUDITOR = SQL_CARGAR_FACTURAS + """
+    WHERE f.estado_auditoria IN ('Pendiente', 'Corregida por Legalizador')
+    ORDER BY f.prioridad_urgencia, f.fecha_limite_liquidacion, f.id
+    LIMIT %s;
+"""
+
+# Analítica sobre resumen_diario (migración 13, mantenida por triggers): series por período y,
+# opcionalmente, por una dimensión. {dimension} es una de DIMENSIONES_RESUMEN o el literal 'Total'.
+PERIODOS_RESUMEN = ('day', 'week', 'month', 'year')
+DIMENSIONES_RESUMEN = ('facturador', 'eps', 'area_servicio')
+
+SQL_CARGAR_RESUMEN_DIARIO = """
+    SELECT date_trunc(%(periodo)s, dia)::date AS periodo, {dimension} AS grupo,
+           SUM(ingresadas) AS ingresadas, SUM(auditadas) AS auditadas, SUM(devueltas) AS devueltas,
+           SUM(entregadas) AS entregadas, SUM(dias_entrega_suma) AS dias_entrega_suma
+    FROM resumen_diario
+    WHERE dia BETWEEN %(desde)s AND %(hasta)s
+    GROUP BY 1, 2
+    ORDER BY 1, 2;
+"""
+
+# Tiempos de ciclo desde facturas_eventos: para cada hito de inicio en [desde, hasta), el primer hito
+# de fin posterior de la misma factura (ventana por factura). Los tramos sin fin cuentan como abiertos.
+# El ingreso es el hito 'Ingreso' solo si la factura entra Pendiente; las de áreas que se crean ya
+# 'Lista para Radicar' (Hospitalización, Urgencias) empiezan en ese hito y no pasan por auditoría.
+SQL_SLA_AUDITORIA = """
+    WITH hitos AS (
+        SELECT id, factura_id, ocurrido_en,
+               CASE WHEN tipo = 'ingreso' AND COALESCE(estado_nuevo, 'Pendiente') = 'Pendiente' THEN 'Ingreso'
+                    ELSE estado_nuevo END AS hito
+        FROM facturas_eventos
+        WHERE ocurrido_en >= %(desde)s AND tipo IN ('ingreso', 'estado')
+    ), siguientes AS (
+        SELECT hito, ocurrido_en,
+               MIN(ocurrido_en) FILTER (WHERE hito IN ('Lista para Radicar', 'Devuelta por Auditor')) OVER posteriores AS auditada_en,
+               MIN(ocurrido_en) FILTER (WHERE hito = 'Corregida por Legalizador') OVER posteriores AS corregida_en,
+               MIN(ocurrido_en) FILTER (WHERE hito = 'En Radicador') OVER posteriores AS radicada_en
+        FROM hitos
+        WINDOW posteriores AS (PARTITION BY factura_id ORDER BY ocurrido_en, id
+                               ROWS BETWEEN 1 FOLLOWING AND UNBOUNDED FOLLOWING)
+    ), tramos AS (
+        SELECT 1 AS orden, 'Ingreso → Auditoría' AS tramo, auditada_en - ocurrido_en AS duracion
+        FROM siguientes WHERE hito = 'Ingreso' AND ocurrido_en < %(hasta)s
+        UNION ALL
+        SELECT 2, 'Devolución → Corrección', corregida_en - ocurrido_en
+        FROM siguientes WHERE hito = 'Devuelta por Auditor' AND ocurrido_en < %(hasta)s
+        UNION ALL
+        SELECT 3, 'Lista para Radicar → Radicador', radicada_en - ocurrido_en
+        FROM siguientes WHERE hito = 'Lista para Radicar' AND ocurrido_en < %(hasta)s
+    )
+    SELECT tramo,
+           COUNT(duracion) AS completados,
+           COUNT(*) - COUNT(duracion) AS abiertos,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM duracion)) / 3600 AS p50_horas,
+           percentile_cont(0.9) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM duracion)) / 3600 AS p90_horas,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM duracion)) / 3600 AS p95_horas,
+           EXTRACT(EPOCH FROM MAX(duracion)) / 3600 AS max_horas
+    FROM tramos
+    GROUP BY orden, tramo
+    ORDER BY orden;
+"""
+
+# Versión de los datos de facturas para los cachés de analítica: cambia con cada escritura
+# (updated_at) y con cada eliminación o archivo (facturas_eliminadas); ambas columnas están indexadas.
+SQL_VERSION_DATOS_FACTURAS = """
+    SELECT (SELECT MAX(updated_at) FROM facturas), (SELECT MAX(eliminada_en) FROM facturas_eliminadas);
+"""
+
+# Pareto de devoluciones por tipo de error (activas y archivadas con tipo_error, por mes de generación)
+# en una sola agrupación: total, por EPS, legalizador, área y mes, y legalizador dentro de cada EPS
+# para el detalle. participacion y acumulado son relativos a cada grupo, tipos de mayor a menor.
+SQL_PARETO_TIPO_ERROR = """
+    WITH devoluciones AS (
+        SELECT tipo_error, eps, facturador, area_servicio, date_trunc('month', fecha_generacion)::date AS mes
+        FROM facturas
+        WHERE tipo_error IS NOT NULL AND tipo_error <> '' AND fecha_generacion BETWEEN %(desde)s AND %(hasta)s
+        UNION ALL
+        SELECT tipo_error, eps, facturador, area_servicio, date_trunc('month', fecha_generacion)::date
+        FROM facturas_historico
+        WHERE tipo_error IS NOT NULL AND tipo_error <> '' AND fecha_generacion BETWEEN %(desde)s AND %(hasta)s
+    ), conteos AS (
+        SELECT
+            CASE GROUPING(eps, facturador, area_servicio, mes)
+                WHEN 15 THEN 'total' WHEN 7 THEN 'eps' WHEN 11 THEN 'facturador'
+                WHEN 13 THEN 'area_servicio' WHEN 14 THEN 'mes' WHEN 3 THEN 'eps_facturador'
+            END AS agrupacion,
+            eps, facturador, area_servicio, mes, tipo_error, COUNT(*) AS devoluciones
+        FROM devoluciones
+        GROUP BY GROUPING SETS (
+            (tipo_error), (eps, tipo_error), (facturador, tipo_error),
+            (area_servicio, tipo_error), (mes, tipo_error), (eps, facturador, tipo_error)
+        )
+    )
+    SELECT agrupacion, eps, facturador, area_servicio, mes, tipo_error, devoluciones,
+           devoluciones::numeric / SUM(devoluciones) OVER grupo AS participacion,
+           SUM(devoluciones) OVER (grupo ORDER BY devoluciones DESC, tipo_error ROWS UNBOUNDED PRECEDING)::numeric
+               / SUM(devoluciones) OVER grupo AS acumulado
+    FROM conteos
+    WINDOW grupo AS (PARTITION BY agrupacion, eps, facturador, area_servicio, mes)
+    ORDER BY agrupacion, eps, facturador, area_servicio, mes, devoluciones DESC, tipo_error;
+"""
+
+SQL_OBTENER_EVENTOS_FACTURA = """
+    SELECT tipo, estado_anterior, estado_nuevo, ocurrido_en, usuario
+    FROM facturas_eventos
+    WHERE factura_id = %s
+    ORDER BY ocurrido_en, id;
+"""
+
+SQL_OBTENER_CONTEO_FACTURAS_POR_LEGALIZADOR_Y_EPS = """
+    SELECT facturador, eps, COUNT(id)
+    FROM facturas
+    WHERE estado_auditoria = 'Pendiente'
+    GROUP BY facturador, eps
+    ORDER BY facturador, eps;
+"""
+
+SQL_OBTENER_CONTEO_FACTURAS_LISTA_PARA_RADICAR = "SELECT COUNT(id) FROM facturas WHERE estado_auditoria = 'Lista para Radicar';"
+
+SQL_OBTENER_CONTEO_FACTURAS_EN_RADICADOR = "SELECT COUNT(id) FROM facturas WHERE estado_auditoria = 'En Radicador';"
+
+SQL_OBTENER_CONTEO_FACTURAS_CON_ERRORES = """
+    SELECT COUNT(id) FROM facturas
+    WHERE estado_auditoria IN ('Devuelta por Auditor', 'Corregida por Legalizador');
+"""
+
+SQL_OBTENER_CONTEO_FACTURAS_PENDIENTES_GLOBAL = "SELECT COUNT(id) FROM facturas WHERE estado_auditoria = 'Pendiente';"
+
+# Las que la tabla muestra como "Refacturar": al menos un día hábil vencido, es decir, fecha límite
+# en o antes del último día hábil anterior a hoy (parámetro, calculado con los festivos de la app).
+SQL_OBTENER_CONTEO_FACTURAS_VENCIDAS = "SELECT COUNT(id) FROM facturas WHERE fecha_limite_liquidacion <= %s;"
+
+# Facturas por entregar al radicador (idx_facturas_pendientes_radicador). {filtro}: vacío o "AND f.<columna> ILIKE %s".
+SQL_OBTENER_IDS_PENDIENTES_RADICADOR = """
+    SELECT f.id FROM facturas f
+    WHERE f.fecha_entrega_radicador IS NULL AND f.estado_auditoria IN ('Lista para Radicar', 'En Radicador') {filtro}
+    ORDER BY f.id;
+"""
+
+SQL_OBTENER_CONTEO_TOTAL_FACTURAS = "SELECT COUNT(id) FROM facturas;"
+
+SQL_OBTENER_FACTURADORES_UNICOS = "SELECT DISTINCT facturador FROM facturas WHERE facturador IS NOT NULL ORDER BY facturador;"
+
+SQL_OBTENER_EPS_UNICAS = "SELECT DISTINCT eps FROM facturas WHERE eps IS NOT NULL ORDER BY eps;"
+
+SQL_OBTENER_LOTES_UNICOS = """
+    SELECT DISTINCT lote_carga_masiva 
+    FROM facturas 
+    WHERE lote_carga_masiva IS NOT NULL
+    -- REMUEVE el filtro por estado para ver TODO
+    ORDER BY lote_carga_masiva DESC;
+"""
+
+SQL_CARGAR_FACTURAS_POR_LOTE = """
+    SELECT
+        f.id, f.numero_factura, f.area_servicio, f.facturador, f.fecha_generacion, f.eps,
+        f.fecha_hora_entrega, f.tiene_correccion, f.descripcion_devolucion,
+        f.fecha_devolucion_lider, f.revisado, f.factura_original_id, f.estado,
+        f.reemplazada_por_numero_factura, f.estado_auditoria, f.observacion_auditor,
+        f.tipo_error, f.fecha_reemplazo, f.fecha_entrega_radicador, f.lote_carga_masiva,
+        fo.numero_factura AS num_fact_original_linked,
+        fo.fecha_generacion AS fecha_gen_original_linked
+    FROM facturas f
+    LEFT JOIN facturas fo ON f.factura_original_id = fo.id
+    WHERE f.lote_carga_masiva = %s
+    ORDER BY f.id;
+"""
+
+SQL_OBTENER_ULTIMO_NUMERO_LOTE = """
+    SELECT MAX(CAST(
+        REGEXP_REPLACE(lote_carga_masiva, '[^0-9]', '', 'g') AS INTEGER
+    ))
+    FROM facturas
+    WHERE lote_carga_masiva IS NOT NULL 
+    AND lote_carga_masiva ~ '[0-9]';  -- Solo filas que contengan al menos un dígito
+"""
+
+SQL_REPARAR_SECUENCIA_IDS = """
+    SELECT setval(pg_get_serial_sequence('facturas', 'id'), 
+    COALESCE(MAX(id), 0) + 1, false) FROM facturas;
+"""
+
+SQL_OBTENER_DATOS_CARGA_POR_LOTE = """
+    SELECT * FROM facturas 
+    WHERE lote_carga_masiva = %s 
+    ORDER BY id;
+"""
+
+def _invalidar_facturas(factura_ids):
+    """Olvida del mapa de identidad del rerun las facturas escritas (y los reemplazos que las muestran)."""
+    mapa_identidad.invalidar('factura', factura_ids, campo_referencia='factura_original_id')
 
 def crear_tablas():
-    try:
-        with DatabaseConnection() as conn:
-            if conn is None:
-                logging.error("No se pudo obtener una conexión a la base de datos.")
-                return
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS usuarios (
-                        id SERIAL PRIMARY KEY,
-                        username TEXT NOT NULL UNIQUE,
-                        password TEXT NOT NULL, -- NOTA: En un entorno real, esto DEBE ser un hash de la contraseña.
-                        role TEXT NOT NULL
-                    );
-                """)
-                cursor.execute("""
-                    INSERT INTO usuarios (username, password, role) VALUES ('legalizador', 'legalizador123', 'legalizador')
-                    ON CONFLICT (username) DO NOTHING;
-                """)
-                cursor.execute("""
-                    INSERT INTO usuarios (username, password, role) VALUES ('auditor', 'auditor123', 'auditor')
-                    ON CONFLICT (username) DO NOTHING;
-                """)
-
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS facturas (
-                        id SERIAL PRIMARY KEY,
-                        numero_factura TEXT NOT NULL,
-                        area_servicio TEXT,
-                        facturador TEXT,
-                        fecha_generacion DATE,
-                        eps TEXT,
-                        fecha_hora_entrega TIMESTAMP,
-                        tiene_correccion BOOLEAN DEFAULT FALSE,
-                        descripcion_devolucion TEXT,
-                        fecha_devolucion_lider DATE,
-                        revisado BOOLEAN DEFAULT FALSE,
-                        factura_original_id INTEGER,
-                        estado TEXT DEFAULT 'Activa',
-                        reemplazada_por_numero_factura TEXT,
-                        estado_auditoria TEXT DEFAULT 'Pendiente', -- Valor por defecto inicial
-                        observacion_auditor TEXT,
-                        tipo_error TEXT,
-                        fecha_reemplazo DATE,
-                        fecha_entrega_radicador TIMESTAMP,
-                        lote_carga_masiva TEXT,
-                        FOREIGN KEY (factura_original_id) REFERENCES facturas(id),
-                        CONSTRAINT unique_factura_details UNIQUE (numero_factura, facturador, eps, area_servicio)
-                    );
-                """)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS detalles_soat (
-                        id SERIAL PRIMARY KEY,
-                        factura_id INTEGER UNIQUE,
-                        fecha_generacion_soat DATE,
-                        FOREIGN KEY (factura_id) REFERENCES facturas(id) ON DELETE CASCADE
-                    );
-                """)
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_facturas_numero_factura ON facturas (numero_factura);")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_facturas_facturador ON facturas (facturador);")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_facturas_eps ON facturas (eps);")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_facturas_area_servicio ON facturas (area_servicio);")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_facturas_estado_auditoria ON facturas (estado_auditoria);")
-
-                logging.info("Tablas verificadas/creadas, usuarios predeterminados e índices insertados.")
-    except Error as e:
-        logging.error(f"Error al crear tablas, insertar usuarios o índices: {e}")
+    # El DDL vive ahora en backend/migraciones.py y se aplica una sola vez por versión.
+    from backend import migraciones
+    return migraciones.aplicar_migraciones()
 
+@grabacion.grabar()
 def obtener_credenciales_usuario(username):
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return None
             with conn.cursor() as cursor:
-                cursor.execute("SELECT password, role FROM usuarios WHERE username = %s;", (username,))
+                sentencias_preparadas.registro.ejecutar(cursor, 'obtener_credenciales_usuario', SQL_OBTENER_CREDENCIALES_USUARIO, (username,))
                 user_data = cursor.fetchone()
                 logging.info(f"Credenciales de usuario obtenidas para '{username}'.")
                 return user_data
@@ -129,84 +730,67 @@ def obtener_credenciales_usuario(username):
         logging.error(f"Error al obtener credenciales del usuario '{username}': {e}")
         return None
 
-def guardar_factura(numero_factura, area_servicio, facturador, fecha_generacion, eps, fecha_hora_entrega, estado_auditoria="Pendiente", lote_carga_masiva=None):
+@grabacion.grabar()
+def crear_factura(numero_factura, area_servicio, facturador, fecha_generacion, eps, fecha_hora_entrega, estado_auditoria="Pendiente"):
+    """
+    Guarda una factura individual (con su detalle SOAT si aplica) en una sola sentencia.
+    Retorna ('creada', fila completa), ('duplicada', None) si el número ya existe, o ('error', None).
+    """
+    parametros = {
+        'numero_factura': numero_factura, 'area_servicio': area_servicio, 'facturador': facturador,
+        'fecha_generacion': fecha_generacion, 'eps': eps, 'fecha_hora_entrega': fecha_hora_entrega,
+        'estado_auditoria': estado_auditoria,
+    }
     try:
         with DatabaseConnection() as conn:
-            if conn is None: return None
+            if conn is None: return 'error', None
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO facturas (numero_factura, area_servicio, facturador, fecha_generacion, eps, fecha_hora_entrega, estado_auditoria, lote_carga_masiva)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;
-                """, (numero_factura, area_servicio, facturador, fecha_generacion, eps, fecha_hora_entrega, estado_auditoria, lote_carga_masiva))
-                factura_id = cursor.fetchone()[0]
-                logging.info(f"Factura '{numero_factura}' guardada con ID: {factura_id}. Estado: {estado_auditoria}, Lote: {lote_carga_masiva}")
-                return factura_id
+                cursor.execute(_con_usuario(cursor, SQL_CREAR_FACTURA), parametros)
+                fila = cursor.fetchone()
+                if fila is None:
+                    logging.warning(f"Intento de guardar factura duplicada: el número '{numero_factura}' ya existe.")
+                    return 'duplicada', None
+                factura_data = dict(zip([desc[0] for desc in cursor.description], fila))
+                logging.info(f"Factura '{numero_factura}' guardada con ID: {factura_data['id']}. Estado: {estado_auditoria}")
+                mapa_identidad.guardar('factura', factura_data['id'], factura_data)
+                return 'creada', factura_data
     except errors.UniqueViolation as e:
-        logging.warning(f"Intento de guardar factura duplicada. La combinación (Número de Factura: '{numero_factura}', Legalizador: '{facturador}', EPS: '{eps}', Área de Servicio: '{area_servicio}') ya existe.")
-        raise e 
+        # Dos altas simultáneas del mismo número con distinto legalizador/EPS pasan ambas el NOT EXISTS.
+        logging.warning(f"Intento de guardar factura duplicada '{numero_factura}' (alta concurrente): {e}")
+        return 'duplicada', None
     except Error as e:
         logging.error(f"Error al guardar factura '{numero_factura}': {e}")
-        raise e
-
-def guardar_detalles_soat(factura_id, fecha_generacion_soat):
-    try:
-        with DatabaseConnection() as conn:
-            if conn is None: return False
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO detalles_soat (factura_id, fecha_generacion_soat)
-                    VALUES (%s, %s);
-                """, (factura_id, fecha_generacion_soat))
-                logging.info(f"Detalles SOAT guardados para factura ID: {factura_id}")
-                return True
-    except Error as e:
-        logging.error(f"Error al guardar detalles SOAT para factura ID: {factura_id}: {e}")
-        return False
+        return 'error', None
 
+@grabacion.grabar()
 def obtener_factura_por_id(factura_id):
+    factura_data = mapa_identidad.obtener('factura', factura_id)
+    if factura_data is not None:
+        return factura_data
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return None
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT
-                        f.id, f.numero_factura, f.area_servicio, f.facturador, f.fecha_generacion, f.eps,
-                        f.fecha_hora_entrega, f.tiene_correccion, f.descripcion_devolucion,
-                        f.fecha_devolucion_lider, f.revisado, f.factura_original_id, f.estado,
-                        f.reemplazada_por_numero_factura, f.estado_auditoria, f.observacion_auditor,
-                        f.tipo_error, f.fecha_reemplazo, f.fecha_entrega_radicador,
-                        fo.numero_factura AS num_fact_original_linked,
-                        fo.fecha_generacion AS fecha_gen_original_linked
-                    FROM facturas f
-                    LEFT JOIN facturas fo ON f.factura_original_id = fo.id
-                    WHERE f.id = %s;
-                """, (factura_id,))
+                sentencias_preparadas.registro.ejecutar(cursor, 'obtener_factura_por_id', SQL_OBTENER_FACTURA_POR_ID, (factura_id,))
                 column_names = [desc[0] for desc in cursor.description]
                 factura_data_tuple = cursor.fetchone()
                 if factura_data_tuple:
                     factura_data = dict(zip(column_names, factura_data_tuple))
                     logging.info(f"Factura ID: {factura_id} obtenida.")
+                    mapa_identidad.guardar('factura', factura_id, factura_data)
                     return factura_data
                 return None
     except Error as e:
         logging.error(f"Error al obtener factura por ID {factura_id}: {e}")
         return None
 
+@grabacion.grabar()
 def obtener_factura_por_numero(numero_factura):
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return None
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT
-                        id, numero_factura, area_servicio, facturador, fecha_generacion, eps,
-                        fecha_hora_entrega, tiene_correccion, descripcion_devolucion,
-                        fecha_devolucion_lider, revisado, factura_original_id, estado,
-                        reemplazada_por_numero_factura, estado_auditoria, observacion_auditor,
-                        tipo_error, fecha_reemplazo, fecha_entrega_radicador
-                    FROM facturas
-                    WHERE numero_factura = %s;
-                """, (numero_factura,))
+                sentencias_preparadas.registro.ejecutar(cursor, 'obtener_factura_por_numero', SQL_OBTENER_FACTURA_POR_NUMERO, (numero_factura,))
                 column_names = [desc[0] for desc in cursor.description]
                 factura_data_tuple = cursor.fetchone()
                 if factura_data_tuple:
@@ -218,16 +802,13 @@ def obtener_factura_por_numero(numero_factura):
         logging.error(f"Error al obtener factura por número {numero_factura}: {e}")
         return None
 
+@grabacion.grabar()
 def obtener_detalles_soat_por_factura_id(factura_id):
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return None
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT id, factura_id, fecha_generacion_soat
-                    FROM detalles_soat
-                    WHERE factura_id = %s;
-                """, (factura_id,))
+                sentencias_preparadas.registro.ejecutar(cursor, 'obtener_detalles_soat_por_factura_id', SQL_OBTENER_DETALLES_SOAT_POR_FACTURA_ID, (factura_id,))
                 column_names = [desc[0] for desc in cursor.description]
                 soat_details_tuple = cursor.fetchone()
 
@@ -240,55 +821,69 @@ def obtener_detalles_soat_por_factura_id(factura_id):
         logging.error(f"Error al obtener detalles SOAT por factura ID {factura_id}: {e}")
         return None
 
-def actualizar_factura(factura_id, numero_factura, area_servicio, facturador, fecha_generacion, eps,
-                       fecha_hora_entrega, tiene_correccion, descripcion_devolucion,
-                       fecha_devolucion_lider, revisado, factura_original_id, estado,
-                       reemplazada_por_numero_factura, estado_auditoria, observacion_auditor, tipo_error, fecha_reemplazo):
+@grabacion.grabar()
+def actualizar_factura_parcial(factura_id, version_esperada, cambios):
+    """
+    Escribe solo las columnas de `cambios` (dict columna -> valor) si la factura sigue en
+    `version_esperada`, en un solo viaje. Retorna (resultado, factura):
+    ('actualizada', fila nueva), ('conflicto', fila vigente), ('no_encontrada', None),
+    ('sin_cambios', None), ('duplicada', None) o ('error', None).
+    """
+    desconocidas = set(cambios) - set(COLUMNAS_EDITABLES_FACTURA)
+    if desconocidas:
+        raise ValueError(f"Columnas no editables: {sorted(desconocidas)}")
+    if not cambios:
+        return 'sin_cambios', None
+    asignaciones = ", ".join(f"{columna} = %s" for columna in cambios)
     try:
         with DatabaseConnection() as conn:
-            if conn is None: return False
+            if conn is None: return 'error', None
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE facturas SET
-                        numero_factura = %s, area_servicio = %s, facturador = %s, fecha_generacion = %s, eps = %s,
-                        fecha_hora_entrega = %s, tiene_correccion = %s, descripcion_devolucion = %s,
-                        fecha_devolucion_lider = %s, revisado = %s, factura_original_id = %s, estado = %s,
-                        reemplazada_por_numero_factura = %s, estado_auditoria = %s, observacion_auditor = %s,
-                        tipo_error = %s, fecha_reemplazo = %s
-                    WHERE id = %s;
-                """, (numero_factura, area_servicio, facturador, fecha_generacion, eps,
-                      fecha_hora_entrega, tiene_correccion, descripcion_devolucion,
-                      fecha_devolucion_lider, revisado, factura_original_id, estado,
-                      reemplazada_por_numero_factura, estado_auditoria, observacion_auditor, tipo_error, fecha_reemplazo,
-                      factura_id))
-                if cursor.rowcount == 0:
-                    logging.warning(f"No se encontró la factura ID: {factura_id} para actualizar o no hubo cambios.")
-                    return False
-                logging.info(f"Factura ID: {factura_id} actualizada correctamente.")
-                return True
+                cursor.execute(_con_usuario(cursor, SQL_ACTUALIZAR_FACTURA_PARCIAL.format(asignaciones=asignaciones)),
+                               (*cambios.values(), factura_id, version_esperada))
+                fila = cursor.fetchone()
+                column_names = [desc[0] for desc in cursor.description]
+                if fila:
+                    logging.info(f"Factura ID: {factura_id} actualizada ({', '.join(cambios)}); versión {fila[column_names.index('version')]}.")
+                    factura_data = dict(zip(column_names, fila))
+                    _invalidar_facturas([factura_id])
+                    mapa_identidad.guardar('factura', factura_id, factura_data)
+                    return 'actualizada', factura_data
+
+                # Solo en el caso raro de que nada coincida: distinguir conflicto de factura inexistente.
+                cursor.execute(SQL_OBTENER_FACTURA_POR_ID, (factura_id,))
+                vigente = cursor.fetchone()
+                _invalidar_facturas([factura_id])
+                if vigente is None:
+                    logging.warning(f"No se encontró la factura ID: {factura_id} para actualizar.")
+                    return 'no_encontrada', None
+                vigente = dict(zip([desc[0] for desc in cursor.description], vigente))
+                mapa_identidad.guardar('factura', factura_id, vigente)
+                logging.warning(f"Conflicto al actualizar la factura ID: {factura_id}: se esperaba la versión "
+                                f"{version_esperada} y la vigente es {vigente['version']}.")
+                return 'conflicto', vigente
     except errors.UniqueViolation as e:
-        logging.warning(f"Intento de actualizar factura con combinación duplicada: (Número: '{numero_factura}', Legalizador: '{facturador}', EPS: '{eps}', Área: '{area_servicio}')")
-        return False
+        logging.warning(f"Intento de actualizar la factura ID: {factura_id} a una combinación duplicada: {cambios}")
+        return 'duplicada', None
     except Error as e:
-        logging.error(f"Error al actualizar factura ID: {factura_id}: {e}")
-        return False
+        logging.error(f"Error al actualizar parcialmente la factura ID: {factura_id}: {e}")
+        return 'error', None
 
+@grabacion.grabar()
 def actualizar_estado_auditoria_factura(factura_id, nuevo_estado_auditoria, observacion, tipo_error):
     try:
         with DatabaseConnection() as conn:
             if conn is None: return False
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE facturas SET
-                        estado_auditoria = %s, observacion_auditor = %s, tipo_error = %s
-                    WHERE id = %s;
-                """, (nuevo_estado_auditoria, observacion, tipo_error, factura_id))
+                cursor.execute(_con_usuario(cursor, SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURA), (nuevo_estado_auditoria, observacion, tipo_error, factura_id))
                 logging.info(f"Estado de auditoría de factura ID: {factura_id} actualizado a '{nuevo_estado_auditoria}'.")
+                _invalidar_facturas([factura_id])
                 return True
     except Error as e:
         logging.error(f"Error al actualizar estado de auditoría de factura ID: {factura_id}: {e}")
         return False
 
+@grabacion.grabar()
 def actualizar_fecha_entrega_radicador(factura_id, fecha_entrega):
     try:
         with DatabaseConnection() as conn:
@@ -299,15 +894,15 @@ def actualizar_fecha_entrega_radicador(factura_id, fecha_entrega):
                 else:
                     new_estado_auditoria = "Lista para Radicar"
                 
-                cursor.execute("""
-                    UPDATE facturas SET fecha_entrega_radicador = %s, estado_auditoria = %s WHERE id = %s;
-                """, (fecha_entrega, new_estado_auditoria, factura_id))
+                cursor.execute(_con_usuario(cursor, SQL_ACTUALIZAR_FECHA_ENTREGA_RADICADOR), (fecha_entrega, new_estado_auditoria, factura_id))
                 logging.info(f"Fecha de entrega al radicador para factura ID: {factura_id} actualizada. Nuevo estado: {new_estado_auditoria}")
+                _invalidar_facturas([factura_id])
                 return True
     except Error as e:
         logging.error(f"Error al actualizar fecha de entrega al radicador para factura ID: {factura_id}: {e}")
         return False
 
+@grabacion.grabar()
 def entregar_facturas_radicador(factura_ids, fecha_entrega):
     try:
         if not factura_ids:
@@ -319,50 +914,68 @@ def entregar_facturas_radicador(factura_ids, fecha_entrega):
                 logging.error("No se pudo obtener conexión para entrega masiva al radicador.")
                 return 0
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE facturas SET
-                        fecha_entrega_radicador = %s,
-                        estado_auditoria = CASE
-                            WHEN estado_auditoria = 'Lista para Radicar' AND %s IS NOT NULL THEN 'En Radicador'
-                            WHEN estado_auditoria = 'En Radicador' AND %s IS NULL THEN 'Lista para Radicar'
-                            ELSE estado_auditoria
-                        END
-                    WHERE id = ANY(%s);
-                """, (fecha_entrega, fecha_entrega, fecha_entrega, factura_ids))
+                cursor.execute(_con_usuario(cursor, SQL_ENTREGAR_FACTURAS_RADICADOR), (fecha_entrega, fecha_entrega, fecha_entrega, factura_ids))
                 updated_count = cursor.rowcount
                 logging.info(f"Entrega masiva al radicador: {updated_count} facturas actualizadas.")
+                _invalidar_facturas(factura_ids)
                 return updated_count
     except Error as e:
         logging.error(f"Error en entrega masiva al radicador: {e}")
         return 0
 
+@grabacion.grabar()
+def aplicar_auditoria_masiva(ids_aprobadas, devoluciones):
+    """
+    Aprueba y devuelve facturas de un lote en una sola transacción.
+    `devoluciones` es una lista de tuplas (factura_id, tipo_error, observacion).
+    Retorna (aprobadas, devueltas).
+    """
+    if not ids_aprobadas and not devoluciones:
+        return 0, 0
+    try:
+        with DatabaseConnection() as conn:
+            if conn is None: return 0, 0
+            with conn.cursor() as cursor:
+                aprobadas = 0
+                devueltas = 0
+                if ids_aprobadas:
+                    cursor.execute(_con_usuario(cursor, SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURAS), ("Lista para Radicar", None, None, list(ids_aprobadas)))
+                    aprobadas = cursor.rowcount
+                if devoluciones:
+                    execute_values(cursor, _con_usuario(cursor, SQL_DEVOLVER_FACTURAS), devoluciones,
+                                   template="(%s::INTEGER, %s, %s)", page_size=len(devoluciones))
+                    devueltas = cursor.rowcount
+                logging.info(f"Auditoría masiva aplicada: {aprobadas} aprobadas, {devueltas} devueltas.")
+                _invalidar_facturas(list(ids_aprobadas) + [devolucion[0] for devolucion in devoluciones])
+                return aprobadas, devueltas
+    except Error as e:
+        logging.error(f"Error al aplicar auditoría masiva: {e}")
+        return 0, 0
+
+@grabacion.grabar()
 def eliminar_factura(factura_id):
     try:
         with DatabaseConnection() as conn:
             if conn is None: return False
             with conn.cursor() as cursor:
-                cursor.execute("DELETE FROM facturas WHERE id = %s;", (factura_id,))
+                cursor.execute(_con_usuario(cursor, SQL_ELIMINAR_FACTURA), (factura_id,))
                 logging.info(f"Factura ID: {factura_id} eliminada correctamente.")
+                _invalidar_facturas([factura_id])
                 return True
     except Error as e:
         logging.error(f"Error al eliminar factura ID: {factura_id}: {e}")
         return False
 
+@grabacion.grabar()
 def guardar_factura_reemplazo(old_factura_id, new_numero_factura, fecha_reemplazo):
     try:
         with DatabaseConnection() as conn:
             if conn is None:
                 return False
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE facturas SET
-                        estado = 'Reemplazada',
-                        reemplazada_por_numero_factura = %s,
-                        fecha_reemplazo = %s,
-                        estado_auditoria = 'Pendiente'
-                    WHERE id = %s;
-                """, (new_numero_factura, fecha_reemplazo, old_factura_id))
+                cursor.execute(_con_usuario(cursor, SQL_GUARDAR_FACTURA_REEMPLAZO), (new_numero_factura, fecha_reemplazo, old_factura_id))
                 logging.info(f"Factura ID: {old_factura_id} actualizada como reemplazada con el nuevo número: {new_numero_factura}.")
+                _invalidar_facturas([old_factura_id])
                 return True
     except errors.UniqueViolation as e:
         logging.warning(f"Intento de actualizar factura con combinación duplicada: (Número: '{new_numero_factura}')")
@@ -371,29 +984,82 @@ def guardar_factura_reemplazo(old_factura_id, new_numero_factura, fecha_reemplaz
         logging.error(f"Error al actualizar factura de reemplazo para ID original {old_factura_id}: {e}")
         return False
 
-def cargar_facturas(search_term=None, search_column=None):
+@grabacion.grabar()
+def obtener_numeros_factura_existentes(numeros_factura):
+    if not numeros_factura:
+        return set()
+    try:
+        with DatabaseConnection() as conn:
+            if conn is None: return set()
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_OBTENER_NUMEROS_FACTURA_EXISTENTES, {'numeros': list(numeros_factura)})
+                existentes = {row[0] for row in cursor.fetchall()}
+                logging.info(f"{len(existentes)} de {len(numeros_factura)} números de factura ya existen.")
+                return existentes
+    except Error as e:
+        logging.error(f"Error al verificar números de factura existentes: {e}")
+        raise e
+
+@grabacion.grabar()
+def guardar_facturas_masivo(facturas, area_servicio, facturador, eps, estado_auditoria, lote_carga_masiva, fecha_hora_entrega):
+    """
+    Inserta una carga masiva en una sola transacción. `facturas` es una lista de
+    tuplas (numero_factura, fecha_generacion). Las combinaciones duplicadas se omiten.
+    Retorna un dict numero_factura -> id de las facturas insertadas.
+    """
+    if not facturas:
+        return {}
     try:
         with DatabaseConnection() as conn:
+            if conn is None: return {}
+            with conn.cursor() as cursor:
+                filas = [(numero, area_servicio, facturador, fecha_generacion, eps, fecha_hora_entrega, estado_auditoria, lote_carga_masiva)
+                         for numero, fecha_generacion in facturas]
+                insertadas = execute_values(cursor, _con_usuario(cursor, SQL_GUARDAR_FACTURAS_MASIVO), filas, page_size=len(filas), fetch=True)
+                ids_por_numero = {numero: factura_id for factura_id, numero in insertadas}
+
+                if area_servicio == "SOAT" and ids_por_numero:
+                    detalles = [(ids_por_numero[numero], fecha_generacion)
+                                for numero, fecha_generacion in facturas if numero in ids_por_numero]
+                    execute_values(cursor, SQL_GUARDAR_DETALLES_SOAT_MASIVO, detalles, page_size=len(detalles))
+
+                logging.info(f"Carga masiva del lote {lote_carga_masiva}: {len(ids_por_numero)} de {len(facturas)} facturas insertadas.")
+                return ids_por_numero
+    except Error as e:
+        logging.error(f"Error en la carga masiva del lote {lote_carga_masiva}: {e}")
+        raise e
+
+@grabacion.grabar()
+def obtener_estados_auditoria_por_ids(factura_ids):
+    if not factura_ids:
+        return {}
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return {}
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_OBTENER_ESTADOS_AUDITORIA_POR_IDS, (list(factura_ids),))
+                return dict(cursor.fetchall())
+    except Error as e:
+        logging.error(f"Error al obtener estados de auditoría por IDs: {e}")
+        return {}
+
+def _consulta_cargar_facturas(search_term, search_column):
+    query = SQL_CARGAR_FACTURAS
+    params = []
+    if search_term and search_column:
+        query += f" WHERE f.{search_column} ILIKE %s"
+        params.append(f"%{search_term}%")
+    query += " ORDER BY f.id DESC;"
+    return query, tuple(params)
+
+@grabacion.grabar(conservar=('search_column',))
+def cargar_facturas(search_term=None, search_column=None):
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return []
             with conn.cursor() as cursor:
-                query = """
-                    SELECT
-                        f.id, f.numero_factura, f.area_servicio, f.facturador, f.fecha_generacion, f.eps,
-                        f.fecha_hora_entrega, f.tiene_correccion, f.descripcion_devolucion,
-                        f.fecha_devolucion_lider, f.revisado, f.factura_original_id, f.estado,
-                        f.reemplazada_por_numero_factura, f.estado_auditoria, f.observacion_auditor,
-                        f.tipo_error, f.fecha_reemplazo, f.fecha_entrega_radicador,
-                        fo.numero_factura AS num_fact_original_linked,
-                        fo.fecha_generacion AS fecha_gen_original_linked
-                    FROM facturas f
-                    LEFT JOIN facturas fo ON f.factura_original_id = fo.id
-                """
-                params = []
-                if search_term and search_column:
-                    query += f" WHERE f.{search_column} ILIKE %s"
-                    params.append(f"%{search_term}%")
-                query += " ORDER BY f.id DESC;"
-                cursor.execute(query, tuple(params))
+                query, params = _consulta_cargar_facturas(search_term, search_column)
+                cursor.execute(query, params)
                 column_names = [desc[0] for desc in cursor.description]
                 facturas_raw = cursor.fetchall()
                 facturas = [dict(zip(column_names, row)) for row in facturas_raw]
@@ -403,18 +1069,224 @@ def cargar_facturas(search_term=None, search_column=None):
         logging.error(f"Error al cargar facturas: {e}")
         return []
 
+@grabacion.grabar(conservar=('search_column',))
+def cargar_facturas_con_marca(search_term=None, search_column=None):
+    """Como cargar_facturas, más la marca de tiempo del servidor desde la que pedir cambios. ([], None) si falla."""
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return [], None
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_MARCA_TIEMPO_SERVIDOR)
+                marca = cursor.fetchone()[0]
+                query, params = _consulta_cargar_facturas(search_term, search_column)
+                cursor.execute(query, params)
+                column_names = [desc[0] for desc in cursor.description]
+                facturas = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                logging.info(f"Cargadas {len(facturas)} facturas (marca {marca}).")
+                return facturas, marca
+    except Error as e:
+        logging.error(f"Error al cargar facturas con marca de tiempo: {e}")
+        return [], None
+
+@grabacion.grabar()
+def cargar_cambios_facturas(desde):
+    """
+    Facturas creadas o modificadas y IDs eliminados desde la marca `desde` (con margen de solape).
+    Retorna {'facturas', 'eliminadas', 'marca'} con la nueva marca, o None si falla.
+    """
+    desde_con_margen = desde - timedelta(seconds=MARGEN_CAMBIOS_S)
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return None
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_MARCA_TIEMPO_SERVIDOR)
+                marca = cursor.fetchone()[0]
+                cursor.execute(SQL_CARGAR_FACTURAS_CAMBIADAS, {'desde': desde_con_margen})
+                column_names = [desc[0] for desc in cursor.description]
+                facturas = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                cursor.execute(SQL_OBTENER_FACTURAS_ELIMINADAS, (desde_con_margen,))
+                eliminadas = [row[0] for row in cursor.fetchall()]
+                logging.info(f"Cambios desde {desde_con_margen}: {len(facturas)} facturas, {len(eliminadas)} eliminadas.")
+                return {'facturas': facturas, 'eliminadas': eliminadas, 'marca': marca}
+    except Error as e:
+        logging.error(f"Error al cargar los cambios de facturas desde {desde}: {e}")
+        return None
+
+@grabacion.grabar(conservar=('search_column',))
+def cargar_facturas_historico(search_term=None, search_column=None):
+    """Facturas archivadas que coinciden con la búsqueda (todas si no hay término), más recientes primero."""
+    query = SQL_CARGAR_FACTURAS_HISTORICO
+    params = []
+    if search_term and search_column:
+        query += f" WHERE f.{search_column} ILIKE %s"
+        params.append(f"%{search_term}%")
+    query += " ORDER BY f.id DESC;"
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return []
+            with conn.cursor() as cursor:
+                cursor.execute(query, tuple(params))
+                column_names = [desc[0] for desc in cursor.description]
+                facturas = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                logging.info(f"Cargadas {len(facturas)} facturas del histórico.")
+                return facturas
+    except Error as e:
+        logging.error(f"Error al cargar facturas del histórico: {e}")
+        return []
+
+@grabacion.grabar(conservar=('user_role',))
+def cargar_bandeja_trabajo(user_role, facturador=None, limite=LIMITE_BANDEJA):
+    """
+    Facturas que requieren acción del usuario: para un legalizador, sus devueltas y las próximas
+    a vencer (de todos si la cuenta no tiene facturador asociado); para un auditor, las pendientes
+    y corregidas. Retorna a lo sumo `limite` filas, más urgentes primero.
+    """
+    if user_role == 'auditor':
+        query = SQL_BANDEJA_AUDITOR
+        params = (limite,)
+    elif user_role == 'legalizador':
+        if facturador:
+            query = SQL_BANDEJA_LEGALIZADOR.format(filtro_facturador="AND f.facturador = %s")
+            params = (facturador, DIAS_HABILES_ALERTA_VENCIMIENTO, facturador, limite)
+        else:
+            query = SQL_BANDEJA_LEGALIZADOR.format(filtro_facturador="")
+            params = (DIAS_HABILES_ALERTA_VENCIMIENTO, limite)
+    else:
+        return []
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return []
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                column_names = [desc[0] for desc in cursor.description]
+                facturas = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                logging.info(f"Bandeja de {user_role} ({facturador or 'todos'}): {len(facturas)} facturas.")
+                return facturas
+    except Error as e:
+        logging.error(f"Error al cargar la bandeja de trabajo de {user_role}: {e}")
+        return []
+
+@grabacion.grabar(conservar=('search_column',))
+def cargar_pagina_facturas_por_urgencia(pagina, filas_por_pagina, search_term=None, search_column=None):
+    """
+    Retorna (facturas de la página, total de facturas que cumplen la búsqueda). Sin búsqueda
+    y con un período activo configurado solo se consideran las facturas de ese período.
+    """
+    filtro = ""
+    params = []
+    inicio = inicio_periodo_activo()
+    if search_term and search_column:
+        filtro = f"WHERE f.{search_column} ILIKE %s"
+        params.append(f"%{search_term}%")
+    elif inicio:
+        filtro = f"WHERE {FILTRO_PERIODO_ACTIVO}"
+        params.append(inicio)
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return [], 0
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_CARGAR_PAGINA_FACTURAS_POR_URGENCIA.format(filtro=filtro),
+                               (*params, filas_por_pagina, pagina * filas_por_pagina))
+                column_names = [desc[0] for desc in cursor.description]
+                facturas = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                cursor.execute(SQL_CONTAR_FACTURAS.format(filtro=filtro), tuple(params))
+                total = cursor.fetchone()[0]
+                logging.info(f"Página {pagina} por urgencia: {len(facturas)} de {total} facturas.")
+                return facturas, total
+    except Error as e:
+        logging.error(f"Error al cargar la página {pagina} de facturas por urgencia: {e}")
+        return [], 0
+
+@grabacion.grabar(conservar=('periodo', 'dimension'))
+def cargar_resumen_diario(desde, hasta, periodo='month', dimension=None):
+    """
+    Ingresadas, auditadas, devueltas, entregadas y suma de días hasta la entrega por período
+    ('day', 'week', 'month' o 'year') entre `desde` y `hasta`, desglosadas por `dimension`
+    (una de DIMENSIONES_RESUMEN) o en una sola serie 'Total' si es None.
+    """
+    if periodo not in PERIODOS_RESUMEN:
+        raise ValueError(f"Período no válido para el resumen: {periodo}")
+    if dimension is not None and dimension not in DIMENSIONES_RESUMEN:
+        raise ValueError(f"Dimensión no válida para el resumen: {dimension}")
+    query = SQL_CARGAR_RESUMEN_DIARIO.format(dimension=dimension or "'Total'")
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return []
+            with conn.cursor() as cursor:
+                cursor.execute(query, {'periodo': periodo, 'desde': desde, 'hasta': hasta})
+                column_names = [desc[0] for desc in cursor.description]
+                filas = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                logging.info(f"Resumen diario {desde} a {hasta} por {periodo}/{dimension or 'total'}: {len(filas)} filas.")
+                return filas
+    except Error as e:
+        logging.error(f"Error al cargar el resumen diario: {e}")
+        return []
+
+@grabacion.grabar()
+def cargar_sla_auditoria(desde, hasta):
+    """Percentiles (horas) de cada tramo del ciclo de auditoría que empezó entre `desde` y `hasta`."""
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return []
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_SLA_AUDITORIA, {'desde': desde, 'hasta': hasta})
+                column_names = [desc[0] for desc in cursor.description]
+                tramos = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                logging.info(f"SLA de auditoría {desde} a {hasta}: {len(tramos)} tramos.")
+                return tramos
+    except Error as e:
+        logging.error(f"Error al calcular el SLA de auditoría: {e}")
+        return []
+
+@grabacion.grabar()
+def obtener_version_datos_facturas():
+    """Par (última modificación, última eliminación) de facturas; None si falla."""
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return None
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_VERSION_DATOS_FACTURAS)
+                return tuple(cursor.fetchone())
+    except Error as e:
+        logging.error(f"Error al obtener la versión de los datos de facturas: {e}")
+        return None
+
+@grabacion.grabar()
+def cargar_pareto_tipo_error(desde, hasta):
+    """Devoluciones por tipo de error con su participación y acumulado en cada agrupación (ver SQL_PARETO_TIPO_ERROR)."""
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return []
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_PARETO_TIPO_ERROR, {'desde': desde, 'hasta': hasta})
+                column_names = [desc[0] for desc in cursor.description]
+                filas = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                logging.info(f"Pareto de tipos de error {desde} a {hasta}: {len(filas)} filas.")
+                return filas
+    except Error as e:
+        logging.error(f"Error al cargar el Pareto de tipos de error: {e}")
+        return []
+
+@grabacion.grabar()
+def obtener_eventos_factura(factura_id):
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return []
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_OBTENER_EVENTOS_FACTURA, (factura_id,))
+                column_names = [desc[0] for desc in cursor.description]
+                return [dict(zip(column_names, row)) for row in cursor.fetchall()]
+    except Error as e:
+        logging.error(f"Error al obtener los eventos de la factura ID: {factura_id}: {e}")
+        return []
+
+@grabacion.grabar()
 def obtener_conteo_facturas_por_legalizador_y_eps():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return []
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT facturador, eps, COUNT(id)
-                    FROM facturas
-                    WHERE estado_auditoria = 'Pendiente'
-                    GROUP BY facturador, eps
-                    ORDER BY facturador, eps;
-                """)
+                cursor.execute(SQL_OBTENER_CONTEO_FACTURAS_POR_LEGALIZADOR_Y_EPS)
                 stats = cursor.fetchall()
                 logging.info("Conteo de facturas pendientes por legalizador y EPS obtenido.")
                 return stats
@@ -422,12 +1294,13 @@ def obtener_conteo_facturas_por_legalizador_y_eps():
         logging.error(f"Error al obtener estadísticas de facturas pendientes: {e}")
         return []
 
+@grabacion.grabar()
 def obtener_conteo_facturas_lista_para_radicar():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return 0
             with conn.cursor() as cursor:
-                cursor.execute("SELECT COUNT(id) FROM facturas WHERE estado_auditoria = 'Lista para Radicar';")
+                cursor.execute(SQL_OBTENER_CONTEO_FACTURAS_LISTA_PARA_RADICAR)
                 count = cursor.fetchone()[0]
                 logging.info(f"Conteo de facturas Lista para Radicar: {count}")
                 return count
@@ -435,12 +1308,13 @@ def obtener_conteo_facturas_lista_para_radicar():
         logging.error(f"Error al obtener conteo de facturas Lista para Radicar: {e}")
         return 0
 
+@grabacion.grabar()
 def obtener_conteo_facturas_en_radicador():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return 0
             with conn.cursor() as cursor:
-                cursor.execute("SELECT COUNT(id) FROM facturas WHERE estado_auditoria = 'En Radicador';")
+                cursor.execute(SQL_OBTENER_CONTEO_FACTURAS_EN_RADICADOR)
                 count = cursor.fetchone()[0]
                 logging.info(f"Conteo de facturas En Radicador: {count}")
                 return count
@@ -448,15 +1322,13 @@ def obtener_conteo_facturas_en_radicador():
         logging.error(f"Error al obtener conteo de facturas En Radicador: {e}")
         return 0
 
+@grabacion.grabar()
 def obtener_conteo_facturas_con_errores():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return 0
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT COUNT(id) FROM facturas
-                    WHERE estado_auditoria IN ('Devuelta por Auditor', 'Corregida por Legalizador');
-                """)
+                cursor.execute(SQL_OBTENER_CONTEO_FACTURAS_CON_ERRORES)
                 count = cursor.fetchone()[0]
                 logging.info(f"Conteo de facturas con errores: {count}")
                 return count
@@ -464,12 +1336,13 @@ def obtener_conteo_facturas_con_errores():
         logging.error(f"Error al obtener conteo de facturas con errores: {e}")
         return 0
 
+@grabacion.grabar()
 def obtener_conteo_facturas_pendientes_global():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return 0
             with conn.cursor() as cursor:
-                cursor.execute("SELECT COUNT(id) FROM facturas WHERE estado_auditoria = 'Pendiente';")
+                cursor.execute(SQL_OBTENER_CONTEO_FACTURAS_PENDIENTES_GLOBAL)
                 count = cursor.fetchone()[0]
                 logging.info(f"Conteo total de facturas pendientes: {count}")
                 return count
@@ -477,15 +1350,13 @@ def obtener_conteo_facturas_pendientes_global():
         logging.error(f"Error al obtener conteo total de facturas pendientes: {e}")
         return 0
 
+@grabacion.grabar()
 def obtener_conteo_facturas_vencidas():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return 0
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT COUNT(id) FROM facturas
-                    WHERE estado = 'Vencidas' AND estado_auditoria NOT IN ('Devuelta por Auditor', 'Corregida por Legalizador', 'En Radicador');
-                """)
+                cursor.execute(SQL_OBTENER_CONTEO_FACTURAS_VENCIDAS, (dia_habil_anterior(date.today()),))
                 count = cursor.fetchone()[0]
                 logging.info(f"Conteo de facturas vencidas: {count}")
                 return count
@@ -493,12 +1364,31 @@ def obtener_conteo_facturas_vencidas():
         logging.error(f"Error al obtener conteo de facturas vencidas: {e}")
         return 0
 
+@grabacion.grabar(conservar=('search_column',))
+def obtener_ids_pendientes_radicador(search_term=None, search_column=None):
+    """IDs de las facturas listas para entregar al radicador, con el mismo filtro de búsqueda del listado."""
+    filtro = ""
+    params = ()
+    if search_term and search_column:
+        filtro = f"AND f.{search_column} ILIKE %s"
+        params = (f"%{search_term}%",)
+    try:
+        with DatabaseConnection(solo_lectura=True) as conn:
+            if conn is None: return []
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_OBTENER_IDS_PENDIENTES_RADICADOR.format(filtro=filtro), params)
+                return [fila[0] for fila in cursor.fetchall()]
+    except Error as e:
+        logging.error(f"Error al obtener las facturas pendientes de entrega al radicador: {e}")
+        return []
+
+@grabacion.grabar()
 def obtener_conteo_total_facturas():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return 0
             with conn.cursor() as cursor:
-                cursor.execute("SELECT COUNT(id) FROM facturas;")
+                cursor.execute(SQL_OBTENER_CONTEO_TOTAL_FACTURAS)
                 count = cursor.fetchone()[0]
                 logging.info(f"Conteo total de facturas: {count}")
                 return count
@@ -506,12 +1396,13 @@ def obtener_conteo_total_facturas():
         logging.error(f"Error al obtener conteo total de facturas: {e}")
         return 0
 
+@grabacion.grabar()
 def obtener_facturadores_unicos():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return []
             with conn.cursor() as cursor:
-                cursor.execute("SELECT DISTINCT facturador FROM facturas WHERE facturador IS NOT NULL ORDER BY facturador;")
+                cursor.execute(SQL_OBTENER_FACTURADORES_UNICOS)
                 facturadores = [row[0] for row in cursor.fetchall()]
                 logging.info("Facturadores únicos obtenidos.")
                 return facturadores
@@ -519,12 +1410,13 @@ def obtener_facturadores_unicos():
         logging.error(f"Error al obtener facturadores únicos: {e}")
         return []
 
+@grabacion.grabar()
 def obtener_eps_unicas():
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return []
             with conn.cursor() as cursor:
-                cursor.execute("SELECT DISTINCT eps FROM facturas WHERE eps IS NOT NULL ORDER BY eps;")
+                cursor.execute(SQL_OBTENER_EPS_UNICAS)
                 epss = [row[0] for row in cursor.fetchall()]
                 logging.info("EPS únicas obtenidas.")
                 return epss
@@ -532,19 +1424,14 @@ def obtener_eps_unicas():
         logging.error(f"Error al obtener EPS únicas: {e}")
         return []
 
+@grabacion.grabar()
 def obtener_lotes_unicos():
     """Obtiene TODOS los lotes de carga masiva registrados (DEBUGGING)"""
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return []
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT DISTINCT lote_carga_masiva 
-                    FROM facturas 
-                    WHERE lote_carga_masiva IS NOT NULL
-                    -- REMUEVE el filtro por estado para ver TODO
-                    ORDER BY lote_carga_masiva DESC;
-                """)
+                cursor.execute(SQL_OBTENER_LOTES_UNICOS)
                 lotes = [row[0] for row in cursor.fetchall()]
                 logging.info(f"DEBUG - Todos los lotes obtenidos: {len(lotes)}")
                 return lotes
@@ -552,25 +1439,13 @@ def obtener_lotes_unicos():
         logging.error(f"Error al obtener lotes únicos: {e}")
         return []
 
+@grabacion.grabar()
 def cargar_facturas_por_lote(numero_lote):
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return []
             with conn.cursor() as cursor:
-                query = """
-                    SELECT
-                        f.id, f.numero_factura, f.area_servicio, f.facturador, f.fecha_generacion, f.eps,
-                        f.fecha_hora_entrega, f.tiene_correccion, f.descripcion_devolucion,
-                        f.fecha_devolucion_lider, f.revisado, f.factura_original_id, f.estado,
-                        f.reemplazada_por_numero_factura, f.estado_auditoria, f.observacion_auditor,
-                        f.tipo_error, f.fecha_reemplazo, f.fecha_entrega_radicador, f.lote_carga_masiva,
-                        fo.numero_factura AS num_fact_original_linked,
-                        fo.fecha_generacion AS fecha_gen_original_linked
-                    FROM facturas f
-                    LEFT JOIN facturas fo ON f.factura_original_id = fo.id
-                    WHERE f.lote_carga_masiva = %s
-                    ORDER BY f.id;
-                """
+                query = SQL_CARGAR_FACTURAS_POR_LOTE
                 cursor.execute(query, (numero_lote,))
                 column_names = [desc[0] for desc in cursor.description]
                 facturas_raw = cursor.fetchall()
@@ -581,20 +1456,14 @@ def cargar_facturas_por_lote(numero_lote):
         logging.error(f"Error al cargar facturas por lote '{numero_lote}': {e}")
         return []
 
+@grabacion.grabar()
 def obtener_ultimo_numero_lote():
     try:
         with DatabaseConnection() as conn:
             if conn is None:
                 return 0
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT MAX(CAST(
-                        REGEXP_REPLACE(lote_carga_masiva, '[^0-9]', '', 'g') AS INTEGER
-                    ))
-                    FROM facturas
-                    WHERE lote_carga_masiva IS NOT NULL 
-                    AND lote_carga_masiva ~ '[0-9]';  -- Solo filas que contengan al menos un dígito
-                """)
+                cursor.execute(SQL_OBTENER_ULTIMO_NUMERO_LOTE)
                 resultado = cursor.fetchone()[0]
                 ultimo_numero = resultado if resultado is not None else 0
                 logging.info(f"Último número de lote encontrado: {ultimo_numero}")
@@ -610,29 +1479,24 @@ def generar_siguiente_id_lote():
     logging.info(f"Siguiente ID de lote generado: {id_formateado}")
     return id_formateado
 
+@grabacion.grabar()
 def reparar_secuencia_ids():
     try:
         with DatabaseConnection() as conn:
             if conn is None: return
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT setval(pg_get_serial_sequence('facturas', 'id'), 
-                    COALESCE(MAX(id), 0) + 1, false) FROM facturas;
-                """)
+                cursor.execute(SQL_REPARAR_SECUENCIA_IDS)
                 logging.info("Secuencia de IDs de la tabla facturas reparada.")
     except Error as e:
         logging.error(f"Error al reparar la secuencia de IDs: {e}")
 
+@grabacion.grabar()
 def obtener_datos_carga_por_lote(numero_lote):
     try:
-        with DatabaseConnection() as conn:
+        with DatabaseConnection(solo_lectura=True) as conn:
             if conn is None: return None
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT * FROM facturas 
-                    WHERE lote_carga_masiva = %s 
-                    ORDER BY id;
-                """, (numero_lote,))
+                cursor.execute(SQL_OBTENER_DATOS_CARGA_POR_LOTE, (numero_lote,))
                 
                 column_names = [desc[0] for desc in cursor.description]
                 facturas = cursor.fetchall()
@@ -0,0 +1,133 @@
+"""
+Grabación opcional de la carga de trabajo de database_operations.
+
+Con DB_GRABAR_CARGA=<ruta> cada operación pública agrega una línea JSON con su nombre,
+sus parámetros anonimizados, el instante relativo al inicio de la grabación y su
+duración. benchmarks/reproductor.py vuelve a emitir esa traza contra una base de pruebas.
+
+Los textos libres y los números de factura se reemplazan por un seudónimo estable
+(HMAC con DB_GRABAR_SAL), de modo que el mismo valor original produce siempre el mismo
+valor grabado y la traza conserva los patrones de acceso sin exponer datos reales.
+"""
+import contextvars
+import hashlib
+import hmac
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from functools import wraps
+
+from config.constants import (
+    FACTURADORES, EPS_OPCIONES, AREA_SERVICIO_OPCIONES,
+    ESTADO_AUDITORIA_OPCIONES, TIPO_ERROR_OPCIONES
+)
+
+RUTA_GRABACION = os.environ.get("DB_GRABAR_CARGA")
+_SAL = (os.environ.get("DB_GRABAR_SAL") or os.urandom(16).hex()).encode()
+
+# Valores de catálogo: no identifican a nadie y el reproductor los necesita tal cual.
+VALORES_PUBLICOS = set(FACTURADORES) | set(EPS_OPCIONES) | set(AREA_SERVICIO_OPCIONES) \
+    | set(ESTADO_AUDITORIA_OPCIONES) | set(TIPO_ERROR_OPCIONES) \
+    | {"Activa", "Reemplazada", "Vencidas", "Lista para Radicar", "En Radicador"}
+
+_en_operacion = contextvars.ContextVar('grabacion_en_operacion', default=False)
+_bloqueo = threading.Lock()
+_archivo = None
+_inicio = None
+
+def grabacion_activa():
+    return bool(RUTA_GRABACION)
+
+def _seudonimo(valor):
+    resumen = hmac.new(_SAL, valor.encode('utf-8'), hashlib.sha256).hexdigest()
+    if valor.isdigit():
+        # Conserva la longitud y que sea numérico (los números de factura se validan así).
+        return str(int(resumen, 16))[:len(valor)].rjust(len(valor), '0')
+    return f"anon_{resumen[:12]}"
+
+def anonimizar(valor):
+    if isinstance(valor, str):
+        return valor if valor in VALORES_PUBLICOS or valor == "" else _seudonimo(valor)
+    if isinstance(valor, (list, tuple, set)):
+        return [anonimizar(v) for v in valor]
+    if isinstance(valor, dict):
+        return {k: anonimizar(v) for k, v in valor.items()}
+    return valor
+
+def codificar(valor):
+    """Valores de la traza a JSON; las fechas se marcan para reconstruirlas al reproducir."""
+    if isinstance(valor, datetime):
+        return {'__fecha_hora__': valor.isoformat()}
+    if isinstance(valor, date):
+        return {'__fecha__': valor.isoformat()}
+    if isinstance(valor, (list, tuple, set)):
+        return [codificar(v) for v in valor]
+    if isinstance(valor, dict):
+        return {k: codificar(v) for k, v in valor.items()}
+    return valor
+
+def decodificar(valor):
+    if isinstance(valor, dict):
+        if '__fecha_hora__' in valor:
+            return datetime.fromisoformat(valor['__fecha_hora__'])
+        if '__fecha__' in valor:
+            return date.fromisoformat(valor['__fecha__'])
+        return {k: decodificar(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [decodificar(v) for v in valor]
+    return valor
+
+def _escribir(evento):
+    global _archivo, _inicio
+    with _bloqueo:
+        try:
+            if _archivo is None:
+                directorio = os.path.dirname(RUTA_GRABACION)
+                if directorio:
+                    os.makedirs(directorio, exist_ok=True)
+                _archivo = open(RUTA_GRABACION, 'a', encoding='utf-8', buffering=1)
+                _inicio = evento['_inicio']
+                logging.info(f"Grabando la carga de la base de datos en {RUTA_GRABACION}")
+            evento['t'] = round(evento.pop('_inicio') - _inicio, 4)
+            _archivo.write(json.dumps(evento, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logging.warning(f"No se pudo escribir la grabación de carga: {e}")
+
+def grabar(conservar=()):
+    """
+    Decorador de las operaciones de database_operations. Solo se graba la operación más
+    externa: las que se llaman desde otra operación se reproducen a través de ella.
+    `conservar` lista parámetros que no se anonimizan (p. ej. nombres de columna).
+    """
+    def decorador(funcion):
+        firma = inspect.signature(funcion)
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not RUTA_GRABACION or _en_operacion.get():
+                return funcion(*args, **kwargs)
+            token = _en_operacion.set(True)
+            inicio = time.monotonic()
+            exito = False
+            try:
+                resultado = funcion(*args, **kwargs)
+                exito = True
+                return resultado
+            finally:
+                _en_operacion.reset(token)
+                duracion_ms = (time.monotonic() - inicio) * 1000
+                parametros = firma.bind(*args, **kwargs).arguments
+                _escribir({
+                    '_inicio': inicio,
+                    'operacion': funcion.__name__,
+                    'parametros': {nombre: codificar(valor if nombre in conservar else anonimizar(valor))
+                                   for nombre, valor in parametros.items()},
+                    'ms': round(duracion_ms, 3),
+                    'exito': exito,
+                })
+        return envoltura
+    return decorador
@@ -0,0 +1,389 @@
+"""
+Instrumentación de las operaciones de base de datos.
+
+DatabaseConnection marca la operación en curso (el nombre de la función de
+database_operations que la abrió) y CursorInstrumentado mide cada sentencia.
+Por operación se acumulan histogramas de latencia y de espera de conexión, filas
+devueltas, viajes a la base, errores y consultas lentas. Las métricas se exponen
+en formato de texto de Prometheus o se vuelcan a JSON.
+
+Variables de entorno:
+    DB_UMBRAL_CONSULTA_LENTA_MS   umbral de consulta lenta (500 por defecto).
+    DB_EXPLICAR_CONSULTAS_LENTAS  "0" para no ejecutar EXPLAIN de las consultas lentas.
+    METRICAS_PUERTO               si se define, sirve /metrics en ese puerto.
+    METRICAS_ARCHIVO              si se define, vuelca las métricas en JSON al terminar el proceso.
+    DB_UMBRAL_N_MAS_1             repeticiones de una misma forma de SQL por rerun antes de avisar (5).
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from psycopg2 import Error
+from psycopg2.extensions import cursor as _cursor_base
+
+LIMITES_HISTOGRAMA_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+UMBRAL_CONSULTA_LENTA_MS = float(os.environ.get("DB_UMBRAL_CONSULTA_LENTA_MS", "500"))
+EXPLICAR_CONSULTAS_LENTAS = os.environ.get("DB_EXPLICAR_CONSULTAS_LENTAS", "1") == "1"
+
+UMBRAL_N_MAS_1 = int(os.environ.get("DB_UMBRAL_N_MAS_1", "5"))
+
+OPERACION_SIN_NOMBRE = "sin_operacion"
+_SENTENCIAS_EXPLICABLES = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+_operacion_actual = contextvars.ContextVar("operacion_bd", default=None)
+# Callbacks (operacion, sql, duracion_ms, filas) activos en el contexto actual, p. ej. durante un rerun.
+_observadores = contextvars.ContextVar("observadores_bd", default=())
+
+class Histograma:
+    def __init__(self):
+        self.cuentas = [0] * (len(LIMITES_HISTOGRAMA_MS) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor_ms):
+        for i, limite in enumerate(LIMITES_HISTOGRAMA_MS):
+            if valor_ms <= limite:
+                self.cuentas[i] += 1
+                break
+        else:
+            self.cuentas[-1] += 1
+        self.suma += valor_ms
+        self.total += 1
+
+    def acumulado(self):
+        """Pares (límite, cuenta acumulada) al estilo de los buckets de Prometheus."""
+        total = 0
+        pares = []
+        for limite, cuenta in zip(list(LIMITES_HISTOGRAMA_MS) + ["+Inf"], self.cuentas):
+            total += cuenta
+            pares.append((limite, total))
+        return pares
+
+    def a_dict(self):
+        return {
+            'total': self.total,
+            'suma_ms': round(self.suma, 3),
+            'promedio_ms': round(self.suma / self.total, 3) if self.total else 0.0,
+            'buckets': {str(limite): cuenta for limite, cuenta in self.acumulado()},
+        }
+
+class MetricasOperacion:
+    def __init__(self):
+        self.latencia = Histograma()
+        self.latencia_sentencias = Histograma()
+        self.espera_conexion = Histograma()
+        self.llamadas = 0
+        self.viajes = 0
+        self.filas = 0
+        self.errores = 0
+        self.consultas_lentas = 0
+
+    def a_dict(self):
+        return {
+            'llamadas': self.llamadas,
+            'viajes': self.viajes,
+            'filas': self.filas,
+            'errores': self.errores,
+            'consultas_lentas': self.consultas_lentas,
+            'latencia_ms': self.latencia.a_dict(),
+            'latencia_sentencias_ms': self.latencia_sentencias.a_dict(),
+            'espera_conexion_ms': self.espera_conexion.a_dict(),
+        }
+
+class RegistroMetricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operaciones = {}
+
+    def _metricas(self, operacion):
+        metricas = self._operaciones.get(operacion)
+        if metricas is None:
+            metricas = self._operaciones[operacion] = MetricasOperacion()
+        return metricas
+
+    def registrar_sentencia(self, operacion, duracion_ms, filas, lenta):
+        with self._lock:
+            metricas = self._metricas(operacion)
+            metricas.viajes += 1
+            metricas.latencia_sentencias.observar(duracion_ms)
+            if filas and filas > 0:
+                metricas.filas += filas
+            if lenta:
+                metricas.consultas_lentas += 1
+
+    def registrar_viaje(self, operacion):
+        with self._lock:
+            self._metricas(operacion).viajes += 1
+
+    def registrar_espera_conexion(self, operacion, espera_ms):
+        with self._lock:
+            self._metricas(operacion).espera_conexion.observar(espera_ms)
+
+    def registrar_operacion(self, operacion, duracion_ms, error):
+        with self._lock:
+            metricas = self._metricas(operacion)
+            metricas.llamadas += 1
+            metricas.latencia.observar(duracion_ms)
+            if error:
+                metricas.errores += 1
+
+    def instantanea(self):
+        with self._lock:
+            return {nombre: metricas.a_dict() for nombre, metricas in sorted(self._operaciones.items())}
+
+    def reiniciar(self):
+        with self._lock:
+            self._operaciones.clear()
+
+    def exportar_prometheus(self):
+        instantanea = self.instantanea()
+        lineas = []
+
+        def histograma(nombre, ayuda, clave):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} histogram")
+            for operacion, datos in instantanea.items():
+                for limite, cuenta in datos[clave]['buckets'].items():
+                    lineas.append(f'{nombre}_bucket{{operacion="{operacion}",le="{limite}"}} {cuenta}')
+                lineas.append(f'{nombre}_sum{{operacion="{operacion}"}} {datos[clave]["suma_ms"]}')
+                lineas.append(f'{nombre}_count{{operacion="{operacion}"}} {datos[clave]["total"]}')
+
+        def contador(nombre, ayuda, clave):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} counter")
+            for operacion, datos in instantanea.items():
+                lineas.append(f'{nombre}{{operacion="{operacion}"}} {datos[clave]}')
+
+        histograma("trazabilidad_db_operacion_ms", "Duración de cada operación de database_operations.", 'latencia_ms')
+        histograma("trazabilidad_db_sentencia_ms", "Duración de cada sentencia SQL.", 'latencia_sentencias_ms')
+        histograma("trazabilidad_db_espera_conexion_ms", "Tiempo para obtener una conexión.", 'espera_conexion_ms')
+        contador("trazabilidad_db_llamadas_total", "Operaciones ejecutadas.", 'llamadas')
+        contador("trazabilidad_db_viajes_total", "Viajes de ida y vuelta a la base (sentencias, commit y rollback).", 'viajes')
+        contador("trazabilidad_db_filas_total", "Filas devueltas o afectadas.", 'filas')
+        contador("trazabilidad_db_errores_total", "Operaciones que terminaron en error.", 'errores')
+        contador("trazabilidad_db_consultas_lentas_total", "Sentencias por encima del umbral de consulta lenta.", 'consultas_lentas')
+
+        from backend.sentencias_preparadas import registro as registro_preparadas
+        for clave, ayuda in (('preparaciones', "PREPARE emitidos por sentencia."),
+                             ('aciertos', "Ejecuciones que reutilizaron una sentencia ya preparada.")):
+            lineas.append(f"# HELP trazabilidad_db_preparadas_{clave}_total {ayuda}")
+            lineas.append(f"# TYPE trazabilidad_db_preparadas_{clave}_total counter")
+            for sentencia, datos in registro_preparadas.estadisticas().items():
+                lineas.append(f'trazabilidad_db_preparadas_{clave}_total{{sentencia="{sentencia}"}} {datos[clave]}')
+        return "\n".join(lineas) + "\n"
+
+    def volcar_json(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump({'generado_en': time.strftime('%Y-%m-%d %H:%M:%S'), 'operaciones': self.instantanea()},
+                      archivo, indent=2, ensure_ascii=False)
+
+metricas = RegistroMetricas()
+
+def operacion_actual():
+    return _operacion_actual.get() or OPERACION_SIN_NOMBRE
+
+def iniciar_operacion(operacion):
+    return _operacion_actual.set(operacion)
+
+def finalizar_operacion(token, operacion, duracion_ms, error):
+    metricas.registrar_operacion(operacion, duracion_ms, error)
+    _operacion_actual.reset(token)
+
+@contextmanager
+def observar_sentencias(observador):
+    """Llama a `observador(operacion, sql, duracion_ms, filas)` por cada sentencia ejecutada dentro del bloque."""
+    token = _observadores.set(_observadores.get() + (observador,))
+    try:
+        yield
+    finally:
+        _observadores.reset(token)
+
+_PATRONES_NORMALIZACION = [
+    (re.compile(r"--[^\n]*"), " "),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s|%\(\w+\)s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),
+    (re.compile(r"\s+"), " "),
+]
+
+def normalizar_sql(sql):
+    """Forma de una sentencia sin literales ni parámetros, para agrupar repeticiones."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', errors='replace')
+    forma = str(sql)
+    for patron, reemplazo in _PATRONES_NORMALIZACION:
+        forma = patron.sub(reemplazo, forma)
+    return forma.strip().rstrip(';').strip()
+
+class RegistroPeticion:
+    """
+    Sentencias emitidas durante una petición (un rerun), agrupadas por forma normalizada.
+    Las tareas de ejecutar_en_paralelo lo llaman desde hilos del pool, de ahí el bloqueo.
+    """
+    def __init__(self, umbral=None):
+        self.umbral = UMBRAL_N_MAS_1 if umbral is None else umbral
+        self.total = 0
+        self.ms = 0.0
+        self.por_forma = Counter()
+        self.operaciones_por_forma = defaultdict(Counter)
+        self._bloqueo = threading.Lock()
+
+    def __call__(self, operacion, sql, duracion_ms, filas):
+        forma = normalizar_sql(sql)
+        with self._bloqueo:
+            self.total += 1
+            self.ms += duracion_ms
+            self.por_forma[forma] += 1
+            self.operaciones_por_forma[forma][operacion] += 1
+
+    def formas_repetidas(self):
+        with self._bloqueo:
+            return [
+                {'forma': forma, 'repeticiones': cuenta, 'operaciones': dict(self.operaciones_por_forma[forma])}
+                for forma, cuenta in self.por_forma.most_common() if cuenta > self.umbral
+            ]
+
+    def resumen(self):
+        repetidas = self.formas_repetidas()
+        with self._bloqueo:
+            return {
+                'sentencias': self.total,
+                'formas_distintas': len(self.por_forma),
+                'ms': round(self.ms, 2),
+                'repetidas': repetidas,
+            }
+
+@contextmanager
+def ambito_peticion(umbral=None):
+    """Registra las sentencias del bloque y avisa en el log de las formas repetidas (posible N+1)."""
+    registro = RegistroPeticion(umbral)
+    try:
+        with observar_sentencias(registro):
+            yield registro
+    finally:
+        for repetida in registro.formas_repetidas():
+            logging.warning(
+                f"Posible N+1: {repetida['repeticiones']} sentencias con la misma forma en una petición "
+                f"(operaciones: {repetida['operaciones']}): {repetida['forma'][:200]}"
+            )
+
+@contextmanager
+def afirmar_sin_n_mas_1(umbral=None, max_sentencias=None):
+    """
+    Ayuda para pruebas: falla con AssertionError si dentro del bloque alguna forma de
+    SQL se repite más de `umbral` veces, o si se superan `max_sentencias` viajes.
+    """
+    registro = RegistroPeticion(umbral)
+    with observar_sentencias(registro):
+        yield registro
+    repetidas = registro.formas_repetidas()
+    if repetidas:
+        detalle = "; ".join(f"{r['repeticiones']}x {r['forma'][:120]}" for r in repetidas)
+        raise AssertionError(f"Patrón N+1 detectado (umbral {registro.umbral}): {detalle}")
+    if max_sentencias is not None and registro.total > max_sentencias:
+        raise AssertionError(f"Se emitieron {registro.total} sentencias; el presupuesto es {max_sentencias}.")
+
+def _registrar_consulta_lenta(cursor, query, vars, duracion_ms, operacion):
+    # En WARNING solo la forma normalizada: los parámetros son datos de facturas y usuarios.
+    logging.warning(f"Consulta lenta en '{operacion}' ({duracion_ms:.1f} ms): {normalizar_sql(query)[:500]}")
+    try:
+        sentencia = cursor.mogrify(query, vars).decode('utf-8', errors='replace')
+    except Exception:
+        return
+    logging.debug(f"Consulta lenta en '{operacion}' con parámetros: {' '.join(sentencia.split())}")
+
+    if not EXPLICAR_CONSULTAS_LENTAS or not sentencia.lstrip().upper().startswith(_SENTENCIAS_EXPLICABLES):
+        return
+    if ";" in sentencia.strip().rstrip(";"):
+        # Varias sentencias en una llamada: EXPLAIN solo cubriría la primera y ejecutaría el resto.
+        return
+    conn = cursor.connection
+    # EXPLAIN corre dentro de la transacción de la operación: un savepoint evita que su fallo
+    # la deje abortada y el commit posterior descarte la escritura sin avisar.
+    en_transaccion = not conn.autocommit
+    try:
+        # Cursor sin instrumentar, para no volver a medir ni sobrescribir el resultado pendiente.
+        with conn.cursor(cursor_factory=_cursor_base) as cursor_explain:
+            if en_transaccion:
+                cursor_explain.execute("SAVEPOINT explicar_consulta_lenta;")
+            try:
+                cursor_explain.execute("EXPLAIN " + sentencia)
+                plan = "\n".join(fila[0] for fila in cursor_explain.fetchall())
+            except Error:
+                if en_transaccion:
+                    cursor_explain.execute("ROLLBACK TO SAVEPOINT explicar_consulta_lenta;")
+                raise
+            finally:
+                if en_transaccion:
+                    cursor_explain.execute("RELEASE SAVEPOINT explicar_consulta_lenta;")
+        logging.warning(f"Plan de la consulta lenta en '{operacion}':\n{plan}")
+    except Error as e:
+        logging.warning(f"No se pudo obtener EXPLAIN de la consulta lenta en '{operacion}': {e}")
+
+class CursorInstrumentado(_cursor_base):
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        exito = False
+        try:
+            resultado = super().execute(query, vars)
+            exito = True
+            return resultado
+        finally:
+            self._registrar(query, vars, (time.perf_counter() - inicio) * 1000, exito)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        exito = False
+        try:
+            resultado = super().executemany(query, vars_list)
+            exito = True
+            return resultado
+        finally:
+            self._registrar(query, None, (time.perf_counter() - inicio) * 1000, exito)
+
+    def _registrar(self, query, vars, duracion_ms, exito):
+        operacion = operacion_actual()
+        lenta = duracion_ms >= UMBRAL_CONSULTA_LENTA_MS
+        metricas.registrar_sentencia(operacion, duracion_ms, self.rowcount, lenta)
+        for observador in _observadores.get():
+            try:
+                observador(operacion, query, duracion_ms, self.rowcount)
+            except Exception as e:
+                logging.warning(f"Error en observador de sentencias: {e}")
+        if lenta and exito and self.connection.closed == 0:
+            _registrar_consulta_lenta(self, query, vars, duracion_ms, operacion)
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('', '/metrics'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        cuerpo = metricas.exportar_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+def iniciar_servidor_metricas(puerto):
+    servidor = ThreadingHTTPServer(("0.0.0.0", int(puerto)), _ManejadorMetricas)
+    hilo = threading.Thread(target=servidor.serve_forever, name="servidor-metricas", daemon=True)
+    hilo.start()
+    logging.info(f"Métricas de base de datos disponibles en http://0.0.0.0:{puerto}/metrics")
+    return servidor
+
+if os.environ.get("METRICAS_ARCHIVO"):
+    atexit.register(lambda: metricas.volcar_json(os.environ["METRICAS_ARCHIVO"]))
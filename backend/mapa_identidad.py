@@ -0,0 +1,72 @@
+"""
+Mapa de identidad por rerun para las lecturas de entidades por id.
+
+Dentro de `ambito_rerun()` (app_streamlit.py envuelve cada ejecución del script),
+obtener_factura_por_id consulta la base una sola vez por factura; las lecturas
+siguientes del mismo rerun reciben una copia de la fila ya leída. Cada escritura
+de database_operations invalida las facturas que toca, de modo que después de
+guardar se vuelve a leer de la base. Fuera de un ámbito (herramientas de línea de
+comandos, benchmarks) no se memoriza nada y cada rerun empieza con el mapa vacío.
+"""
+import contextvars
+from contextlib import contextmanager
+
+_mapa_actual = contextvars.ContextVar("mapa_identidad", default=None)
+
+class MapaIdentidad:
+    def __init__(self):
+        self._entidades = {}
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, tipo, id_entidad):
+        fila = self._entidades.get((tipo, id_entidad))
+        if fila is None:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        # Copia: quien la recibe puede modificarla sin alterar lo que verán las lecturas siguientes.
+        return dict(fila)
+
+    def guardar(self, tipo, id_entidad, fila):
+        if fila is not None:
+            self._entidades[(tipo, id_entidad)] = dict(fila)
+
+    def invalidar(self, tipo, ids=None, campo_referencia=None):
+        """
+        Olvida las entidades `ids` del tipo (todas si ids es None) y las que las referencian
+        por `campo_referencia` (p. ej. un reemplazo muestra el número de su factura original).
+        """
+        ids = None if ids is None else set(ids)
+        for clave in [clave for clave, fila in self._entidades.items() if clave[0] == tipo and (
+                ids is None or clave[1] in ids or (campo_referencia and fila.get(campo_referencia) in ids))]:
+            del self._entidades[clave]
+
+    def resumen(self):
+        return {'entidades': len(self._entidades), 'aciertos': self.aciertos, 'fallos': self.fallos}
+
+def mapa_actual():
+    return _mapa_actual.get()
+
+@contextmanager
+def ambito_rerun():
+    mapa = MapaIdentidad()
+    token = _mapa_actual.set(mapa)
+    try:
+        yield mapa
+    finally:
+        _mapa_actual.reset(token)
+
+def obtener(tipo, id_entidad):
+    mapa = _mapa_actual.get()
+    return None if mapa is None else mapa.obtener(tipo, id_entidad)
+
+def guardar(tipo, id_entidad, fila):
+    mapa = _mapa_actual.get()
+    if mapa is not None:
+        mapa.guardar(tipo, id_entidad, fila)
+
+def invalidar(tipo, ids=None, campo_referencia=None):
+    mapa = _mapa_actual.get()
+    if mapa is not None:
+        mapa.invalidar(tipo, ids, campo_referencia)
@@ -0,0 +1,727 @@
+"""
+Migraciones versionadas del esquema.
+
+Cada migración se aplica una sola vez y queda registrada en la tabla
+schema_version. Se ejecutan al desplegar (python -m backend.migraciones) o, como
+respaldo, una vez por proceso desde app_streamlit.py; nunca en cada rerun.
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+from psycopg2 import Error
+
+from backend import database_operations as db_ops
+from backend import sentencias_preparadas
+
+# Llave del bloqueo consultivo que serializa varios procesos migrando a la vez.
+LLAVE_BLOQUEO_MIGRACIONES = 726001
+
+# El bloqueo es de sesión (las migraciones concurrentes no caben en una transacción), así que
+# tomarlo y liberarlo debe ocurrir en el mismo backend. Detrás del pooler en modo transacción
+# cada transacción puede ir a otro backend y el bloqueo quedaría tomado para siempre; por eso
+# las migraciones usan DB_MIGRACIONES_DSN (conexión directa o pooler en modo sesión) y se
+# niegan a correr por el puerto del pooler transaccional.
+DSN_MIGRACIONES = os.environ.get("DB_MIGRACIONES_DSN")
+
+# Las migraciones marcadas como 'concurrente' se ejecutan fuera de transacción
+# (requisito de CREATE/DROP INDEX CONCURRENTLY); no deben mezclar otro DDL.
+# facturas puede estar particionada (backend/particionado.py) y PostgreSQL no admite
+# CONCURRENTLY sobre tablas ni índices particionados: _aplicar_migracion quita la palabra
+# en esas sentencias y el índice se construye bloqueando escrituras mientras dura.
+# Las migraciones nuevas deben seguir funcionando en ambos casos.
+MIGRACIONES = [
+    {
+        'version': 1,
+        'descripcion': 'Esquema inicial: usuarios, facturas, detalles_soat e índices básicos',
+        'sentencias': [
+            """
+            CREATE TABLE IF NOT EXISTS usuarios (
+                id SERIAL PRIMARY KEY,
+                username TEXT NOT NULL UNIQUE,
+                password TEXT NOT NULL, -- NOTA: En un entorno real, esto DEBE ser un hash de la contraseña.
+                role TEXT NOT NULL
+            );
+            """,
+            """
+            INSERT INTO usuarios (username, password, role) VALUES ('legalizador', 'legalizador123', 'legalizador')
+            ON CONFLICT (username) DO NOTHING;
+            """,
+            """
+            INSERT INTO usuarios (username, password, role) VALUES ('auditor', 'auditor123', 'auditor')
+            ON CONFLICT (username) DO NOTHING;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS facturas (
+                id SERIAL PRIMARY KEY,
+                numero_factura TEXT NOT NULL,
+                area_servicio TEXT,
+                facturador TEXT,
+                fecha_generacion DATE,
+                eps TEXT,
+                fecha_hora_entrega TIMESTAMP,
+                tiene_correccion BOOLEAN DEFAULT FALSE,
+                descripcion_devolucion TEXT,
+                fecha_devolucion_lider DATE,
+                revisado BOOLEAN DEFAULT FALSE,
+                factura_original_id INTEGER,
+                estado TEXT DEFAULT 'Activa',
+                reemplazada_por_numero_factura TEXT,
+                estado_auditoria TEXT DEFAULT 'Pendiente', -- Valor por defecto inicial
+                observacion_auditor TEXT,
+                tipo_error TEXT,
+                fecha_reemplazo DATE,
+                fecha_entrega_radicador TIMESTAMP,
+                lote_carga_masiva TEXT,
+                FOREIGN KEY (factura_original_id) REFERENCES facturas(id),
+                CONSTRAINT unique_factura_details UNIQUE (numero_factura, facturador, eps, area_servicio)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS detalles_soat (
+                id SERIAL PRIMARY KEY,
+                factura_id INTEGER UNIQUE,
+                fecha_generacion_soat DATE,
+                FOREIGN KEY (factura_id) REFERENCES facturas(id) ON DELETE CASCADE
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_facturas_numero_factura ON facturas (numero_factura);",
+            "CREATE INDEX IF NOT EXISTS idx_facturas_facturador ON facturas (facturador);",
+            "CREATE INDEX IF NOT EXISTS idx_facturas_eps ON facturas (eps);",
+            "CREATE INDEX IF NOT EXISTS idx_facturas_area_servicio ON facturas (area_servicio);",
+            "CREATE INDEX IF NOT EXISTS idx_facturas_estado_auditoria ON facturas (estado_auditoria);",
+        ],
+    },
+    {
+        'version': 2,
+        'descripcion': 'Reparar la secuencia de IDs de facturas tras importaciones con IDs explícitos',
+        'sentencias': [
+            """
+            SELECT setval(pg_get_serial_sequence('facturas', 'id'),
+            COALESCE(MAX(id), 0) + 1, false) FROM facturas;
+            """,
+        ],
+    },
+    {
+        'version': 3,
+        'descripcion': 'Índices compuestos, parciales y cubrientes según las consultas reales de la app',
+        'concurrente': True,
+        'sentencias': [
+            # Conteos por estado y GROUP BY (facturador, eps) de las estadísticas: solo índice, sin ordenar.
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_estado_facturador_eps ON facturas (estado_auditoria, facturador, eps);",
+            # Facturas de un lote en orden de id, lista de lotes y último número de lote.
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_lote_id ON facturas (lote_carga_masiva, id)
+            INCLUDE (estado_auditoria) WHERE lote_carga_masiva IS NOT NULL;
+            """,
+            # Auto-unión de reemplazos y verificación de la FK al eliminar una factura original.
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_factura_original_id ON facturas (factura_original_id)
+            WHERE factura_original_id IS NOT NULL;
+            """,
+            # Facturas listas aún sin entregar al radicador.
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_pendientes_radicador ON facturas (id)
+            WHERE fecha_entrega_radicador IS NULL AND estado_auditoria IN ('Lista para Radicar', 'En Radicador');
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_vencidas ON facturas (estado_auditoria)
+            WHERE estado = 'Vencidas';
+            """,
+            # Prefijo del índice compuesto; ya no aporta nada.
+            "DROP INDEX CONCURRENTLY IF EXISTS idx_facturas_estado_auditoria;",
+        ],
+    },
+    {
+        'version': 4,
+        'descripcion': 'Versión y updated_at en facturas para actualizaciones parciales con concurrencia optimista',
+        'sentencias': [
+            # Con un valor por defecto no volátil, ADD COLUMN no reescribe la tabla (PostgreSQL 11+).
+            "ALTER TABLE facturas ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;",
+            "ALTER TABLE facturas ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();",
+            # Cualquier UPDATE (edición, auditoría, entrega al radicador) incrementa la versión,
+            # así una edición basada en datos viejos se detecta aunque la otra escritura venga de otra pantalla.
+            """
+            CREATE OR REPLACE FUNCTION facturas_versionar() RETURNS trigger AS $$
+            BEGIN
+                NEW.version := OLD.version + 1;
+                NEW.updated_at := NOW();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS trg_facturas_versionar ON facturas;",
+            """
+            CREATE TRIGGER trg_facturas_versionar BEFORE UPDATE ON facturas
+            FOR EACH ROW EXECUTE FUNCTION facturas_versionar();
+            """,
+        ],
+    },
+    {
+        'version': 5,
+        'descripcion': 'Urgencia de cada factura (prioridad de auditoría y fecha límite de liquidación) calculada en la base',
+        'sentencias': [
+            "CREATE TABLE IF NOT EXISTS dias_festivos (fecha DATE PRIMARY KEY);",
+            # Los mismos festivos de utils/date_utils.py (DIAS_FESTIVOS_2025).
+            """
+            INSERT INTO dias_festivos (fecha) VALUES
+                ('2025-01-01'), ('2025-01-06'), ('2025-03-24'), ('2025-04-17'), ('2025-04-18'),
+                ('2025-05-01'), ('2025-05-26'), ('2025-06-16'), ('2025-06-23'), ('2025-07-20'),
+                ('2025-08-07'), ('2025-08-18'), ('2025-10-13'), ('2025-11-03'), ('2025-11-17'),
+                ('2025-12-08'), ('2025-12-25')
+            ON CONFLICT (fecha) DO NOTHING;
+            """,
+            # Equivalente a sumar_dias_habiles de utils/date_utils.py: el día hábil número `dias` después de `inicio`.
+            """
+            CREATE OR REPLACE FUNCTION sumar_dias_habiles(inicio DATE, dias INTEGER) RETURNS DATE AS $$
+                SELECT d::date
+                FROM generate_series(inicio + 1, inicio + dias * 2 + 30, INTERVAL '1 day') AS d
+                WHERE EXTRACT(ISODOW FROM d) < 6
+                  AND NOT EXISTS (SELECT 1 FROM dias_festivos f WHERE f.fecha = d::date)
+                ORDER BY d
+                OFFSET dias - 1 LIMIT 1;
+            $$ LANGUAGE sql STABLE;
+            """,
+            "ALTER TABLE facturas ADD COLUMN IF NOT EXISTS prioridad_urgencia SMALLINT;",
+            "ALTER TABLE facturas ADD COLUMN IF NOT EXISTS fecha_limite_liquidacion DATE;",
+            # El relleno inicial no es una edición: no debe cambiar la versión de cada factura.
+            "ALTER TABLE facturas DISABLE TRIGGER trg_facturas_versionar;",
+            """
+            UPDATE facturas SET prioridad_urgencia = CASE estado_auditoria
+                WHEN 'Devuelta por Auditor' THEN 1
+                WHEN 'Corregida por Legalizador' THEN 2
+                ELSE 3 END;
+            """,
+            # Se calcula una vez por fecha base distinta, no una vez por factura.
+            """
+            UPDATE facturas f SET fecha_limite_liquidacion = l.limite
+            FROM (
+                SELECT base, sumar_dias_habiles(base, 21) AS limite
+                FROM (SELECT DISTINCT COALESCE(fecha_reemplazo, fecha_generacion) AS base FROM facturas) b
+                WHERE base IS NOT NULL
+            ) l
+            WHERE COALESCE(f.fecha_reemplazo, f.fecha_generacion) = l.base;
+            """,
+            "ALTER TABLE facturas ENABLE TRIGGER trg_facturas_versionar;",
+            """
+            CREATE OR REPLACE FUNCTION facturas_calcular_urgencia() RETURNS trigger AS $$
+            BEGIN
+                NEW.prioridad_urgencia := CASE NEW.estado_auditoria
+                    WHEN 'Devuelta por Auditor' THEN 1
+                    WHEN 'Corregida por Legalizador' THEN 2
+                    ELSE 3 END;
+                IF TG_OP = 'INSERT' THEN
+                    NEW.fecha_limite_liquidacion := sumar_dias_habiles(COALESCE(NEW.fecha_reemplazo, NEW.fecha_generacion), 21);
+                ELSIF NEW.fecha_generacion IS DISTINCT FROM OLD.fecha_generacion
+                   OR NEW.fecha_reemplazo IS DISTINCT FROM OLD.fecha_reemplazo THEN
+                    NEW.fecha_limite_liquidacion := sumar_dias_habiles(COALESCE(NEW.fecha_reemplazo, NEW.fecha_generacion), 21);
+                END IF;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS trg_facturas_urgencia ON facturas;",
+            """
+            CREATE TRIGGER trg_facturas_urgencia BEFORE INSERT OR UPDATE ON facturas
+            FOR EACH ROW EXECUTE FUNCTION facturas_calcular_urgencia();
+            """,
+        ],
+    },
+    {
+        'version': 6,
+        'descripcion': 'Índice para la bandeja ordenada por urgencia',
+        'concurrente': True,
+        'sentencias': [
+            # Devueltas, corregidas y luego el resto por fecha límite: las vencidas (por refacturar) quedan primero.
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_urgencia
+            ON facturas (prioridad_urgencia, fecha_limite_liquidacion, id);
+            """,
+        ],
+    },
+    {
+        'version': 7,
+        'descripcion': 'Legalizador (facturador) asociado a cada usuario para su bandeja de trabajo',
+        'sentencias': [
+            # NULL = cuenta compartida: ve la bandeja de todos los legalizadores.
+            "ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS facturador TEXT;",
+        ],
+    },
+    {
+        'version': 8,
+        'descripcion': 'Índices parciales de las bandejas de trabajo por rol',
+        'concurrente': True,
+        'sentencias': [
+            # Legalizador: sus devueltas y sus facturas próximas a vencer que aún no están en radicación.
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_bandeja_devueltas
+            ON facturas (facturador, fecha_limite_liquidacion)
+            WHERE estado_auditoria = 'Devuelta por Auditor';
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_bandeja_por_vencer
+            ON facturas (facturador, fecha_limite_liquidacion)
+            WHERE estado_auditoria IN ('Pendiente', 'Corregida por Legalizador', 'Lista para Radicar');
+            """,
+            # Auditor: pendientes y corregidas en orden de urgencia.
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_bandeja_auditor
+            ON facturas (prioridad_urgencia, fecha_limite_liquidacion, id)
+            WHERE estado_auditoria IN ('Pendiente', 'Corregida por Legalizador');
+            """,
+        ],
+    },
+    {
+        'version': 9,
+        'descripcion': 'Feed de cambios: updated_at en detalles_soat y marcas de facturas eliminadas',
+        'sentencias': [
+            "ALTER TABLE detalles_soat ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();",
+            """
+            CREATE OR REPLACE FUNCTION tocar_updated_at() RETURNS trigger AS $$
+            BEGIN
+                NEW.updated_at := NOW();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS trg_detalles_soat_updated_at ON detalles_soat;",
+            """
+            CREATE TRIGGER trg_detalles_soat_updated_at BEFORE UPDATE ON detalles_soat
+            FOR EACH ROW EXECUTE FUNCTION tocar_updated_at();
+            """,
+            # Una fila por factura eliminada, para que los cachés incrementales la quiten de su listado.
+            """
+            CREATE TABLE IF NOT EXISTS facturas_eliminadas (
+                factura_id INTEGER PRIMARY KEY,
+                eliminada_en TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_facturas_eliminadas_eliminada_en ON facturas_eliminadas (eliminada_en);",
+            """
+            CREATE OR REPLACE FUNCTION facturas_registrar_eliminacion() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO facturas_eliminadas (factura_id, eliminada_en) VALUES (OLD.id, NOW())
+                ON CONFLICT (factura_id) DO UPDATE SET eliminada_en = EXCLUDED.eliminada_en;
+                RETURN OLD;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS trg_facturas_eliminacion ON facturas;",
+            """
+            CREATE TRIGGER trg_facturas_eliminacion AFTER DELETE ON facturas
+            FOR EACH ROW EXECUTE FUNCTION facturas_registrar_eliminacion();
+            """,
+        ],
+    },
+    {
+        'version': 10,
+        'descripcion': 'Índices del feed de cambios por updated_at',
+        'concurrente': True,
+        'sentencias': [
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_updated_at ON facturas (updated_at);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_detalles_soat_updated_at ON detalles_soat (updated_at);",
+            # Un cambio en una factura original también cambia lo que muestran sus reemplazos.
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_factura_original_id ON facturas (factura_original_id);",
+        ],
+    },
+    {
+        'version': 11,
+        'descripcion': 'Tablas de histórico para las facturas radicadas archivadas',
+        'sentencias': [
+            # Mismas columnas que facturas (el archivo copia por nombre, COLUMNAS_FACTURAS_ARCHIVO):
+            # una columna nueva en facturas debe agregarse también aquí.
+            """
+            CREATE TABLE IF NOT EXISTS facturas_historico (
+                LIKE facturas,
+                archivada_en TIMESTAMP NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (id)
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_facturas_historico_numero_factura ON facturas_historico (numero_factura);",
+            """
+            CREATE TABLE IF NOT EXISTS detalles_soat_historico (
+                LIKE detalles_soat,
+                PRIMARY KEY (id)
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_detalles_soat_historico_factura_id ON detalles_soat_historico (factura_id);",
+        ],
+    },
+    {
+        'version': 12,
+        'descripcion': 'Índice parcial de facturas archivables',
+        'concurrente': True,
+        'sentencias': [
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_facturas_archivables
+            ON facturas (fecha_entrega_radicador)
+            WHERE estado_auditoria = 'En Radicador';
+            """,
+        ],
+    },
+    {
+        'version': 13,
+        'descripcion': 'Resumen diario de facturas ingresadas, auditadas, devueltas y entregadas',
+        'sentencias': [
+            # Una fila por día, legalizador, EPS y área (vacíos en lugar de NULL para la llave).
+            # dias_entrega_suma / entregadas es el tiempo medio entre ingreso y entrega al radicador.
+            """
+            CREATE TABLE IF NOT EXISTS resumen_diario (
+                dia DATE NOT NULL,
+                facturador TEXT NOT NULL DEFAULT '',
+                eps TEXT NOT NULL DEFAULT '',
+                area_servicio TEXT NOT NULL DEFAULT '',
+                ingresadas INTEGER NOT NULL DEFAULT 0,
+                auditadas INTEGER NOT NULL DEFAULT 0,
+                devueltas INTEGER NOT NULL DEFAULT 0,
+                entregadas INTEGER NOT NULL DEFAULT 0,
+                dias_entrega_suma INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dia, facturador, eps, area_servicio)
+            );
+            """,
+            # Triggers por sentencia con tablas de transición: una carga masiva o una auditoría
+            # por lotes suma sus eventos con un solo INSERT ... ON CONFLICT por grupo.
+            # El archivo y las eliminaciones no descuentan: el resumen cuenta eventos ocurridos.
+            """
+            CREATE OR REPLACE FUNCTION resumen_diario_sumar_ingresos() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO resumen_diario AS r (dia, facturador, eps, area_servicio, ingresadas, entregadas, dias_entrega_suma)
+                SELECT e.dia, e.facturador, e.eps, e.area_servicio,
+                       SUM(e.ingresadas), SUM(e.entregadas), SUM(e.dias_entrega)
+                FROM (
+                    SELECT n.fecha_hora_entrega::date AS dia, COALESCE(n.facturador, '') AS facturador,
+                           COALESCE(n.eps, '') AS eps, COALESCE(n.area_servicio, '') AS area_servicio,
+                           1 AS ingresadas, 0 AS entregadas, 0 AS dias_entrega
+                    FROM nuevas n WHERE n.fecha_hora_entrega IS NOT NULL
+                    UNION ALL
+                    SELECT n.fecha_entrega_radicador::date, COALESCE(n.facturador, ''), COALESCE(n.eps, ''),
+                           COALESCE(n.area_servicio, ''), 0, 1,
+                           COALESCE(n.fecha_entrega_radicador::date - n.fecha_hora_entrega::date, 0)
+                    FROM nuevas n WHERE n.fecha_entrega_radicador IS NOT NULL
+                ) e
+                GROUP BY e.dia, e.facturador, e.eps, e.area_servicio
+                ON CONFLICT (dia, facturador, eps, area_servicio) DO UPDATE SET
+                    ingresadas = r.ingresadas + EXCLUDED.ingresadas,
+                    entregadas = r.entregadas + EXCLUDED.entregadas,
+                    dias_entrega_suma = r.dias_entrega_suma + EXCLUDED.dias_entrega_suma;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            """
+            CREATE OR REPLACE FUNCTION resumen_diario_sumar_cambios() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO resumen_diario AS r (dia, facturador, eps, area_servicio, auditadas, devueltas, entregadas, dias_entrega_suma)
+                SELECT e.dia, e.facturador, e.eps, e.area_servicio,
+                       SUM(e.auditadas), SUM(e.devueltas), SUM(e.entregadas), SUM(e.dias_entrega)
+                FROM (
+                    SELECT CURRENT_DATE AS dia, COALESCE(d.facturador, '') AS facturador,
+                           COALESCE(d.eps, '') AS eps, COALESCE(d.area_servicio, '') AS area_servicio,
+                           1 AS auditadas, (d.estado_auditoria = 'Devuelta por Auditor')::int AS devueltas,
+                           0 AS entregadas, 0 AS dias_entrega
+                    FROM antes a JOIN despues d ON d.id = a.id
+                    WHERE d.estado_auditoria IN ('Lista para Radicar', 'Devuelta por Auditor')
+                      AND d.estado_auditoria IS DISTINCT FROM a.estado_auditoria
+                    UNION ALL
+                    SELECT d.fecha_entrega_radicador::date, COALESCE(d.facturador, ''), COALESCE(d.eps, ''),
+                           COALESCE(d.area_servicio, ''), 0, 0, 1,
+                           COALESCE(d.fecha_entrega_radicador::date - d.fecha_hora_entrega::date, 0)
+                    FROM antes a JOIN despues d ON d.id = a.id
+                    WHERE a.fecha_entrega_radicador IS NULL AND d.fecha_entrega_radicador IS NOT NULL
+                ) e
+                GROUP BY e.dia, e.facturador, e.eps, e.area_servicio
+                ON CONFLICT (dia, facturador, eps, area_servicio) DO UPDATE SET
+                    auditadas = r.auditadas + EXCLUDED.auditadas,
+                    devueltas = r.devueltas + EXCLUDED.devueltas,
+                    entregadas = r.entregadas + EXCLUDED.entregadas,
+                    dias_entrega_suma = r.dias_entrega_suma + EXCLUDED.dias_entrega_suma;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS trg_facturas_resumen_ingresos ON facturas;",
+            """
+            CREATE TRIGGER trg_facturas_resumen_ingresos AFTER INSERT ON facturas
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION resumen_diario_sumar_ingresos();
+            """,
+            "DROP TRIGGER IF EXISTS trg_facturas_resumen_cambios ON facturas;",
+            """
+            CREATE TRIGGER trg_facturas_resumen_cambios AFTER UPDATE ON facturas
+            REFERENCING OLD TABLE AS antes NEW TABLE AS despues
+            FOR EACH STATEMENT EXECUTE FUNCTION resumen_diario_sumar_cambios();
+            """,
+            # Carga inicial desde las fechas guardadas (activas y archivadas). Las decisiones de
+            # auditoría anteriores a esta migración no quedaron registradas con fecha y no se reconstruyen.
+            """
+            INSERT INTO resumen_diario AS r (dia, facturador, eps, area_servicio, ingresadas, entregadas, dias_entrega_suma)
+            SELECT e.dia, e.facturador, e.eps, e.area_servicio,
+                   SUM(e.ingresadas), SUM(e.entregadas), SUM(e.dias_entrega)
+            FROM (
+                SELECT fecha_hora_entrega, fecha_entrega_radicador, facturador, eps, area_servicio FROM facturas
+                UNION ALL
+                SELECT fecha_hora_entrega, fecha_entrega_radicador, facturador, eps, area_servicio FROM facturas_historico
+            ) f
+            CROSS JOIN LATERAL (
+                SELECT f.fecha_hora_entrega::date AS dia, COALESCE(f.facturador, '') AS facturador,
+                       COALESCE(f.eps, '') AS eps, COALESCE(f.area_servicio, '') AS area_servicio,
+                       1 AS ingresadas, 0 AS entregadas, 0 AS dias_entrega
+                WHERE f.fecha_hora_entrega IS NOT NULL
+                UNION ALL
+                SELECT f.fecha_entrega_radicador::date, COALESCE(f.facturador, ''), COALESCE(f.eps, ''),
+                       COALESCE(f.area_servicio, ''), 0, 1,
+                       COALESCE(f.fecha_entrega_radicador::date - f.fecha_hora_entrega::date, 0)
+                WHERE f.fecha_entrega_radicador IS NOT NULL
+            ) e
+            GROUP BY e.dia, e.facturador, e.eps, e.area_servicio
+            ON CONFLICT (dia, facturador, eps, area_servicio) DO NOTHING;
+            """,
+        ],
+    },
+    {
+        'version': 14,
+        'descripcion': 'Registro de eventos de auditoría de facturas (solo inserción)',
+        'sentencias': [
+            # Sin llave foránea a facturas: los eventos se conservan tras el archivo o la eliminación.
+            # usuario viene de app.usuario, que DatabaseConnection fija en cada transacción de escritura.
+            """
+            CREATE TABLE IF NOT EXISTS facturas_eventos (
+                id BIGSERIAL PRIMARY KEY,
+                factura_id INTEGER NOT NULL,
+                tipo TEXT NOT NULL,
+                estado_anterior TEXT,
+                estado_nuevo TEXT,
+                ocurrido_en TIMESTAMP NOT NULL DEFAULT NOW(),
+                usuario TEXT DEFAULT current_setting('app.usuario', true)
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_facturas_eventos_factura_id ON facturas_eventos (factura_id, ocurrido_en);",
+            # Las filas llegan en orden de ocurrido_en: un BRIN basta para los rangos de tiempo.
+            "CREATE INDEX IF NOT EXISTS idx_facturas_eventos_ocurrido_en ON facturas_eventos USING BRIN (ocurrido_en);",
+            """
+            CREATE OR REPLACE FUNCTION facturas_eventos_solo_insercion() RETURNS trigger AS $$
+            BEGIN
+                RAISE EXCEPTION 'facturas_eventos solo admite inserciones';
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS trg_facturas_eventos_solo_insercion ON facturas_eventos;",
+            """
+            CREATE TRIGGER trg_facturas_eventos_solo_insercion BEFORE UPDATE OR DELETE ON facturas_eventos
+            FOR EACH STATEMENT EXECUTE FUNCTION facturas_eventos_solo_insercion();
+            """,
+            # Como el resumen diario, por sentencia: una auditoría por lotes registra todos sus eventos
+            # con un solo INSERT, en la misma transacción que el cambio de estado.
+            """
+            CREATE OR REPLACE FUNCTION facturas_registrar_ingresos() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO facturas_eventos (factura_id, tipo, estado_nuevo)
+                SELECT n.id, 'ingreso', n.estado_auditoria FROM nuevas n;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            """
+            CREATE OR REPLACE FUNCTION facturas_registrar_cambios() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO facturas_eventos (factura_id, tipo, estado_anterior, estado_nuevo)
+                SELECT d.id, 'estado', a.estado_auditoria, d.estado_auditoria
+                FROM antes a JOIN despues d ON d.id = a.id
+                WHERE d.estado_auditoria IS DISTINCT FROM a.estado_auditoria
+                UNION ALL
+                SELECT d.id, 'entrega_radicador', a.estado_auditoria, d.estado_auditoria
+                FROM antes a JOIN despues d ON d.id = a.id
+                WHERE a.fecha_entrega_radicador IS NULL AND d.fecha_entrega_radicador IS NOT NULL;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS trg_facturas_eventos_ingresos ON facturas;",
+            """
+            CREATE TRIGGER trg_facturas_eventos_ingresos AFTER INSERT ON facturas
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION facturas_registrar_ingresos();
+            """,
+            "DROP TRIGGER IF EXISTS trg_facturas_eventos_cambios ON facturas;",
+            """
+            CREATE TRIGGER trg_facturas_eventos_cambios AFTER UPDATE ON facturas
+            REFERENCING OLD TABLE AS antes NEW TABLE AS despues
+            FOR EACH STATEMENT EXECUTE FUNCTION facturas_registrar_cambios();
+            """,
+        ],
+    },
+    {
+        'version': 15,
+        'descripcion': 'Quita updated_at de detalles_soat, que el feed de cambios no usa',
+        'sentencias': [
+            # Las migraciones 9 y 10 crearon la columna, su trigger y su índice (que cae con la columna),
+            # pero el feed de cambios nunca lee detalles_soat: el listado no muestra el detalle SOAT.
+            # El histórico se creó con LIKE detalles_soat y debe conservar las mismas columnas.
+            "DROP TRIGGER IF EXISTS trg_detalles_soat_updated_at ON detalles_soat;",
+            "DROP FUNCTION IF EXISTS tocar_updated_at();",
+            "ALTER TABLE detalles_soat DROP COLUMN IF EXISTS updated_at;",
+            "ALTER TABLE detalles_soat_historico DROP COLUMN IF EXISTS updated_at;",
+        ],
+    },
+]
+
+def _asegurar_tabla_version(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            aplicada_en TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """)
+
+def _versiones_aplicadas(cursor):
+    cursor.execute("SELECT version FROM schema_version;")
+    return {row[0] for row in cursor.fetchall()}
+
+def _eliminar_indices_invalidos(cursor):
+    # Un CREATE INDEX CONCURRENTLY interrumpido deja un índice INVALID que
+    # IF NOT EXISTS no vuelve a construir; se elimina antes de reintentar.
+    cursor.execute("""
+        SELECT c.relname, c.relkind = 'I'
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE NOT i.indisvalid AND n.nspname = current_schema();
+    """)
+    for nombre_indice, particionado in cursor.fetchall():
+        logging.warning(f"Eliminando índice inválido '{nombre_indice}' de una migración concurrente previa.")
+        concurrently = "" if particionado else " CONCURRENTLY"
+        cursor.execute(f'DROP INDEX{concurrently} IF EXISTS "{nombre_indice}";')
+
+# Objeto sobre el que actúa una sentencia CREATE/DROP INDEX CONCURRENTLY: la tabla o el índice.
+_OBJETIVO_CONCURRENTE = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\b.*?\bON\s+(?:ONLY\s+)?([\w.\"]+)"
+    r"|DROP\s+INDEX\s+CONCURRENTLY\s+(?:IF\s+EXISTS\s+)?([\w.\"]+)",
+    re.IGNORECASE | re.DOTALL)
+
+SQL_ES_PARTICIONADO = "SELECT COALESCE(bool_or(relkind IN ('p', 'I')), false) FROM pg_class WHERE oid = to_regclass(%s);"
+
+def _adaptar_a_particionada(cursor, sentencia):
+    """Quita CONCURRENTLY de la sentencia si actúa sobre una tabla o un índice particionado."""
+    coincidencia = _OBJETIVO_CONCURRENTE.search(sentencia)
+    if not coincidencia:
+        return sentencia
+    objetivo = coincidencia.group(1) or coincidencia.group(2)
+    cursor.execute(SQL_ES_PARTICIONADO, (objetivo,))
+    if not cursor.fetchone()[0]:
+        return sentencia
+    logging.warning(f"'{objetivo}' está particionado: la sentencia se ejecuta sin CONCURRENTLY y bloquea escrituras mientras dura.")
+    return re.sub(r"\s+CONCURRENTLY\b", "", sentencia, count=1, flags=re.IGNORECASE)
+
+def _aplicar_migracion(conn, migracion):
+    version = migracion['version']
+    concurrente = migracion.get('concurrente', False)
+    conn.autocommit = concurrente
+    try:
+        with conn.cursor() as cursor:
+            if concurrente:
+                _eliminar_indices_invalidos(cursor)
+            for sentencia in migracion['sentencias']:
+                if concurrente:
+                    sentencia = _adaptar_a_particionada(cursor, sentencia)
+                cursor.execute(sentencia)
+            cursor.execute(
+                "INSERT INTO schema_version (version, descripcion) VALUES (%s, %s);",
+                (version, migracion['descripcion'])
+            )
+        if not concurrente:
+            conn.commit()
+        logging.info(f"Migración {version} aplicada: {migracion['descripcion']}")
+    except Error:
+        if not concurrente:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+def abrir_conexion_migraciones(dsn=None):
+    """Conexión dedicada que conserva el estado de sesión; None si no hay o pasa por el pooler transaccional."""
+    conn = db_ops.abrir_conexion_dedicada(dsn or DSN_MIGRACIONES)
+    if conn is None:
+        return None
+    try:
+        puerto = int(conn.info.port)
+    except (AttributeError, TypeError, ValueError):
+        puerto = None
+    if puerto == sentencias_preparadas.PUERTO_POOLER_TRANSACCIONAL:
+        logging.error(f"Las migraciones no pueden correr por el pooler en modo transacción (puerto {puerto}): "
+                      "configure DB_MIGRACIONES_DSN con una conexión directa o del pooler en modo sesión.")
+        conn.close()
+        return None
+    return conn
+
+def aplicar_migraciones(hasta=None, dsn=None):
+    conn = abrir_conexion_migraciones(dsn)
+    if conn is None:
+        logging.error("No se pudo obtener una conexión para aplicar migraciones.")
+        return False
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s);", (LLAVE_BLOQUEO_MIGRACIONES,))
+            _asegurar_tabla_version(cursor)
+            aplicadas = _versiones_aplicadas(cursor)
+
+        pendientes = [m for m in sorted(MIGRACIONES, key=lambda m: m['version'])
+                      if m['version'] not in aplicadas and (hasta is None or m['version'] <= hasta)]
+        if not pendientes:
+            logging.info("Esquema al día; no hay migraciones pendientes.")
+        for migracion in pendientes:
+            _aplicar_migracion(conn, migracion)
+        return True
+    except Error as e:
+        logging.error(f"Error al aplicar migraciones: {e}")
+        return False
+    finally:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s);", (LLAVE_BLOQUEO_MIGRACIONES,))
+        except Error:
+            pass
+        conn.close()
+
+def estado_migraciones(dsn=None):
+    conn = db_ops.abrir_conexion_dedicada(dsn)
+    if conn is None:
+        return []
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            _asegurar_tabla_version(cursor)
+            cursor.execute("SELECT version, aplicada_en FROM schema_version;")
+            aplicadas = dict(cursor.fetchall())
+        return [(m['version'], m['descripcion'], aplicadas.get(m['version'])) for m in MIGRACIONES]
+    except Error as e:
+        logging.error(f"Error al consultar el estado de las migraciones: {e}")
+        return []
+    finally:
+        conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aplica las migraciones pendientes del esquema de trazabilidad.")
+    parser.add_argument("--estado", action="store_true", help="Solo muestra qué migraciones están aplicadas.")
+    parser.add_argument("--hasta", type=int, default=None, help="Aplica migraciones solo hasta esta versión.")
+    parser.add_argument("--reparar-secuencia", action="store_true",
+                        help="Vuelve a sincronizar la secuencia de IDs de facturas (tras importar datos).")
+    args = parser.parse_args(argv)
+
+    if args.estado:
+        for version, descripcion, aplicada_en in estado_migraciones():
+            marca = aplicada_en.strftime('%Y-%m-%d %H:%M:%S') if aplicada_en else "PENDIENTE"
+            print(f"{version:>4}  {marca:<19}  {descripcion}")
+        return 0
+
+    if not aplicar_migraciones(hasta=args.hasta):
+        return 1
+    if args.reparar_secuencia:
+        db_ops.reparar_secuencia_ids()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+"""
+Particionado opcional de facturas por rango de fecha_generacion (una partición por año).
+
+No forma parte de MIGRACIONES: convertir la tabla copia todas las filas bajo un
+bloqueo exclusivo, así que se ejecuta en una ventana de mantenimiento y exige
+PostgreSQL 13 o superior (triggers BEFORE sobre tablas particionadas):
+
+    python -m backend.particionado --convertir
+    python -m backend.particionado --asegurar 2        # particiones de los 2 años siguientes
+    python -m backend.particionado --mover 2022 --tablespace almacenamiento_frio
+    python -m backend.particionado --desprender 2021
+    python -m backend.particionado --integridad        # reinstala SENTENCIAS_INTEGRIDAD
+
+Diferencias con la tabla sin particionar, impuestas por PostgreSQL:
+  - La llave primaria es (id, fecha_generacion) y la restricción unique_factura_details
+    incluye fecha_generacion; fecha_generacion pasa a NOT NULL. La unicidad original
+    (numero_factura, facturador, eps, area_servicio) la mantiene un trigger que consulta
+    idx_facturas_numero_factura en cada partición. Ese trigger lanza unique_violation en
+    lugar de dejar actuar al ON CONFLICT DO NOTHING de la carga masiva, que de todos modos
+    descarta antes los números existentes. Los IDs siguen saliendo de la misma secuencia.
+  - Una tabla particionada no puede ser referenciada solo por id, así que las llaves
+    foráneas factura_original_id y detalles_soat.factura_id se reemplazan por triggers
+    equivalentes (existencia de la referencia, borrado bloqueado si hay reemplazos y
+    borrado en cascada de detalles_soat).
+  - Con DB_MESES_PERIODO_ACTIVO > 0 (database_operations.MESES_PERIODO_ACTIVO, desactivado
+    por defecto) la grilla por urgencia sin búsqueda se limita al período activo, cuyo
+    predicado sobre fecha_generacion descarta las particiones de años anteriores.
+
+Los índices y triggers de las migraciones se recrean en la tabla nueva a partir de sus
+definiciones en el catálogo, de modo que las consultas por urgencia, bandejas y feed de
+cambios siguen usando sus índices en cada partición.
+"""
+import argparse
+import logging
+import sys
+from datetime import date
+from psycopg2 import Error
+
+from backend import database_operations as db_ops
+from backend import migraciones
+from backend.migraciones import LLAVE_BLOQUEO_MIGRACIONES
+
+PARTICION_POR_DEFECTO = "facturas_default"
+
+SQL_ES_PARTICIONADA = "SELECT relkind = 'p' FROM pg_class WHERE oid = 'facturas'::regclass;"
+
+SQL_INDICES_FACTURAS = """
+    SELECT pg_get_indexdef(i.indexrelid)
+    FROM pg_index i
+    WHERE i.indrelid = 'facturas'::regclass AND NOT i.indisunique AND NOT i.indisprimary;
+"""
+
+SQL_TRIGGERS_FACTURAS = """
+    SELECT pg_get_triggerdef(t.oid)
+    FROM pg_trigger t
+    WHERE t.tgrelid = 'facturas'::regclass AND NOT t.tgisinternal;
+"""
+
+SQL_RANGO_ANIOS = """
+    SELECT EXTRACT(YEAR FROM MIN(fecha_generacion))::int, EXTRACT(YEAR FROM MAX(fecha_generacion))::int,
+           COUNT(*) FILTER (WHERE fecha_generacion IS NULL)
+    FROM facturas;
+"""
+
+SQL_PARTICIONES = """
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_inherits h
+    JOIN pg_class c ON c.oid = h.inhrelid
+    WHERE h.inhparent = 'facturas'::regclass
+    ORDER BY c.relname;
+"""
+
+SQL_REFERENCIAS_A_PARTICION = """
+    SELECT COUNT(*) FROM facturas f
+    JOIN {particion} p ON f.factura_original_id = p.id
+    WHERE f.tableoid <> '{particion}'::regclass;
+"""
+
+SQL_INDICES_PARTICION = "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s;"
+
+# Reemplazo de las llaves foráneas y de la unicidad original. Las verificaciones de
+# referencias son triggers AFTER por sentencia con tablas de transición: ven las filas
+# insertadas en la misma sentencia (SQL_CREAR_FACTURA inserta la factura y su detalle SOAT
+# en una sola) y consultan cada partición una vez por sentencia, no una vez por fila.
+# La factura referenciada se toma FOR KEY SHARE, como haría la llave foránea, para que un
+# borrado concurrente espere a que la referencia se confirme y la vea.
+# Un UPDATE que cambia fecha_generacion mueve la fila de partición, pero PostgreSQL no
+# dispara los triggers DELETE por sentencia en ese caso, así que no cuenta como borrado.
+SENTENCIAS_INTEGRIDAD = [
+    "DROP TRIGGER IF EXISTS trg_facturas_verificar_original ON facturas;",
+    "DROP TRIGGER IF EXISTS trg_facturas_verificar_original_insercion ON facturas;",
+    "DROP TRIGGER IF EXISTS trg_facturas_verificar_original_cambio ON facturas;",
+    "DROP TRIGGER IF EXISTS trg_facturas_cascada_eliminacion ON facturas;",
+    "DROP TRIGGER IF EXISTS trg_facturas_unicidad ON facturas;",
+    "DROP TRIGGER IF EXISTS trg_detalles_soat_verificar_factura ON detalles_soat;",
+    "DROP TRIGGER IF EXISTS trg_detalles_soat_verificar_factura_insercion ON detalles_soat;",
+    "DROP TRIGGER IF EXISTS trg_detalles_soat_verificar_factura_cambio ON detalles_soat;",
+    """
+    CREATE OR REPLACE FUNCTION facturas_verificar_referencias(referencias INTEGER[]) RETURNS void AS $$
+    DECLARE
+        faltante INTEGER;
+    BEGIN
+        IF cardinality(referencias) = 0 THEN
+            RETURN;
+        END IF;
+        PERFORM 1 FROM facturas WHERE id = ANY (referencias) FOR KEY SHARE;
+        SELECT r INTO faltante
+        FROM unnest(referencias) AS r
+        WHERE NOT EXISTS (SELECT 1 FROM facturas WHERE id = r)
+        LIMIT 1;
+        IF FOUND THEN
+            RAISE EXCEPTION 'La factura % no existe', faltante
+                USING ERRCODE = 'foreign_key_violation';
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION facturas_verificar_original() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM facturas_verificar_referencias(ARRAY(
+                SELECT DISTINCT factura_original_id FROM nuevas WHERE factura_original_id IS NOT NULL));
+        ELSE
+            PERFORM facturas_verificar_referencias(ARRAY(
+                SELECT DISTINCT n.factura_original_id
+                FROM nuevas n JOIN anteriores a ON a.id = n.id
+                WHERE n.factura_original_id IS NOT NULL
+                  AND n.factura_original_id IS DISTINCT FROM a.factura_original_id));
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER trg_facturas_verificar_original_insercion
+        AFTER INSERT ON facturas
+        REFERENCING NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION facturas_verificar_original();
+    """,
+    """
+    CREATE TRIGGER trg_facturas_verificar_original_cambio
+        AFTER UPDATE ON facturas
+        REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION facturas_verificar_original();
+    """,
+    """
+    CREATE OR REPLACE FUNCTION facturas_cascada_eliminacion() RETURNS trigger AS $$
+    DECLARE
+        referenciada INTEGER;
+    BEGIN
+        SELECT b.id INTO referenciada
+        FROM borradas b JOIN facturas f ON f.factura_original_id = b.id
+        LIMIT 1;
+        IF FOUND THEN
+            RAISE EXCEPTION 'La factura % tiene reemplazos que la referencian', referenciada
+                USING ERRCODE = 'foreign_key_violation';
+        END IF;
+        DELETE FROM detalles_soat d USING borradas b WHERE d.factura_id = b.id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER trg_facturas_cascada_eliminacion
+        AFTER DELETE ON facturas
+        REFERENCING OLD TABLE AS borradas
+        FOR EACH STATEMENT EXECUTE FUNCTION facturas_cascada_eliminacion();
+    """,
+    """
+    CREATE OR REPLACE FUNCTION detalles_soat_verificar_factura() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM facturas_verificar_referencias(ARRAY(
+                SELECT DISTINCT factura_id FROM nuevas WHERE factura_id IS NOT NULL));
+        ELSE
+            PERFORM facturas_verificar_referencias(ARRAY(
+                SELECT DISTINCT n.factura_id
+                FROM nuevas n JOIN anteriores a ON a.id = n.id
+                WHERE n.factura_id IS NOT NULL AND n.factura_id IS DISTINCT FROM a.factura_id));
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER trg_detalles_soat_verificar_factura_insercion
+        AFTER INSERT ON detalles_soat
+        REFERENCING NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION detalles_soat_verificar_factura();
+    """,
+    """
+    CREATE TRIGGER trg_detalles_soat_verificar_factura_cambio
+        AFTER UPDATE ON detalles_soat
+        REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION detalles_soat_verificar_factura();
+    """,
+    # unique_factura_details particionada incluye fecha_generacion; este trigger mantiene la
+    # unicidad original (numero_factura, facturador, eps, area_servicio) entre particiones.
+    # El bloqueo consultivo por llave serializa las inserciones concurrentes del mismo número,
+    # y la consulta posterior ve las filas ya confirmadas y las anteriores de la misma sentencia.
+    """
+    CREATE OR REPLACE FUNCTION facturas_verificar_unicidad() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext(concat_ws('|', NEW.numero_factura, NEW.facturador,
+                                                          NEW.eps, NEW.area_servicio)));
+        IF EXISTS (SELECT 1 FROM facturas
+                   WHERE numero_factura = NEW.numero_factura AND facturador = NEW.facturador
+                     AND eps = NEW.eps AND area_servicio = NEW.area_servicio AND id <> NEW.id) THEN
+            RAISE EXCEPTION 'Ya existe la factura % de % (%, %)', NEW.numero_factura, NEW.facturador,
+                NEW.eps, NEW.area_servicio
+                USING ERRCODE = 'unique_violation', CONSTRAINT = 'unique_factura_details';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER trg_facturas_unicidad
+        BEFORE INSERT OR UPDATE OF numero_factura, facturador, eps, area_servicio ON facturas
+        FOR EACH ROW EXECUTE FUNCTION facturas_verificar_unicidad();
+    """,
+]
+
+def nombre_particion(anio):
+    return f"facturas_{anio}"
+
+def _sentencia_crear_particion(anio):
+    return (f"CREATE TABLE IF NOT EXISTS {nombre_particion(anio)} PARTITION OF facturas "
+            f"FOR VALUES FROM ('{anio}-01-01') TO ('{anio + 1}-01-01');")
+
+def es_particionada(cursor):
+    cursor.execute(SQL_ES_PARTICIONADA)
+    return bool(cursor.fetchone()[0])
+
+def _conexion_con_bloqueo():
+    # Misma conexión y llave que las migraciones: no se particiona mientras otro proceso migra.
+    conn = migraciones.abrir_conexion_migraciones()
+    if conn is None:
+        logging.error("No se pudo obtener una conexión para el particionado.")
+        return None
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s);", (LLAVE_BLOQUEO_MIGRACIONES,))
+    return conn
+
+def _liberar(conn):
+    try:
+        conn.rollback()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (LLAVE_BLOQUEO_MIGRACIONES,))
+    except Error:
+        pass
+    conn.close()
+
+def convertir_a_particionada(anios_adelante=1):
+    """
+    Reemplaza facturas por una tabla particionada por año con las mismas columnas, filas,
+    índices y triggers. Todo ocurre en una transacción: si algo falla, la tabla queda intacta.
+    """
+    conn = _conexion_con_bloqueo()
+    if conn is None:
+        return False
+    try:
+        conn.autocommit = False
+        with conn.cursor() as cursor:
+            if es_particionada(cursor):
+                logging.info("La tabla facturas ya está particionada.")
+                return True
+            cursor.execute("LOCK TABLE facturas, detalles_soat IN ACCESS EXCLUSIVE MODE;")
+            cursor.execute(SQL_RANGO_ANIOS)
+            anio_min, anio_max, sin_fecha = cursor.fetchone()
+            if sin_fecha:
+                logging.error(f"{sin_fecha} facturas no tienen fecha_generacion; complétela antes de particionar.")
+                conn.rollback()
+                return False
+            cursor.execute(SQL_INDICES_FACTURAS)
+            indices = [fila[0] for fila in cursor.fetchall()]
+            cursor.execute(SQL_TRIGGERS_FACTURAS)
+            triggers = [fila[0] for fila in cursor.fetchall()]
+
+            anio_actual = date.today().year
+            anio_min = min(anio_min or anio_actual, anio_actual)
+            anio_max = max(anio_max or anio_actual, anio_actual) + anios_adelante
+
+            cursor.execute("ALTER TABLE facturas RENAME TO facturas_sin_particionar;")
+            cursor.execute("""
+                CREATE TABLE facturas (LIKE facturas_sin_particionar INCLUDING DEFAULTS)
+                PARTITION BY RANGE (fecha_generacion);
+            """)
+            cursor.execute("ALTER TABLE facturas ALTER COLUMN fecha_generacion SET NOT NULL;")
+            cursor.execute("ALTER TABLE facturas ADD PRIMARY KEY (id, fecha_generacion);")
+            for anio in range(anio_min, anio_max + 1):
+                cursor.execute(_sentencia_crear_particion(anio))
+            cursor.execute(f"CREATE TABLE {PARTICION_POR_DEFECTO} PARTITION OF facturas DEFAULT;")
+
+            # Los triggers aún no existen en la tabla nueva: la copia conserva version y updated_at.
+            cursor.execute("INSERT INTO facturas SELECT * FROM facturas_sin_particionar;")
+            logging.info(f"{cursor.rowcount} facturas copiadas a la tabla particionada ({anio_min}-{anio_max}).")
+
+            # La secuencia pasa a la tabla nueva antes de eliminar la anterior, que se la llevaría consigo.
+            cursor.execute("ALTER SEQUENCE facturas_id_seq OWNED BY facturas.id;")
+            cursor.execute("ALTER TABLE detalles_soat DROP CONSTRAINT IF EXISTS detalles_soat_factura_id_fkey;")
+            cursor.execute("DROP TABLE facturas_sin_particionar;")
+
+            cursor.execute("""
+                ALTER TABLE facturas ADD CONSTRAINT unique_factura_details
+                UNIQUE (numero_factura, facturador, eps, area_servicio, fecha_generacion);
+            """)
+            for definicion in indices:
+                cursor.execute(definicion)
+            for definicion in triggers:
+                cursor.execute(definicion)
+            _instalar_integridad(cursor)
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE facturas;")
+        logging.info(f"Tabla facturas particionada: {len(indices)} índices y {len(triggers)} triggers recreados.")
+        return True
+    except Error as e:
+        logging.error(f"Error al particionar la tabla facturas: {e}")
+        return False
+    finally:
+        _liberar(conn)
+
+def _instalar_integridad(cursor):
+    for sentencia in SENTENCIAS_INTEGRIDAD:
+        cursor.execute(sentencia)
+
+def reinstalar_integridad():
+    """Reemplaza los triggers de integridad de una tabla ya particionada por los de SENTENCIAS_INTEGRIDAD."""
+    conn = _conexion_con_bloqueo()
+    if conn is None:
+        return False
+    try:
+        conn.autocommit = False
+        with conn.cursor() as cursor:
+            if not es_particionada(cursor):
+                logging.info("La tabla facturas no está particionada; conserva sus llaves foráneas.")
+                return True
+            _instalar_integridad(cursor)
+        conn.commit()
+        logging.info("Triggers de integridad de facturas reinstalados.")
+        return True
+    except Error as e:
+        logging.error(f"Error al reinstalar los triggers de integridad: {e}")
+        return False
+    finally:
+        _liberar(conn)
+
+def asegurar_particiones(anios_adelante=1):
+    """Crea las particiones del año actual y de los `anios_adelante` siguientes que falten."""
+    conn = _conexion_con_bloqueo()
+    if conn is None:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            if not es_particionada(cursor):
+                logging.error("La tabla facturas no está particionada; ejecute primero --convertir.")
+                return False
+            anio_actual = date.today().year
+            for anio in range(anio_actual, anio_actual + anios_adelante + 1):
+                # Falla si la partición por defecto ya guarda filas de ese año; en ese caso hay que
+                # moverlas en una ventana de mantenimiento antes de crear la partición.
+                cursor.execute(_sentencia_crear_particion(anio))
+        logging.info(f"Particiones de facturas aseguradas hasta {anio_actual + anios_adelante}.")
+        return True
+    except Error as e:
+        logging.error(f"Error al crear particiones de facturas: {e}")
+        return False
+    finally:
+        _liberar(conn)
+
+def mover_particion(anio, tablespace):
+    """Mueve la partición de un año (tabla e índices) a otro tablespace, p. ej. de almacenamiento más barato."""
+    particion = nombre_particion(anio)
+    conn = _conexion_con_bloqueo()
+    if conn is None:
+        return False
+    try:
+        conn.autocommit = False
+        with conn.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {particion} SET TABLESPACE "{tablespace}";')
+            cursor.execute(SQL_INDICES_PARTICION, (particion,))
+            for (indice,) in cursor.fetchall():
+                cursor.execute(f'ALTER INDEX "{indice}" SET TABLESPACE "{tablespace}";')
+        conn.commit()
+        logging.info(f"Partición {particion} movida al tablespace '{tablespace}'.")
+        return True
+    except Error as e:
+        logging.error(f"Error al mover la partición {particion} al tablespace '{tablespace}': {e}")
+        return False
+    finally:
+        _liberar(conn)
+
+def desprender_particion(anio):
+    """
+    Separa la partición de un año de facturas: deja de aparecer en la aplicación pero se
+    conserva como tabla independiente (se puede archivar, mover o volver a adjuntar).
+    Se niega si facturas de otros años la referencian como original.
+    """
+    particion = nombre_particion(anio)
+    conn = _conexion_con_bloqueo()
+    if conn is None:
+        return False
+    try:
+        conn.autocommit = False
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_REFERENCIAS_A_PARTICION.format(particion=particion))
+            referencias = cursor.fetchone()[0]
+            if referencias:
+                logging.error(f"{referencias} facturas de otros años referencian a {particion}; no se desprende.")
+                conn.rollback()
+                return False
+            cursor.execute(f"ALTER TABLE facturas DETACH PARTITION {particion};")
+        conn.commit()
+        logging.info(f"Partición {particion} desprendida; sus detalles SOAT se conservan en detalles_soat.")
+        return True
+    except Error as e:
+        logging.error(f"Error al desprender la partición {particion}: {e}")
+        return False
+    finally:
+        _liberar(conn)
+
+def listar_particiones():
+    conn = db_ops.abrir_conexion_dedicada()
+    if conn is None:
+        return []
+    try:
+        with conn.cursor() as cursor:
+            if not es_particionada(cursor):
+                return []
+            cursor.execute(SQL_PARTICIONES)
+            return cursor.fetchall()
+    except Error as e:
+        logging.error(f"Error al listar las particiones de facturas: {e}")
+        return []
+    finally:
+        conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Particionado por año de la tabla facturas.")
+    parser.add_argument("--convertir", action="store_true", help="Convierte facturas en tabla particionada (requiere ventana de mantenimiento).")
+    parser.add_argument("--asegurar", type=int, metavar="ANIOS", help="Crea las particiones del año actual y de los N siguientes.")
+    parser.add_argument("--mover", type=int, metavar="ANIO", help="Mueve la partición del año al tablespace indicado.")
+    parser.add_argument("--tablespace", help="Tablespace destino para --mover.")
+    parser.add_argument("--desprender", type=int, metavar="ANIO", help="Desprende la partición del año.")
+    parser.add_argument("--integridad", action="store_true", help="Reinstala los triggers que reemplazan llaves foráneas y unicidad.")
+    args = parser.parse_args(argv)
+
+    if args.convertir:
+        return 0 if convertir_a_particionada() else 1
+    if args.integridad:
+        return 0 if reinstalar_integridad() else 1
+    if args.asegurar is not None:
+        return 0 if asegurar_particiones(args.asegurar) else 1
+    if args.mover is not None:
+        if not args.tablespace:
+            parser.error("--mover requiere --tablespace.")
+        return 0 if mover_particion(args.mover, args.tablespace) else 1
+    if args.desprender is not None:
+        return 0 if desprender_particion(args.desprender) else 1
+
+    for nombre, limites in listar_particiones():
+        print(f"{nombre:<24}  {limites}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Enrutamiento de lecturas a una réplica opcional.
+
+Con DB_REPLICA_DSN configurado, las operaciones de solo lectura de database_operations
+(tablas, estadísticas, lotes, reportes, exportaciones) se envían a la réplica mientras:
+  - su retraso de replicación no supere DB_REPLICA_RETRASO_MAX_S (se mide cada
+    DB_REPLICA_INTERVALO_S segundos, no en cada consulta), y
+  - la sesión no haya escrito en los últimos DB_REPLICA_ADHERENCIA_S segundos; así quien
+    acaba de guardar o auditar lee sus propios cambios desde la primaria.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+REPLICA_DSN = os.environ.get("DB_REPLICA_DSN")
+RETRASO_MAX_S = float(os.environ.get("DB_REPLICA_RETRASO_MAX_S", "5"))
+ADHERENCIA_S = float(os.environ.get("DB_REPLICA_ADHERENCIA_S", "15"))
+INTERVALO_VERIFICACION_S = float(os.environ.get("DB_REPLICA_INTERVALO_S", "5"))
+
+# Retraso 0 si la réplica ya aplicó todo lo recibido (una primaria sin escrituras no la "atrasa").
+SQL_RETRASO_REPLICA = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END;
+"""
+
+_bloqueo = threading.Lock()
+_ultima_escritura = {}
+_estado = {'verificado_en': None, 'retraso_s': None, 'utilizable': False}
+lecturas = Counter()
+
+def replica_configurada():
+    return bool(REPLICA_DSN)
+
+def id_sesion_actual():
+    """Sesión de Streamlit que ejecuta la operación; None fuera de la app (herramientas de línea de comandos)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        contexto = get_script_run_ctx()
+        return contexto.session_id if contexto else None
+    except ImportError:
+        return None
+
+def registrar_escritura():
+    ahora = time.monotonic()
+    with _bloqueo:
+        for sesion in [sesion for sesion, ultima in _ultima_escritura.items() if ahora - ultima >= ADHERENCIA_S]:
+            del _ultima_escritura[sesion]
+        _ultima_escritura[id_sesion_actual()] = ahora
+
+def sesion_escribio_recientemente():
+    ultima = _ultima_escritura.get(id_sesion_actual())
+    return ultima is not None and time.monotonic() - ultima < ADHERENCIA_S
+
+def _medir_retraso(conn):
+    from psycopg2 import Error
+    from psycopg2.extensions import cursor as cursor_simple
+    try:
+        with conn.cursor(cursor_factory=cursor_simple) as cursor:
+            cursor.execute(SQL_RETRASO_REPLICA)
+            retraso = cursor.fetchone()[0]
+        conn.rollback()
+        return None if retraso is None else float(retraso)
+    except Error as e:
+        logging.warning(f"No se pudo medir el retraso de la réplica: {e}")
+        try:
+            conn.rollback()
+        except Error:
+            pass
+        return None
+
+def replica_utilizable(pool):
+    """
+    Verifica (como mucho cada INTERVALO_VERIFICACION_S) que la réplica responde y está al día.
+    Mide con una conexión del pool de la réplica para no interferir con las lecturas en curso.
+    """
+    if pool is None:
+        return False
+    ahora = time.monotonic()
+    with _bloqueo:
+        if _estado['verificado_en'] is not None and ahora - _estado['verificado_en'] < INTERVALO_VERIFICACION_S:
+            return _estado['utilizable']
+        _estado['verificado_en'] = ahora
+    try:
+        conn = pool.getconn()
+    except Exception as e:
+        logging.warning(f"No se pudo obtener una conexión de la réplica para medir el retraso: {e}")
+        return _estado['utilizable']
+    try:
+        retraso = _medir_retraso(conn)
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+    utilizable = retraso is not None and retraso <= RETRASO_MAX_S
+    with _bloqueo:
+        if utilizable != _estado['utilizable']:
+            if utilizable:
+                logging.info(f"Réplica disponible (retraso {retraso:.1f} s); las lecturas vuelven a enviarse a ella.")
+            else:
+                logging.warning(f"Réplica no utilizable (retraso: {retraso}); las lecturas van a la primaria.")
+        _estado['retraso_s'] = retraso
+        _estado['utilizable'] = utilizable
+    return utilizable
+
+def debe_leer_de_replica():
+    """Decisión previa a pedir la conexión: hay réplica y la sesión no escribió hace poco."""
+    return replica_configurada() and not sesion_escribio_recientemente()
+
+def registrar_lectura(destino):
+    lecturas[destino] += 1
+
+def estado():
+    return {**_estado, 'lecturas': dict(lecturas), 'sesiones_adheridas': sum(
+        1 for ultima in list(_ultima_escritura.values()) if time.monotonic() - ultima < ADHERENCIA_S)}
@@ -0,0 +1,109 @@
+"""
+Registro de sentencias preparadas para las búsquedas puntuales más frecuentes.
+
+Cada sentencia se prepara (PREPARE) la primera vez que se usa en una conexión y
+después se ejecuta por nombre (EXECUTE), sin volver a analizarla ni planificarla.
+Se lleva la cuenta de preparaciones y ejecuciones por sentencia.
+
+DB_SENTENCIAS_PREPARADAS: "1" activa, "0" desactiva, "auto" (por defecto) activa salvo
+en el puerto 6543 del pooler en modo transacción, donde una sentencia preparada en una
+conexión del servidor no está disponible en la siguiente transacción.
+
+Solo tiene efecto sobre conexiones directas o del pooler en modo sesión. La configuración
+por defecto (DB_PORT=6543) pasa por el pooler transaccional y ejecuta las sentencias sin
+preparar; para aprovecharlas, apunte la app al puerto de sesión, por ejemplo:
+
+    DB_PORT=5432                      # pooler en modo sesión o conexión directa
+    DB_SENTENCIAS_PREPARADAS=auto
+
+Forzar "1" detrás del puerto 6543 produce errores "prepared statement does not exist".
+"""
+import itertools
+import logging
+import os
+import re
+import threading
+from collections import Counter
+
+PUERTO_POOLER_TRANSACCIONAL = 6543
+PREFIJO = "pp_"
+
+def convertir_marcadores(sql):
+    """Convierte los marcadores %s de psycopg2 en $1, $2... para PREPARE."""
+    contador = itertools.count(1)
+    return re.sub(r'%s', lambda _: f"${next(contador)}", sql.strip().rstrip(';'))
+
+class RegistroSentenciasPreparadas:
+    def __init__(self, modo=None):
+        self.modo = modo or os.environ.get("DB_SENTENCIAS_PREPARADAS", "auto")
+        self._preparadas = {}
+        # El bloqueo global solo protege los diccionarios y contadores; PREPARE se serializa
+        # por conexión, así que una preparación lenta no detiene a las demás conexiones.
+        self._bloqueo = threading.Lock()
+        self._bloqueos_conexion = {}
+        self._aviso_pooler = False
+        self.preparaciones = Counter()
+        self.ejecuciones = Counter()
+        self.directas = Counter()
+
+    def habilitado_para(self, conn):
+        if self.modo == "0":
+            return False
+        if self.modo == "1":
+            return True
+        try:
+            habilitado = int(conn.info.port) != PUERTO_POOLER_TRANSACCIONAL
+        except (AttributeError, TypeError, ValueError):
+            return False
+        if not habilitado and not self._aviso_pooler:
+            self._aviso_pooler = True
+            logging.info("Sentencias preparadas desactivadas: la conexión usa el pooler en modo transacción "
+                         f"(puerto {PUERTO_POOLER_TRANSACCIONAL}); use el puerto de sesión para activarlas.")
+        return habilitado
+
+    def ejecutar(self, cursor, nombre, sql, parametros):
+        conn = cursor.connection
+        if not self.habilitado_para(conn):
+            with self._bloqueo:
+                self.directas[nombre] += 1
+            cursor.execute(sql, parametros)
+            return
+
+        nombre_preparado = PREFIJO + nombre
+        # El PID distingue una reconexión que reutilice la misma dirección de memoria.
+        clave = (id(conn), conn.get_backend_pid())
+        with self._bloqueo:
+            preparadas = self._preparadas.setdefault(clave, set())
+            bloqueo_conexion = self._bloqueos_conexion.setdefault(clave, threading.Lock())
+        with bloqueo_conexion:
+            if nombre not in preparadas:
+                cursor.execute(f"PREPARE {nombre_preparado} AS {convertir_marcadores(sql)}")
+                preparadas.add(nombre)
+                with self._bloqueo:
+                    self.preparaciones[nombre] += 1
+                logging.info(f"Sentencia '{nombre}' preparada en la conexión {clave[1]}.")
+
+        marcadores = ", ".join(["%s"] * len(parametros))
+        cursor.execute(f"EXECUTE {nombre_preparado} ({marcadores})", parametros)
+        with self._bloqueo:
+            self.ejecuciones[nombre] += 1
+
+    def olvidar_conexion(self, conn):
+        with self._bloqueo:
+            for clave in [clave for clave in self._preparadas if clave[0] == id(conn)]:
+                del self._preparadas[clave]
+                self._bloqueos_conexion.pop(clave, None)
+
+    def estadisticas(self):
+        nombres = set(self.preparaciones) | set(self.ejecuciones) | set(self.directas)
+        return {
+            nombre: {
+                'preparaciones': self.preparaciones[nombre],
+                'ejecuciones': self.ejecuciones[nombre],
+                'aciertos': self.ejecuciones[nombre] - self.preparaciones[nombre],
+                'sin_preparar': self.directas[nombre],
+            }
+            for nombre in sorted(nombres)
+        }
+
+registro = RegistroSentenciasPreparadas()
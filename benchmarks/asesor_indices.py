@@ -0,0 +1,128 @@
+"""
+Asesor de índices: ejecuta EXPLAIN sobre todo el catálogo de consultas en una base
+local con datos sintéticos y reporta recorridos secuenciales e índices que ninguna
+consulta utiliza.
+
+    python -m benchmarks.asesor_indices --dsn postgresql://localhost/trazabilidad_bench --filas 1000000
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from backend import migraciones
+from backend import database_operations as db_ops
+from benchmarks.catalogo_consultas import obtener_muestras, sentencias_catalogadas, sentencias_sin_catalogar
+from benchmarks.datos_sinteticos import cargar_facturas_sinteticas
+
+UMBRAL_FILAS_SEQ_SCAN = 10_000
+
+def recorrer_nodos(plan):
+    yield plan
+    for subplan in plan.get('Plans', []):
+        yield from recorrer_nodos(subplan)
+
+def explicar(cursor, sql, parametros):
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql.strip(), parametros)
+    resultado = cursor.fetchone()[0]
+    if isinstance(resultado, str):
+        resultado = json.loads(resultado)
+    return resultado[0]['Plan']
+
+def tamanos_tablas(cursor):
+    cursor.execute("""
+        SELECT c.relname, c.reltuples::BIGINT
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema();
+    """)
+    return dict(cursor.fetchall())
+
+def indices_existentes(cursor):
+    cursor.execute("""
+        SELECT indexname, tablename FROM pg_indexes WHERE schemaname = current_schema();
+    """)
+    return dict(cursor.fetchall())
+
+def analizar_catalogo(conn, umbral_filas=UMBRAL_FILAS_SEQ_SCAN):
+    with conn.cursor() as cursor:
+        muestras = obtener_muestras(cursor)
+        filas_por_tabla = tamanos_tablas(cursor)
+        indices = indices_existentes(cursor)
+
+        consultas = []
+        indices_usados = set()
+        for nombre, sql, parametros in sentencias_catalogadas(muestras):
+            plan = explicar(cursor, sql, parametros)
+            seq_scans = []
+            for nodo in recorrer_nodos(plan):
+                if nodo.get('Index Name'):
+                    indices_usados.add(nodo['Index Name'])
+                if nodo.get('Node Type') == 'Seq Scan':
+                    tabla = nodo.get('Relation Name')
+                    if filas_por_tabla.get(tabla, 0) >= umbral_filas:
+                        seq_scans.append(tabla)
+            consultas.append({
+                'consulta': nombre,
+                'costo_total': plan.get('Total Cost'),
+                'filas_estimadas': plan.get('Plan Rows'),
+                'seq_scans': seq_scans,
+            })
+        conn.rollback()
+
+    return {
+        'consultas': consultas,
+        'indices_sin_uso': sorted(nombre for nombre in indices if nombre not in indices_usados
+                                  and not nombre.endswith('_pkey')),
+        'sin_catalogar': sentencias_sin_catalogar(),
+    }
+
+def imprimir_reporte(reporte):
+    print(f"{'Consulta':<55} {'Costo':>12} {'Filas':>10}  Seq scans")
+    for consulta in reporte['consultas']:
+        seq = ", ".join(consulta['seq_scans']) or "-"
+        print(f"{consulta['consulta']:<55} {consulta['costo_total']:>12.1f} {consulta['filas_estimadas']:>10}  {seq}")
+    print()
+    print("Índices que ninguna consulta del catálogo utiliza:")
+    for nombre in reporte['indices_sin_uso'] or ["(ninguno)"]:
+        print(f"  - {nombre}")
+    if reporte['sin_catalogar']:
+        print()
+        print("Sentencias de database_operations sin entrada en el catálogo:")
+        for nombre in reporte['sin_catalogar']:
+            print(f"  - {nombre}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analiza con EXPLAIN el catálogo de consultas sobre datos sintéticos.")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN"), help="Base PostgreSQL local de pruebas (o BENCH_DSN).")
+    parser.add_argument("--filas", type=int, default=None, help="Regenera esta cantidad de facturas sintéticas antes de analizar.")
+    parser.add_argument("--semilla", type=int, default=2025)
+    parser.add_argument("--umbral-filas", type=int, default=UMBRAL_FILAS_SEQ_SCAN,
+                        help="Tamaño mínimo de tabla a partir del cual un Seq Scan se reporta.")
+    parser.add_argument("--json", dest="salida_json", default=None, help="Guarda el reporte en este archivo JSON.")
+    args = parser.parse_args(argv)
+
+    if not args.dsn:
+        parser.error("Indique --dsn o la variable BENCH_DSN; nunca use la base de producción.")
+
+    if not migraciones.aplicar_migraciones(dsn=args.dsn):
+        return 1
+    conn = db_ops.abrir_conexion_dedicada(args.dsn)
+    if conn is None:
+        return 1
+    try:
+        if args.filas:
+            cargar_facturas_sinteticas(conn, args.filas, args.semilla)
+        reporte = analizar_catalogo(conn, args.umbral_filas)
+    finally:
+        conn.close()
+
+    imprimir_reporte(reporte)
+    if args.salida_json:
+        with open(args.salida_json, 'w', encoding='utf-8') as archivo:
+            json.dump(reporte, archivo, indent=2, ensure_ascii=False, default=str)
+        logging.info(f"Reporte guardado en {args.salida_json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+Prueba de carga con sesiones concurrentes de la app de Streamlit.
+
+Cada sesión es un AppTest independiente que ejecuta un guion realista (inicio de
+sesión, búsqueda, paginación, edición, carga masiva y auditoría por lotes) contra
+una base PostgreSQL local. Para cada nivel de concurrencia reporta la latencia
+p50/p95/p99 por acción, los viajes a la base por acción y la memoria del proceso.
+
+    python -m benchmarks.carga_concurrente --dsn postgresql://localhost/trazabilidad_bench \\
+        --filas 100000 --concurrencias 1 5 10 20
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from config.constants import FACTURADORES, EPS_OPCIONES
+from benchmarks.datos_sinteticos import cargar_facturas_sinteticas
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_streamlit.py')
+TIEMPO_LIMITE_RERUN_S = 120
+TAMANO_CARGA_MASIVA = 100
+CREDENCIALES = {
+    'legalizador': ('legalizador', 'legalizador123'),
+    'auditor': ('auditor', 'auditor123'),
+}
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))
+    return round(ordenados[indice], 2)
+
+def memoria_proceso_mb():
+    """RSS actual del proceso (Linux); en otros sistemas, el pico que reporta getrusage."""
+    try:
+        with open('/proc/self/status') as estado:
+            for linea in estado:
+                if linea.startswith('VmRSS:'):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _boton(at, etiqueta):
+    for boton in at.button:
+        if boton.label == etiqueta:
+            return boton
+    return None
+
+def _por_etiqueta(elementos, etiqueta):
+    for elemento in elementos:
+        if elemento.label == etiqueta:
+            return elemento
+    return None
+
+# Acciones del guion. Cada una recibe la sesión y devuelve False si no pudo ejecutarse.
+
+def accion_login(sesion):
+    usuario, contrasena = CREDENCIALES[sesion.rol]
+    at = sesion.at
+    at.text_input[0].input(usuario)
+    at.text_input[1].input(contrasena)
+    return sesion.ejecutar(_boton(at, "Entrar").click())
+
+def accion_buscar(sesion):
+    campo = sesion.at.text_input(key="search_input_widget_0")
+    return sesion.ejecutar(campo.input(str(sesion.rng.randint(1000, 1999))))
+
+def accion_limpiar_busqueda(sesion):
+    return sesion.ejecutar(sesion.at.text_input(key="search_input_widget_0").input(""))
+
+def accion_paginar(sesion):
+    boton = _boton(sesion.at, "Siguiente ⏩")
+    if boton is None or boton.disabled:
+        return False
+    return sesion.ejecutar(boton.click())
+
+def accion_editar(sesion):
+    at = sesion.at
+    if not sesion.ejecutar(at.number_input(key="selected_invoice_id_input_0").set_value(sesion.factura_id())):
+        return False
+    boton = _boton(at, "Cargar para Edición")
+    if boton is None or not sesion.ejecutar(boton.click()):
+        return False
+    guardar = _boton(at, "Actualizar Factura")
+    return guardar is not None and sesion.ejecutar(guardar.click())
+
+def accion_carga_masiva(sesion):
+    # AppTest no admite st.file_uploader: se ejecuta la misma ruta del backend que usa
+    # el formulario de carga y luego el rerun que lo sigue.
+    from backend import database_operations as db_ops
+    from backend import instrumentacion
+
+    lote = f"CC{sesion.numero:03d}{sesion.rng.randint(0, 99999):05d}"
+    hoy = datetime.now()
+    facturas = [(f"{8_000_000 + sesion.rng.randint(0, 9_999_999)}", hoy.date()) for _ in range(TAMANO_CARGA_MASIVA)]
+    with instrumentacion.ambito_peticion() as peticion:
+        existentes = db_ops.obtener_numeros_factura_existentes([numero for numero, _ in facturas])
+        db_ops.guardar_facturas_masivo([f for f in facturas if f[0] not in existentes], "SOAT",
+                                       sesion.rng.choice(FACTURADORES), sesion.rng.choice(EPS_OPCIONES),
+                                       "Pendiente", lote, hoy)
+    sesion.viajes_externos += peticion.total
+    return sesion.ejecutar(sesion.at)
+
+def accion_auditar_lote(sesion):
+    at = sesion.at
+    selector = _por_etiqueta(at.selectbox, "Seleccione el Número de Lote a Auditar:")
+    if selector is None or len(selector.options) < 2:
+        return False
+    if not sesion.ejecutar(selector.select(sesion.rng.choice(selector.options[1:]))):
+        return False
+    aprobar = at.multiselect(key="ms_aprobar")
+    if not aprobar.options:
+        return False
+    if not sesion.ejecutar(aprobar.set_value(aprobar.options[:5])):
+        return False
+    boton = _boton(at, "🔥 Aplicar Auditoría Masiva")
+    return boton is not None and sesion.ejecutar(boton.click())
+
+GUIONES = {
+    'legalizador': [
+        ('login', accion_login), ('buscar', accion_buscar), ('limpiar_busqueda', accion_limpiar_busqueda),
+        ('paginar', accion_paginar), ('paginar', accion_paginar), ('editar', accion_editar),
+        ('carga_masiva', accion_carga_masiva),
+    ],
+    'auditor': [
+        ('login', accion_login), ('buscar', accion_buscar), ('limpiar_busqueda', accion_limpiar_busqueda),
+        ('paginar', accion_paginar), ('auditar_lote', accion_auditar_lote),
+    ],
+}
+
+class SesionSimulada:
+    def __init__(self, numero, rol, semilla, max_id):
+        from streamlit.testing.v1 import AppTest
+
+        self.numero = numero
+        self.rol = rol
+        self.rng = random.Random(semilla + numero)
+        self.max_id = max_id
+        self.at = AppTest.from_file(RUTA_APP, default_timeout=TIEMPO_LIMITE_RERUN_S)
+        self.viajes_externos = 0
+        self.muestras = []
+        self.errores = []
+
+    def factura_id(self):
+        return self.rng.randint(1, self.max_id)
+
+    def _viajes(self):
+        try:
+            return self.at.session_state['_viajes_bd_acumulados']
+        except KeyError:
+            return 0
+
+    def ejecutar(self, elemento):
+        elemento.run()
+        if self.at.exception:
+            self.errores.append(self.at.exception[0].message)
+            return False
+        return True
+
+    def correr_guion(self, iteraciones):
+        self.ejecutar(self.at)
+        for _ in range(iteraciones):
+            for nombre, accion in GUIONES[self.rol]:
+                if nombre == 'login' and self.muestras:
+                    continue
+                viajes_previos = self._viajes() + self.viajes_externos
+                inicio = time.perf_counter()
+                try:
+                    completada = accion(self)
+                except Exception as e:
+                    self.errores.append(f"{nombre}: {e}")
+                    completada = False
+                duracion_ms = (time.perf_counter() - inicio) * 1000
+                self.muestras.append({
+                    'accion': nombre,
+                    'ms': duracion_ms,
+                    'viajes_bd': self._viajes() + self.viajes_externos - viajes_previos,
+                    'completada': completada,
+                })
+
+class MuestreadorMemoria(threading.Thread):
+    def __init__(self, intervalo_s=0.5):
+        super().__init__(daemon=True)
+        self.intervalo_s = intervalo_s
+        self.pico_mb = memoria_proceso_mb()
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.wait(self.intervalo_s):
+            self.pico_mb = max(self.pico_mb, memoria_proceso_mb())
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+def ejecutar_nivel(concurrencia, iteraciones, proporcion_auditores, semilla, max_id):
+    roles = ['auditor' if i < round(concurrencia * proporcion_auditores) else 'legalizador' for i in range(concurrencia)]
+    sesiones = [SesionSimulada(i, rol, semilla, max_id) for i, rol in enumerate(roles)]
+    memoria_inicial = memoria_proceso_mb()
+    muestreador = MuestreadorMemoria()
+    muestreador.start()
+
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=sesion.correr_guion, args=(iteraciones,)) for sesion in sesiones]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion_s = time.perf_counter() - inicio
+    muestreador.detener()
+
+    muestras = [muestra for sesion in sesiones for muestra in sesion.muestras]
+    por_accion = defaultdict(list)
+    for muestra in muestras:
+        if muestra['completada']:
+            por_accion[muestra['accion']].append(muestra)
+
+    def resumir(grupo):
+        tiempos = [m['ms'] for m in grupo]
+        viajes = [m['viajes_bd'] for m in grupo]
+        return {
+            'muestras': len(grupo),
+            'p50_ms': percentil(tiempos, 50),
+            'p95_ms': percentil(tiempos, 95),
+            'p99_ms': percentil(tiempos, 99),
+            'viajes_bd_promedio': round(sum(viajes) / len(viajes), 1) if viajes else None,
+        }
+
+    completadas = [m for m in muestras if m['completada']]
+    return {
+        'concurrencia': concurrencia,
+        'duracion_s': round(duracion_s, 2),
+        'acciones_por_s': round(len(completadas) / duracion_s, 2) if duracion_s else None,
+        'global': resumir(completadas),
+        'por_accion': {accion: resumir(grupo) for accion, grupo in sorted(por_accion.items())},
+        'acciones_fallidas': len(muestras) - len(completadas),
+        'errores': sorted({error for sesion in sesiones for error in sesion.errores})[:20],
+        'memoria_inicial_mb': round(memoria_inicial, 1),
+        'memoria_pico_mb': round(muestreador.pico_mb, 1),
+    }
+
+def imprimir_nivel(nivel):
+    print(f"\n== {nivel['concurrencia']} sesiones · {nivel['duracion_s']} s · {nivel['acciones_por_s']} acciones/s · "
+          f"memoria {nivel['memoria_inicial_mb']} -> {nivel['memoria_pico_mb']} MB ==")
+    print(f"{'Acción':<20} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'viajes BD':>10}")
+    for accion, datos in [('(todas)', nivel['global'])] + list(nivel['por_accion'].items()):
+        print(f"{accion:<20} {datos['muestras']:>5} {datos['p50_ms'] or 0:>10.1f} {datos['p95_ms'] or 0:>10.1f} "
+              f"{datos['p99_ms'] or 0:>10.1f} {datos['viajes_bd_promedio'] or 0:>10.1f}")
+    if nivel['acciones_fallidas']:
+        print(f"Acciones fallidas: {nivel['acciones_fallidas']}")
+        for error in nivel['errores']:
+            print(f"  - {error[:160]}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones concurrentes de la app.")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN"), help="Base PostgreSQL local de pruebas (o BENCH_DSN).")
+    parser.add_argument("--filas", type=int, default=None, help="Regenera esta cantidad de facturas sintéticas antes de empezar.")
+    parser.add_argument("--concurrencias", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--iteraciones", type=int, default=3, help="Veces que cada sesión repite su guion.")
+    parser.add_argument("--proporcion-auditores", type=float, default=0.25)
+    parser.add_argument("--semilla", type=int, default=2025)
+    parser.add_argument("--json", dest="salida_json", default=None, help="Guarda los resultados en este archivo JSON.")
+    args = parser.parse_args(argv)
+
+    if not args.dsn:
+        parser.error("Indique --dsn o la variable BENCH_DSN; nunca use la base de producción.")
+
+    os.environ["DB_DSN"] = args.dsn
+    from backend import database_operations as db_ops
+    from backend import migraciones
+
+    if not migraciones.aplicar_migraciones(dsn=args.dsn):
+        return 1
+    if args.filas:
+        conn = db_ops.abrir_conexion_dedicada(args.dsn)
+        if conn is None:
+            return 1
+        try:
+            cargar_facturas_sinteticas(conn, args.filas, args.semilla)
+        finally:
+            conn.close()
+    max_id = db_ops.obtener_conteo_total_facturas() or 1
+
+    resultados = {'fecha_hora': datetime.now().isoformat(timespec='seconds'), 'facturas': max_id, 'niveles': []}
+    for concurrencia in args.concurrencias:
+        logging.info(f"Ejecutando {concurrencia} sesiones concurrentes...")
+        nivel = ejecutar_nivel(concurrencia, args.iteraciones, args.proporcion_auditores, args.semilla, max_id)
+        imprimir_nivel(nivel)
+        resultados['niveles'].append(nivel)
+
+    if args.salida_json:
+        with open(args.salida_json, 'w', encoding='utf-8') as archivo:
+            json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+        logging.info(f"Resultados guardados en {args.salida_json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Catálogo de las sentencias SQL de backend/database_operations.py con parámetros
+de ejemplo, para analizarlas con EXPLAIN sobre datos sintéticos.
+"""
+from datetime import timedelta
+
+from backend import database_operations as db_ops
+
+def _una_fila(sql, plantilla):
+    """Las sentencias de execute_values llevan `VALUES %s`; para EXPLAIN basta una fila."""
+    return sql.replace("VALUES %s", f"VALUES {plantilla}")
+
+# Cada entrada recibe las muestras tomadas de la base y devuelve (sql, parámetros).
+CATALOGO = {
+    'SQL_OBTENER_CREDENCIALES_USUARIO': lambda m: (db_ops.SQL_OBTENER_CREDENCIALES_USUARIO, (m['username'],)),
+    'SQL_CREAR_FACTURA': lambda m: (db_ops.SQL_CREAR_FACTURA, {
+        'numero_factura': '99999999', 'area_servicio': 'SOAT', 'facturador': m['facturador'],
+        'fecha_generacion': m['fecha'], 'eps': m['eps'], 'fecha_hora_entrega': m['fecha'],
+        'estado_auditoria': 'Pendiente'}),
+    'SQL_OBTENER_FACTURA_POR_ID': lambda m: (db_ops.SQL_OBTENER_FACTURA_POR_ID, (m['id'],)),
+    'SQL_OBTENER_FACTURA_POR_NUMERO': lambda m: (db_ops.SQL_OBTENER_FACTURA_POR_NUMERO, (m['numero_factura'],)),
+    'SQL_OBTENER_DETALLES_SOAT_POR_FACTURA_ID': lambda m: (db_ops.SQL_OBTENER_DETALLES_SOAT_POR_FACTURA_ID, (m['id'],)),
+    'SQL_ACTUALIZAR_FACTURA_PARCIAL': lambda m: (
+        db_ops.SQL_ACTUALIZAR_FACTURA_PARCIAL.format(asignaciones="eps = %s, fecha_reemplazo = %s"),
+        (m['eps'], m['fecha'], m['id'], 1)),
+    'SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURA': lambda m: (db_ops.SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURA, (
+        'Lista para Radicar', None, None, m['id'])),
+    'SQL_ACTUALIZAR_FECHA_ENTREGA_RADICADOR': lambda m: (db_ops.SQL_ACTUALIZAR_FECHA_ENTREGA_RADICADOR, (
+        m['fecha'], 'En Radicador', m['id'])),
+    'SQL_ENTREGAR_FACTURAS_RADICADOR': lambda m: (db_ops.SQL_ENTREGAR_FACTURAS_RADICADOR, (
+        m['fecha'], m['fecha'], m['fecha'], m['ids'])),
+    'SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURAS': lambda m: (db_ops.SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURAS, (
+        'Lista para Radicar', None, None, m['ids'])),
+    'SQL_DEVOLVER_FACTURAS': lambda m: (_una_fila(db_ops.SQL_DEVOLVER_FACTURAS, "(%s::INTEGER, %s, %s)"), (
+        m['id'], 'TARIFA', 'Revisión')),
+    'SQL_GUARDAR_FACTURAS_MASIVO': lambda m: (_una_fila(db_ops.SQL_GUARDAR_FACTURAS_MASIVO, "(%s, %s, %s, %s, %s, %s, %s, %s)"), (
+        '99999999', 'SOAT', m['facturador'], m['fecha'], m['eps'], m['fecha'], 'Pendiente', m['lote'])),
+    'SQL_GUARDAR_DETALLES_SOAT_MASIVO': lambda m: (_una_fila(db_ops.SQL_GUARDAR_DETALLES_SOAT_MASIVO, "(%s, %s)"), (
+        m['id'], m['fecha'])),
+    'SQL_OBTENER_NUMEROS_FACTURA_EXISTENTES': lambda m: (db_ops.SQL_OBTENER_NUMEROS_FACTURA_EXISTENTES, {
+        'numeros': [m['numero_factura'], '99999999']}),
+    'SQL_OBTENER_ESTADOS_AUDITORIA_POR_IDS': lambda m: (db_ops.SQL_OBTENER_ESTADOS_AUDITORIA_POR_IDS, (m['ids'],)),
+    'SQL_ELIMINAR_FACTURA': lambda m: (db_ops.SQL_ELIMINAR_FACTURA, (m['id'],)),
+    'SQL_GUARDAR_FACTURA_REEMPLAZO': lambda m: (db_ops.SQL_GUARDAR_FACTURA_REEMPLAZO, ('99999999', m['fecha'], m['id'])),
+    'SQL_CARGAR_FACTURAS': lambda m: (db_ops.SQL_CARGAR_FACTURAS + " ORDER BY f.id DESC;", None),
+    'SQL_CARGAR_FACTURAS (búsqueda)': lambda m: (
+        db_ops.SQL_CARGAR_FACTURAS + " WHERE f.numero_factura ILIKE %s ORDER BY f.id DESC;", (f"%{m['numero_factura'][-4:]}%",)),
+    'SQL_CARGAR_PAGINA_FACTURAS_POR_URGENCIA': lambda m: (
+        db_ops.SQL_CARGAR_PAGINA_FACTURAS_POR_URGENCIA.format(filtro=""), (15, 600)),
+    # Con DB_MESES_PERIODO_ACTIVO configurado (12 meses de ejemplo).
+    'SQL_CARGAR_PAGINA_FACTURAS_POR_URGENCIA (período activo)': lambda m: (
+        db_ops.SQL_CARGAR_PAGINA_FACTURAS_POR_URGENCIA.format(filtro=f"WHERE {db_ops.FILTRO_PERIODO_ACTIVO}"),
+        (m['fecha'] - timedelta(days=365), 15, 600)),
+    'SQL_BANDEJA_LEGALIZADOR': lambda m: (
+        db_ops.SQL_BANDEJA_LEGALIZADOR.format(filtro_facturador="AND f.facturador = %s"),
+        (m['facturador'], db_ops.DIAS_HABILES_ALERTA_VENCIMIENTO, m['facturador'], db_ops.LIMITE_BANDEJA)),
+    'SQL_BANDEJA_AUDITOR': lambda m: (db_ops.SQL_BANDEJA_AUDITOR, (db_ops.LIMITE_BANDEJA,)),
+    'SQL_MARCA_TIEMPO_SERVIDOR': lambda m: (db_ops.SQL_MARCA_TIEMPO_SERVIDOR, None),
+    'SQL_CARGAR_FACTURAS_CAMBIADAS': lambda m: (db_ops.SQL_CARGAR_FACTURAS_CAMBIADAS, {'desde': m['ultima_actualizacion']}),
+    'SQL_OBTENER_FACTURAS_ELIMINADAS': lambda m: (db_ops.SQL_OBTENER_FACTURAS_ELIMINADAS, (m['ultima_actualizacion'],)),
+    'SQL_ARCHIVAR_FACTURAS': lambda m: (db_ops.SQL_ARCHIVAR_FACTURAS, {
+        'limite': m['fecha'], 'tamano_lote': db_ops.TAMANO_LOTE_ARCHIVO}),
+    'SQL_CARGAR_FACTURAS_HISTORICO': lambda m: (
+        db_ops.SQL_CARGAR_FACTURAS_HISTORICO + " WHERE f.numero_factura ILIKE %s ORDER BY f.id DESC;",
+        (f"%{m['numero_factura'][-4:]}%",)),
+    'SQL_CONTAR_FACTURAS': lambda m: (db_ops.SQL_CONTAR_FACTURAS.format(filtro=""), None),
+    'SQL_CARGAR_RESUMEN_DIARIO': lambda m: (db_ops.SQL_CARGAR_RESUMEN_DIARIO.format(dimension='eps'), {
+        'periodo': 'month', 'desde': m['fecha'] - timedelta(days=730), 'hasta': m['fecha']}),
+    'SQL_SLA_AUDITORIA': lambda m: (db_ops.SQL_SLA_AUDITORIA, {
+        'desde': m['fecha'] - timedelta(days=90), 'hasta': m['fecha']}),
+    'SQL_OBTENER_EVENTOS_FACTURA': lambda m: (db_ops.SQL_OBTENER_EVENTOS_FACTURA, (m['id'],)),
+    'SQL_VERSION_DATOS_FACTURAS': lambda m: (db_ops.SQL_VERSION_DATOS_FACTURAS, None),
+    'SQL_PARETO_TIPO_ERROR': lambda m: (db_ops.SQL_PARETO_TIPO_ERROR, {
+        'desde': m['fecha'] - timedelta(days=365), 'hasta': m['fecha']}),
+    'SQL_OBTENER_CONTEO_FACTURAS_POR_LEGALIZADOR_Y_EPS': lambda m: (db_ops.SQL_OBTENER_CONTEO_FACTURAS_POR_LEGALIZADOR_Y_EPS, None),
+    'SQL_OBTENER_CONTEO_FACTURAS_LISTA_PARA_RADICAR': lambda m: (db_ops.SQL_OBTENER_CONTEO_FACTURAS_LISTA_PARA_RADICAR, None),
+    'SQL_OBTENER_CONTEO_FACTURAS_EN_RADICADOR': lambda m: (db_ops.SQL_OBTENER_CONTEO_FACTURAS_EN_RADICADOR, None),
+    'SQL_OBTENER_CONTEO_FACTURAS_CON_ERRORES': lambda m: (db_ops.SQL_OBTENER_CONTEO_FACTURAS_CON_ERRORES, None),
+    'SQL_OBTENER_CONTEO_FACTURAS_PENDIENTES_GLOBAL': lambda m: (db_ops.SQL_OBTENER_CONTEO_FACTURAS_PENDIENTES_GLOBAL, None),
+    'SQL_OBTENER_CONTEO_FACTURAS_VENCIDAS': lambda m: (db_ops.SQL_OBTENER_CONTEO_FACTURAS_VENCIDAS, (m['fecha'],)),
+    'SQL_OBTENER_IDS_PENDIENTES_RADICADOR': lambda m: (db_ops.SQL_OBTENER_IDS_PENDIENTES_RADICADOR.format(filtro=""), None),
+    'SQL_OBTENER_CONTEO_TOTAL_FACTURAS': lambda m: (db_ops.SQL_OBTENER_CONTEO_TOTAL_FACTURAS, None),
+    'SQL_OBTENER_FACTURADORES_UNICOS': lambda m: (db_ops.SQL_OBTENER_FACTURADORES_UNICOS, None),
+    'SQL_OBTENER_EPS_UNICAS': lambda m: (db_ops.SQL_OBTENER_EPS_UNICAS, None),
+    'SQL_OBTENER_LOTES_UNICOS': lambda m: (db_ops.SQL_OBTENER_LOTES_UNICOS, None),
+    'SQL_CARGAR_FACTURAS_POR_LOTE': lambda m: (db_ops.SQL_CARGAR_FACTURAS_POR_LOTE, (m['lote'],)),
+    'SQL_OBTENER_ULTIMO_NUMERO_LOTE': lambda m: (db_ops.SQL_OBTENER_ULTIMO_NUMERO_LOTE, None),
+    'SQL_REPARAR_SECUENCIA_IDS': lambda m: (db_ops.SQL_REPARAR_SECUENCIA_IDS, None),
+    'SQL_OBTENER_DATOS_CARGA_POR_LOTE': lambda m: (db_ops.SQL_OBTENER_DATOS_CARGA_POR_LOTE, (m['lote'],)),
+}
+
+def obtener_muestras(cursor):
+    """Valores reales de la base para parametrizar el catálogo."""
+    cursor.execute("""
+        SELECT id, numero_factura, facturador, eps, fecha_generacion
+        FROM facturas ORDER BY id OFFSET (SELECT COUNT(*) / 2 FROM facturas) LIMIT 1;
+    """)
+    fila = cursor.fetchone()
+    if fila is None:
+        raise ValueError("La tabla facturas está vacía; cargue datos sintéticos primero.")
+    factura_id, numero_factura, facturador, eps, fecha = fila
+    cursor.execute("""
+        SELECT lote_carga_masiva FROM facturas WHERE lote_carga_masiva IS NOT NULL
+        GROUP BY lote_carga_masiva ORDER BY COUNT(*) DESC LIMIT 1;
+    """)
+    lote = cursor.fetchone()
+    # Un refresco incremental típico pide los cambios de los últimos segundos.
+    cursor.execute("SELECT MAX(updated_at) FROM facturas;")
+    ultima_actualizacion = cursor.fetchone()[0]
+    return {
+        'id': factura_id,
+        'ids': list(range(factura_id, factura_id + 50)),
+        'numero_factura': numero_factura,
+        'facturador': facturador,
+        'eps': eps,
+        'fecha': fecha,
+        'lote': lote[0] if lote else '001',
+        'username': 'auditor',
+        'ultima_actualizacion': ultima_actualizacion,
+    }
+
+def sentencias_sin_catalogar():
+    """Constantes SQL_* de database_operations que aún no tienen entrada en el catálogo."""
+    catalogadas = {nombre.split(' ')[0] for nombre in CATALOGO}
+    return sorted(nombre for nombre in dir(db_ops)
+                  if nombre.startswith('SQL_') and nombre not in catalogadas)
+
+def sentencias_catalogadas(muestras):
+    for nombre, construir in CATALOGO.items():
+        sql, parametros = construir(muestras)
+        yield nombre, sql, parametros
@@ -0,0 +1,148 @@
+"""
+Generador determinista de facturas sintéticas.
+
+Produce datos con la forma de producción (legalizadores y EPS de config/constants,
+lotes de carga masiva, cadenas de reemplazo y la mezcla habitual de estados de
+auditoría) y los carga con COPY en una base PostgreSQL local de pruebas.
+"""
+import csv
+import io
+import logging
+import random
+from datetime import date, datetime, timedelta
+
+from config.constants import FACTURADORES, EPS_OPCIONES, AREA_SERVICIO_OPCIONES, TIPO_ERROR_OPCIONES
+
+COLUMNAS_FACTURAS = [
+    'id', 'numero_factura', 'area_servicio', 'facturador', 'fecha_generacion', 'eps',
+    'fecha_hora_entrega', 'factura_original_id', 'estado', 'reemplazada_por_numero_factura',
+    'estado_auditoria', 'observacion_auditor', 'tipo_error', 'fecha_reemplazo',
+    'fecha_entrega_radicador', 'lote_carga_masiva'
+]
+
+# Mezcla aproximada del histórico: la mayoría ya fue entregada al radicador.
+PESOS_ESTADO_AUDITORIA = {
+    "En Radicador": 0.55,
+    "Pendiente": 0.18,
+    "Lista para Radicar": 0.12,
+    "Devuelta por Auditor": 0.08,
+    "Corregida por Legalizador": 0.07,
+}
+
+PROBABILIDAD_INICIO_LOTE = 0.02
+TAMANO_LOTE = (20, 200)
+PROBABILIDAD_REEMPLAZO = 0.03
+DIAS_HISTORICO = 730
+TAMANOS_ESTANDAR = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000}
+
+def generar_facturas(total, semilla=2025, hoy=None):
+    """Genera `total` filas (tuplas en el orden de COLUMNAS_FACTURAS) de forma reproducible."""
+    rng = random.Random(semilla)
+    hoy = hoy or date.today()
+    estados = list(PESOS_ESTADO_AUDITORIA)
+    pesos = list(PESOS_ESTADO_AUDITORIA.values())
+    tipos_error = TIPO_ERROR_OPCIONES[1:]
+
+    numero_lote = 0
+    restantes_lote = 0
+    contexto_lote = None
+
+    for factura_id in range(1, total + 1):
+        if restantes_lote == 0 and rng.random() < PROBABILIDAD_INICIO_LOTE:
+            numero_lote += 1
+            restantes_lote = rng.randint(*TAMANO_LOTE)
+            contexto_lote = {
+                'lote': f"{numero_lote:03d}",
+                'facturador': rng.choice(FACTURADORES),
+                'eps': rng.choice(EPS_OPCIONES),
+                'area_servicio': rng.choice(AREA_SERVICIO_OPCIONES),
+                'entrega': datetime.combine(hoy - timedelta(days=rng.randint(0, DIAS_HISTORICO)), datetime.min.time())
+                           + timedelta(hours=rng.randint(7, 17)),
+            }
+
+        if restantes_lote > 0:
+            restantes_lote -= 1
+            lote = contexto_lote['lote']
+            facturador = contexto_lote['facturador']
+            eps = contexto_lote['eps']
+            area_servicio = contexto_lote['area_servicio']
+            fecha_hora_entrega = contexto_lote['entrega']
+            fecha_generacion = fecha_hora_entrega.date() - timedelta(days=rng.randint(0, 20))
+        else:
+            lote = None
+            facturador = rng.choice(FACTURADORES)
+            eps = rng.choice(EPS_OPCIONES)
+            area_servicio = rng.choice(AREA_SERVICIO_OPCIONES)
+            fecha_generacion = hoy - timedelta(days=rng.randint(0, DIAS_HISTORICO))
+            fecha_hora_entrega = datetime.combine(fecha_generacion, datetime.min.time()) + timedelta(
+                days=rng.randint(0, 5), hours=rng.randint(7, 17), minutes=rng.randint(0, 59))
+
+        estado_auditoria = rng.choices(estados, pesos)[0]
+        tipo_error = None
+        observacion = None
+        if estado_auditoria in ("Devuelta por Auditor", "Corregida por Legalizador"):
+            tipo_error = rng.choice(tipos_error)
+            observacion = f"Revisión {tipo_error.lower()}"
+
+        fecha_entrega_radicador = None
+        if estado_auditoria == "En Radicador":
+            fecha_entrega_radicador = fecha_hora_entrega + timedelta(days=rng.randint(1, 30))
+
+        estado = 'Activa'
+        reemplazada_por = None
+        fecha_reemplazo = None
+        factura_original_id = None
+        if factura_id > 1 and rng.random() < PROBABILIDAD_REEMPLAZO:
+            if rng.random() < 0.5:
+                estado = 'Reemplazada'
+                reemplazada_por = str(9_000_000 + factura_id)
+                fecha_reemplazo = min(hoy, fecha_generacion + timedelta(days=rng.randint(15, 40)))
+            else:
+                factura_original_id = rng.randint(max(1, factura_id - 5000), factura_id - 1)
+
+        yield (
+            factura_id, str(1_000_000 + factura_id), area_servicio, facturador, fecha_generacion, eps,
+            fecha_hora_entrega, factura_original_id, estado, reemplazada_por,
+            estado_auditoria, observacion, tipo_error, fecha_reemplazo,
+            fecha_entrega_radicador, lote
+        )
+
+def cargar_facturas_sinteticas(conn, total, semilla=2025, tamano_bloque=50_000):
+    """Vacía facturas/detalles_soat y carga `total` facturas sintéticas con COPY."""
+    columnas = ", ".join(COLUMNAS_FACTURAS)
+    with conn.cursor() as cursor:
+        cursor.execute("TRUNCATE detalles_soat, facturas RESTART IDENTITY CASCADE;")
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        pendientes = 0
+        for fila in generar_facturas(total, semilla):
+            escritor.writerow(fila)
+            pendientes += 1
+            if pendientes == tamano_bloque:
+                _copiar_bloque(cursor, buffer, columnas)
+                buffer = io.StringIO()
+                escritor = csv.writer(buffer)
+                pendientes = 0
+        if pendientes:
+            _copiar_bloque(cursor, buffer, columnas)
+
+        cursor.execute("""
+            INSERT INTO detalles_soat (factura_id, fecha_generacion_soat)
+            SELECT id, fecha_generacion FROM facturas WHERE area_servicio = 'SOAT';
+        """)
+        cursor.execute("""
+            SELECT setval(pg_get_serial_sequence('facturas', 'id'),
+            COALESCE(MAX(id), 0) + 1, false) FROM facturas;
+        """)
+    conn.commit()
+    autocommit_previo = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("VACUUM ANALYZE facturas;")
+        cursor.execute("VACUUM ANALYZE detalles_soat;")
+    conn.autocommit = autocommit_previo
+    logging.info(f"Cargadas {total} facturas sintéticas (semilla {semilla}).")
+
+def _copiar_bloque(cursor, buffer, columnas):
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY facturas ({columnas}) FROM STDIN WITH (FORMAT csv)", buffer)
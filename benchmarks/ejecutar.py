@@ -0,0 +1,270 @@
+"""
+Suite de benchmarks de las rutas críticas sobre datos sintéticos.
+
+Para cada tamaño carga las facturas sintéticas en una base PostgreSQL local y mide
+cargar_facturas, la transformación para visualización, el cálculo de días hábiles,
+la carga masiva, el reporte de carga masiva y las funciones de estadísticas. Los
+resultados se guardan en JSON y se pueden comparar con una corrida anterior:
+
+    python -m benchmarks.ejecutar --dsn postgresql://localhost/trazabilidad_bench --tamanos 10k 100k
+    python -m benchmarks.ejecutar --dsn ... --comparar-con benchmarks/resultados/base.json
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.datos_sinteticos import TAMANOS_ESTANDAR, cargar_facturas_sinteticas
+
+DIRECTORIO_RESULTADOS = os.path.join('benchmarks', 'resultados')
+TAMANO_LOTE_CARGA_MASIVA = 500
+MUESTRA_DIAS_HABILES = 5_000
+MUESTRA_BUSQUEDAS_PUNTUALES = 200
+TOLERANCIA_REGRESION = 0.20
+
+def medir(funcion, repeticiones=5, calentamiento=1):
+    """Ejecuta `funcion` varias veces y resume los tiempos en milisegundos."""
+    for _ in range(calentamiento):
+        funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        'repeticiones': repeticiones,
+        'min_ms': round(tiempos[0], 2),
+        'mediana_ms': round(statistics.median(tiempos), 2),
+        'p95_ms': round(tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))], 2),
+        'max_ms': round(tiempos[-1], 2),
+    }
+
+@contextlib.contextmanager
+def _sin_salida_estandar():
+    # La transformación imprime trazas de depuración por fila; no deben inundar la consola.
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        yield
+
+def _medir_carga_masiva(db_ops, repeticiones):
+    """Inserta y luego elimina un lote de prueba en cada repetición."""
+    from config.constants import FACTURADORES, EPS_OPCIONES
+    from utils.io_utils import generar_reporte_carga_masiva
+
+    tiempos_carga, tiempos_reporte = [], []
+    for repeticion in range(repeticiones):
+        lote = f"BENCH{repeticion:03d}"
+        fecha_hora = datetime.now()
+        facturas = [(f"B{repeticion:02d}{i:06d}", fecha_hora.date()) for i in range(TAMANO_LOTE_CARGA_MASIVA)]
+
+        inicio = time.perf_counter()
+        existentes = db_ops.obtener_numeros_factura_existentes([numero for numero, _ in facturas])
+        nuevas = [f for f in facturas if f[0] not in existentes]
+        ids_por_numero = db_ops.guardar_facturas_masivo(
+            nuevas, "SOAT", FACTURADORES[0], EPS_OPCIONES[0], "Pendiente", lote, fecha_hora)
+        tiempos_carga.append((time.perf_counter() - inicio) * 1000)
+
+        df_lote = pd.DataFrame(nuevas, columns=['numero_factura', 'fecha_generacion'])
+        ids = [ids_por_numero[numero] for numero in df_lote['numero_factura']]
+        inicio = time.perf_counter()
+        generar_reporte_carga_masiva(lote, FACTURADORES[0], EPS_OPCIONES[0], "SOAT", df_lote, fecha_hora, ids)
+        tiempos_reporte.append((time.perf_counter() - inicio) * 1000)
+
+        for factura_id in ids:
+            db_ops.eliminar_factura(factura_id)
+
+    def resumir(tiempos):
+        tiempos.sort()
+        return {
+            'repeticiones': len(tiempos),
+            'filas': TAMANO_LOTE_CARGA_MASIVA,
+            'min_ms': round(tiempos[0], 2),
+            'mediana_ms': round(statistics.median(tiempos), 2),
+            'max_ms': round(tiempos[-1], 2),
+        }
+    return resumir(tiempos_carga), resumir(tiempos_reporte)
+
+def ejecutar_tamano(dsn, total, semilla=2025, repeticiones=5):
+    # Los imports que tocan la conexión cacheada se hacen después de fijar DB_DSN.
+    from backend import database_operations as db_ops
+    from backend import sentencias_preparadas
+    from utils.date_utils import sumar_dias_habiles, calcular_dias_habiles_entre_fechas
+    from utils.df_utils import process_factura_for_display_df
+
+    conn = db_ops.abrir_conexion_dedicada(dsn)
+    if conn is None:
+        raise RuntimeError("No se pudo conectar a la base de benchmarks.")
+    try:
+        inicio = time.perf_counter()
+        cargar_facturas_sinteticas(conn, total, semilla)
+        carga_ms = (time.perf_counter() - inicio) * 1000
+    finally:
+        conn.close()
+
+    resultados = {'filas': total, 'carga_datos_sinteticos_ms': round(carga_ms, 2), 'operaciones': {}}
+    operaciones = resultados['operaciones']
+    # Las funciones largas se repiten menos en tamaños grandes.
+    repeticiones_pesadas = repeticiones if total <= 100_000 else max(1, repeticiones // 3)
+
+    operaciones['cargar_facturas'] = medir(db_ops.cargar_facturas, repeticiones_pesadas)
+    operaciones['cargar_facturas (búsqueda)'] = medir(
+        lambda: db_ops.cargar_facturas("1000", "numero_factura"), repeticiones)
+
+    facturas = db_ops.cargar_facturas()
+    df_raw = pd.DataFrame(facturas)
+    with _sin_salida_estandar():
+        operaciones['_process_factura_for_display_df'] = medir(
+            lambda: process_factura_for_display_df(df_raw), repeticiones_pesadas)
+
+    fechas = pd.to_datetime(df_raw['fecha_generacion']).dt.date.head(MUESTRA_DIAS_HABILES).tolist()
+    hoy = datetime.now().date()
+    operaciones['sumar_dias_habiles'] = {
+        **medir(lambda: [sumar_dias_habiles(fecha, 21) for fecha in fechas], repeticiones), 'llamadas': len(fechas)}
+    limites = [sumar_dias_habiles(fecha, 21) for fecha in fechas]
+    operaciones['calcular_dias_habiles_entre_fechas'] = {
+        **medir(lambda: [calcular_dias_habiles_entre_fechas(hoy, limite) for limite in limites], repeticiones),
+        'llamadas': len(limites)}
+
+    operaciones['carga_masiva'], operaciones['generar_reporte_carga_masiva'] = _medir_carga_masiva(db_ops, repeticiones)
+
+    muestra = df_raw.sample(n=min(MUESTRA_BUSQUEDAS_PUNTUALES, len(df_raw)), random_state=semilla)
+    pares = list(zip(muestra['id'].tolist(), muestra['numero_factura'].tolist()))
+
+    def busquedas_puntuales():
+        for factura_id, numero_factura in pares:
+            db_ops.obtener_factura_por_id(factura_id)
+            db_ops.obtener_factura_por_numero(numero_factura)
+            db_ops.obtener_detalles_soat_por_factura_id(factura_id)
+
+    registro_preparadas = sentencias_preparadas.registro
+    modo_previo = registro_preparadas.modo
+    try:
+        for modo, etiqueta in (("0", "sin preparar"), ("1", "preparadas")):
+            registro_preparadas.modo = modo
+            operaciones[f'busquedas_puntuales ({etiqueta})'] = {
+                **medir(busquedas_puntuales, repeticiones), 'llamadas': 3 * len(pares)}
+    finally:
+        registro_preparadas.modo = modo_previo
+    resultados['sentencias_preparadas'] = registro_preparadas.estadisticas()
+
+    funciones_estadisticas = [
+        db_ops.obtener_conteo_facturas_pendientes_global,
+        db_ops.obtener_conteo_facturas_lista_para_radicar,
+        db_ops.obtener_conteo_facturas_en_radicador,
+        db_ops.obtener_conteo_facturas_con_errores,
+        db_ops.obtener_conteo_total_facturas,
+        db_ops.obtener_conteo_facturas_por_legalizador_y_eps,
+        db_ops.obtener_conteo_facturas_vencidas,
+    ]
+    for funcion in funciones_estadisticas:
+        operaciones[funcion.__name__] = medir(funcion, repeticiones)
+    operaciones['estadisticas (tablero completo)'] = medir(
+        lambda: [funcion() for funcion in funciones_estadisticas], repeticiones)
+
+    return resultados
+
+def metadatos_corrida(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'fecha_hora': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'maquina': platform.node(),
+        'semilla': args.semilla,
+        'repeticiones': args.repeticiones,
+    }
+
+def comparar(actual, referencia, tolerancia=TOLERANCIA_REGRESION):
+    """Operaciones cuya mediana empeoró más que `tolerancia` respecto a la referencia."""
+    regresiones = []
+    for etiqueta, datos in actual['tamanos'].items():
+        datos_referencia = referencia.get('tamanos', {}).get(etiqueta)
+        if not datos_referencia:
+            continue
+        for operacion, medida in datos['operaciones'].items():
+            medida_referencia = datos_referencia['operaciones'].get(operacion)
+            if not medida_referencia or not medida_referencia.get('mediana_ms'):
+                continue
+            cambio = medida['mediana_ms'] / medida_referencia['mediana_ms'] - 1
+            if cambio > tolerancia:
+                regresiones.append({
+                    'tamano': etiqueta,
+                    'operacion': operacion,
+                    'referencia_ms': medida_referencia['mediana_ms'],
+                    'actual_ms': medida['mediana_ms'],
+                    'cambio': round(cambio, 3),
+                })
+    return regresiones
+
+def imprimir_resultados(resultados):
+    for etiqueta, datos in resultados['tamanos'].items():
+        print(f"\n== {etiqueta} ({datos['filas']} facturas) ==")
+        print(f"{'Operación':<50} {'Mediana ms':>12} {'Máx ms':>12}")
+        for operacion, medida in datos['operaciones'].items():
+            print(f"{operacion:<50} {medida['mediana_ms']:>12.2f} {medida['max_ms']:>12.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de las rutas críticas sobre datos sintéticos.")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN"), help="Base PostgreSQL local de pruebas (o BENCH_DSN).")
+    parser.add_argument("--tamanos", nargs="+", default=["10k"], choices=list(TAMANOS_ESTANDAR))
+    parser.add_argument("--semilla", type=int, default=2025)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--salida", default=None, help="Archivo JSON de resultados (por defecto benchmarks/resultados/<fecha>.json).")
+    parser.add_argument("--comparar-con", default=None, help="JSON de una corrida anterior para detectar regresiones.")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_REGRESION,
+                        help="Aumento relativo de la mediana que se considera regresión (0.20 = 20%%).")
+    args = parser.parse_args(argv)
+
+    if not args.dsn:
+        parser.error("Indique --dsn o la variable BENCH_DSN; nunca use la base de producción.")
+
+    # database_operations toma la conexión de DB_DSN; el esquema se crea con las migraciones.
+    os.environ["DB_DSN"] = args.dsn
+    from backend import migraciones
+    if not migraciones.aplicar_migraciones(dsn=args.dsn):
+        return 1
+
+    resultados = {'metadatos': metadatos_corrida(args), 'tamanos': {}}
+    for etiqueta in args.tamanos:
+        logging.info(f"Benchmark con {etiqueta} facturas...")
+        resultados['tamanos'][etiqueta] = ejecutar_tamano(
+            args.dsn, TAMANOS_ESTANDAR[etiqueta], args.semilla, args.repeticiones)
+
+    imprimir_resultados(resultados)
+
+    salida = args.salida or os.path.join(DIRECTORIO_RESULTADOS, f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    directorio = os.path.dirname(salida)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as archivo:
+        json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+    logging.info(f"Resultados guardados en {salida}")
+
+    if args.comparar_con:
+        with open(args.comparar_con, encoding='utf-8') as archivo:
+            referencia = json.load(archivo)
+        regresiones = comparar(resultados, referencia, args.tolerancia)
+        if regresiones:
+            print("\nRegresiones respecto a la referencia:")
+            for regresion in regresiones:
+                print(f"  [{regresion['tamano']}] {regresion['operacion']}: "
+                      f"{regresion['referencia_ms']:.2f} ms -> {regresion['actual_ms']:.2f} ms (+{regresion['cambio']:.0%})")
+            return 1
+        print("\nSin regresiones respecto a la referencia.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
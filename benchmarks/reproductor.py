@@ -0,0 +1,172 @@
+"""
+Reproduce contra una base de pruebas una traza grabada con DB_GRABAR_CARGA.
+
+Las operaciones se vuelven a emitir a través de database_operations respetando los
+instantes originales (o escalados con --velocidad) y con concurrencia, de modo que se
+pueda comparar un cambio de esquema o de índices con los patrones de acceso reales:
+
+    python -m benchmarks.reproductor data/carga.jsonl --dsn postgresql://localhost/trazabilidad_bench \\
+        --velocidad 2 --json antes.json
+    python -m benchmarks.reproductor data/carga.jsonl --dsn ... --json despues.json --comparar-con antes.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.grabacion import decodificar
+from benchmarks.carga_concurrente import percentil
+
+PREFIJOS_ESCRITURA = ('guardar_', 'actualizar_', 'eliminar_', 'entregar_', 'aplicar_', 'reparar_')
+TOLERANCIA_REGRESION = 0.20
+
+def leer_traza(ruta):
+    eventos = []
+    with open(ruta, encoding='utf-8') as archivo:
+        for numero_linea, linea in enumerate(archivo, 1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                eventos.append(json.loads(linea))
+            except json.JSONDecodeError:
+                logging.warning(f"Línea {numero_linea} de la traza no es JSON válido; se omite.")
+    eventos.sort(key=lambda evento: evento['t'])
+    return eventos
+
+def reproducir(eventos, velocidad=1.0, hilos=8, solo_lectura=False):
+    """
+    Emite cada evento en su instante original dividido por `velocidad` (0 = sin esperas).
+    Retorna las muestras (operacion, ms_original, ms_reproduccion, exito).
+    """
+    from backend import database_operations as db_ops
+
+    muestras = []
+    bloqueo = threading.Lock()
+
+    def ejecutar(evento):
+        funcion = getattr(db_ops, evento['operacion'], None)
+        if funcion is None:
+            logging.warning(f"La operación {evento['operacion']} ya no existe en database_operations; se omite.")
+            return
+        inicio = time.perf_counter()
+        exito = True
+        try:
+            funcion(**decodificar(evento['parametros']))
+        except Exception as e:
+            exito = False
+            logging.warning(f"Error al reproducir {evento['operacion']}: {e}")
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+        with bloqueo:
+            muestras.append((evento['operacion'], evento['ms'], duracion_ms, exito))
+
+    inicio_reproduccion = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        for evento in eventos:
+            if solo_lectura and evento['operacion'].startswith(PREFIJOS_ESCRITURA):
+                continue
+            if velocidad > 0:
+                espera = evento['t'] / velocidad - (time.perf_counter() - inicio_reproduccion)
+                if espera > 0:
+                    time.sleep(espera)
+            ejecutor.submit(ejecutar, evento)
+    return muestras, time.perf_counter() - inicio_reproduccion
+
+def resumir(muestras):
+    por_operacion = defaultdict(lambda: {'original': [], 'reproduccion': [], 'errores': 0})
+    for operacion, ms_original, ms_reproduccion, exito in muestras:
+        datos = por_operacion[operacion]
+        datos['original'].append(ms_original)
+        datos['reproduccion'].append(ms_reproduccion)
+        if not exito:
+            datos['errores'] += 1
+    return {
+        operacion: {
+            'llamadas': len(datos['reproduccion']),
+            'errores': datos['errores'],
+            'original_p50_ms': percentil(datos['original'], 50),
+            'original_p95_ms': percentil(datos['original'], 95),
+            'p50_ms': percentil(datos['reproduccion'], 50),
+            'p95_ms': percentil(datos['reproduccion'], 95),
+            'total_ms': round(sum(datos['reproduccion']), 2),
+        }
+        for operacion, datos in sorted(por_operacion.items())
+    }
+
+def comparar(actual, referencia, tolerancia=TOLERANCIA_REGRESION):
+    regresiones = []
+    for operacion, datos in actual['operaciones'].items():
+        previo = referencia.get('operaciones', {}).get(operacion)
+        if not previo or not previo.get('p95_ms'):
+            continue
+        cambio = datos['p95_ms'] / previo['p95_ms'] - 1
+        if cambio > tolerancia:
+            regresiones.append((operacion, previo['p95_ms'], datos['p95_ms'], cambio))
+    return regresiones
+
+def imprimir_resumen(resultado):
+    print(f"{resultado['eventos']} operaciones en {resultado['duracion_s']:.1f} s (velocidad x{resultado['velocidad']})")
+    print(f"{'Operación':<48} {'n':>6} {'err':>4} {'orig p95':>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for operacion, datos in resultado['operaciones'].items():
+        print(f"{operacion:<48} {datos['llamadas']:>6} {datos['errores']:>4} {datos['original_p95_ms'] or 0:>10.1f} "
+              f"{datos['p50_ms'] or 0:>10.1f} {datos['p95_ms'] or 0:>10.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproduce una traza de carga grabada con DB_GRABAR_CARGA.")
+    parser.add_argument("traza", help="Archivo JSONL generado por backend/grabacion.py.")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN"), help="Base PostgreSQL de pruebas (o BENCH_DSN).")
+    parser.add_argument("--velocidad", type=float, default=1.0,
+                        help="1 = ritmo original, 2 = el doble de rápido, 0 = sin esperas entre operaciones.")
+    parser.add_argument("--hilos", type=int, default=8, help="Operaciones simultáneas como máximo.")
+    parser.add_argument("--solo-lectura", action="store_true", help="Omite las operaciones que escriben.")
+    parser.add_argument("--json", dest="salida_json", default=None, help="Guarda el resumen en este archivo JSON.")
+    parser.add_argument("--comparar-con", default=None, help="Resumen JSON de una reproducción anterior.")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_REGRESION)
+    args = parser.parse_args(argv)
+
+    if not args.dsn:
+        parser.error("Indique --dsn o la variable BENCH_DSN; nunca reproduzca contra la base de producción.")
+    os.environ["DB_DSN"] = args.dsn
+    # La reproducción no debe grabarse a sí misma.
+    os.environ.pop("DB_GRABAR_CARGA", None)
+    from backend import grabacion
+    grabacion.RUTA_GRABACION = None
+
+    eventos = leer_traza(args.traza)
+    if not eventos:
+        logging.error("La traza está vacía.")
+        return 1
+    muestras, duracion_s = reproducir(eventos, args.velocidad, args.hilos, args.solo_lectura)
+    resultado = {
+        'traza': args.traza,
+        'eventos': len(muestras),
+        'velocidad': args.velocidad,
+        'duracion_s': round(duracion_s, 2),
+        'operaciones': resumir(muestras),
+    }
+    imprimir_resumen(resultado)
+
+    if args.salida_json:
+        with open(args.salida_json, 'w', encoding='utf-8') as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        logging.info(f"Resumen guardado en {args.salida_json}")
+
+    if args.comparar_con:
+        with open(args.comparar_con, encoding='utf-8') as archivo:
+            referencia = json.load(archivo)
+        regresiones = comparar(resultado, referencia, args.tolerancia)
+        if regresiones:
+            print("\nOperaciones con p95 peor que la referencia:")
+            for operacion, previo, actual, cambio in regresiones:
+                print(f"  {operacion}: {previo:.1f} ms -> {actual:.1f} ms (+{cambio:.0%})")
+            return 1
+        print("\nSin regresiones respecto a la referencia.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
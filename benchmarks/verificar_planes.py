@@ -0,0 +1,190 @@
+"""
+Verificación de planes de consulta: falla (código de salida 1) si alguna sentencia de
+backend/database_operations.py deja de usar el índice esperado, hace un Seq Scan sobre
+una tabla grande o supera su costo estimado máximo.
+
+Carga un conjunto sintético grande en una base PostgreSQL local, ejecuta
+EXPLAIN (FORMAT JSON) sobre todo el catálogo de consultas y compara cada plan con
+EXPECTATIVAS. Pensado para correr en el pipeline de despliegue:
+
+    python -m benchmarks.verificar_planes --dsn postgresql://localhost/trazabilidad_bench --filas 1000000
+
+tests/test_planes.py lo ejecuta desde pytest cuando BENCH_DSN está definida, y el job de
+.github/workflows/pruebas.yml lo corre sobre un PostgreSQL de servicio.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from backend import migraciones
+from backend import database_operations as db_ops
+from benchmarks.asesor_indices import explicar, recorrer_nodos, tamanos_tablas
+from benchmarks.catalogo_consultas import obtener_muestras, sentencias_catalogadas, sentencias_sin_catalogar
+from benchmarks.datos_sinteticos import cargar_facturas_sinteticas
+
+FILAS_POR_DEFECTO = 500_000
+UMBRAL_FILAS_SEQ_SCAN = 10_000
+TABLAS_VIGILADAS = ('facturas', 'detalles_soat')
+
+# Por sentencia del catálogo:
+#   indices: al menos uno debe aparecer en el plan.
+#   costo_relativo_max: costo total estimado máximo, como fracción del Seq Scan completo de facturas.
+#   permitir_seq_scan: la consulta recorre (casi) toda la tabla a propósito.
+# Las sentencias sin entrada solo deben evitar Seq Scan sobre las tablas vigiladas.
+POR_ID = {'indices': {'facturas_pkey'}, 'costo_relativo_max': 0.01}
+POR_IDS = {'indices': {'facturas_pkey'}, 'costo_relativo_max': 0.05}
+POR_NUMERO = {'indices': {'idx_facturas_numero_factura', 'unique_factura_details'}, 'costo_relativo_max': 0.01}
+POR_LOTE = {'indices': {'idx_facturas_lote_id'}, 'costo_relativo_max': 0.05}
+POR_ESTADO = {'indices': {'idx_facturas_estado_facturador_eps', 'idx_facturas_pendientes_radicador'},
+              'costo_relativo_max': 0.6}
+
+EXPECTATIVAS = {
+    'SQL_OBTENER_FACTURA_POR_ID': POR_ID,
+    'SQL_OBTENER_FACTURA_POR_NUMERO': POR_NUMERO,
+    'SQL_OBTENER_DETALLES_SOAT_POR_FACTURA_ID': {'indices': {'detalles_soat_factura_id_key'}, 'costo_relativo_max': 0.01},
+    'SQL_CREAR_FACTURA': POR_NUMERO,
+    'SQL_ACTUALIZAR_FACTURA_PARCIAL': POR_ID,
+    'SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURA': POR_ID,
+    'SQL_ACTUALIZAR_FECHA_ENTREGA_RADICADOR': POR_ID,
+    'SQL_ELIMINAR_FACTURA': POR_ID,
+    'SQL_GUARDAR_FACTURA_REEMPLAZO': POR_ID,
+    'SQL_ENTREGAR_FACTURAS_RADICADOR': POR_IDS,
+    'SQL_ACTUALIZAR_ESTADO_AUDITORIA_FACTURAS': POR_IDS,
+    'SQL_DEVOLVER_FACTURAS': POR_IDS,
+    'SQL_OBTENER_ESTADOS_AUDITORIA_POR_IDS': POR_IDS,
+    'SQL_OBTENER_NUMEROS_FACTURA_EXISTENTES': POR_NUMERO,
+    'SQL_CARGAR_FACTURAS_POR_LOTE': POR_LOTE,
+    'SQL_OBTENER_DATOS_CARGA_POR_LOTE': POR_LOTE,
+    'SQL_CARGAR_PAGINA_FACTURAS_POR_URGENCIA': {'indices': {'idx_facturas_urgencia'}, 'costo_relativo_max': 0.01},
+    'SQL_CARGAR_PAGINA_FACTURAS_POR_URGENCIA (período activo)': {'indices': {'idx_facturas_urgencia'},
+                                                                 'costo_relativo_max': 0.01},
+    'SQL_BANDEJA_LEGALIZADOR': {'indices': {'idx_facturas_bandeja_devueltas', 'idx_facturas_bandeja_por_vencer'},
+                                'costo_relativo_max': 0.05},
+    'SQL_BANDEJA_AUDITOR': {'indices': {'idx_facturas_bandeja_auditor'}, 'costo_relativo_max': 0.01},
+    'SQL_CARGAR_FACTURAS_CAMBIADAS': {'indices': {'idx_facturas_updated_at'}, 'costo_relativo_max': 0.05},
+    'SQL_ARCHIVAR_FACTURAS': {'indices': {'idx_facturas_archivables', 'facturas_pkey'}, 'costo_relativo_max': 0.05},
+    'SQL_VERSION_DATOS_FACTURAS': {'indices': {'idx_facturas_updated_at'}, 'costo_relativo_max': 0.01},
+    'SQL_OBTENER_CONTEO_FACTURAS_POR_LEGALIZADOR_Y_EPS': POR_ESTADO,
+    'SQL_OBTENER_CONTEO_FACTURAS_LISTA_PARA_RADICAR': POR_ESTADO,
+    'SQL_OBTENER_CONTEO_FACTURAS_CON_ERRORES': POR_ESTADO,
+    'SQL_OBTENER_CONTEO_FACTURAS_PENDIENTES_GLOBAL': POR_ESTADO,
+    'SQL_OBTENER_IDS_PENDIENTES_RADICADOR': {'indices': {'idx_facturas_pendientes_radicador'}, 'costo_relativo_max': 0.05},
+    'SQL_REPARAR_SECUENCIA_IDS': {'indices': {'facturas_pkey'}, 'costo_relativo_max': 0.01},
+    # Recorridos completos intencionales: listado sin filtro, búsqueda ILIKE '%...%',
+    # el estado mayoritario, el total y los DISTINCT de los selectores.
+    'SQL_CARGAR_FACTURAS': {'permitir_seq_scan': True},
+    'SQL_CARGAR_FACTURAS (búsqueda)': {'permitir_seq_scan': True},
+    'SQL_OBTENER_CONTEO_FACTURAS_EN_RADICADOR': {'permitir_seq_scan': True},
+    'SQL_OBTENER_CONTEO_TOTAL_FACTURAS': {'permitir_seq_scan': True},
+    # Vencidas: toda factura antigua cuenta, así que es la mayoría de la tabla.
+    'SQL_OBTENER_CONTEO_FACTURAS_VENCIDAS': {'permitir_seq_scan': True},
+    'SQL_CONTAR_FACTURAS': {'permitir_seq_scan': True},
+    'SQL_OBTENER_FACTURADORES_UNICOS': {'permitir_seq_scan': True},
+    'SQL_OBTENER_EPS_UNICAS': {'permitir_seq_scan': True},
+    'SQL_OBTENER_LOTES_UNICOS': {'permitir_seq_scan': True},
+    'SQL_OBTENER_ULTIMO_NUMERO_LOTE': {'permitir_seq_scan': True},
+    # Analítica de un año de devoluciones: se cachea por versión de los datos.
+    'SQL_PARETO_TIPO_ERROR': {'permitir_seq_scan': True},
+}
+
+def costo_seq_scan_facturas(cursor):
+    return explicar(cursor, "SELECT * FROM facturas", None)['Total Cost']
+
+def evaluar_plan(nombre, plan, filas_por_tabla, costo_referencia, umbral_filas=UMBRAL_FILAS_SEQ_SCAN):
+    """Lista de incumplimientos del plan frente a su expectativa (vacía si cumple)."""
+    expectativa = EXPECTATIVAS.get(nombre, {})
+    nodos = list(recorrer_nodos(plan))
+    indices_usados = {nodo['Index Name'] for nodo in nodos if nodo.get('Index Name')}
+    fallas = []
+
+    if not expectativa.get('permitir_seq_scan'):
+        for nodo in nodos:
+            tabla = nodo.get('Relation Name')
+            if (nodo.get('Node Type') == 'Seq Scan' and tabla in TABLAS_VIGILADAS
+                    and filas_por_tabla.get(tabla, 0) >= umbral_filas):
+                fallas.append(f"Seq Scan sobre {tabla} ({filas_por_tabla[tabla]} filas)")
+
+    if expectativa.get('indices') and not (expectativa['indices'] & indices_usados):
+        fallas.append(f"no usa ninguno de {sorted(expectativa['indices'])} (usa {sorted(indices_usados) or 'ninguno'})")
+
+    costo_maximo = expectativa.get('costo_relativo_max')
+    if costo_maximo is not None and plan['Total Cost'] > costo_maximo * costo_referencia:
+        fallas.append(f"costo {plan['Total Cost']:.0f} > {costo_maximo:.0%} del Seq Scan completo ({costo_referencia:.0f})")
+    return fallas
+
+def verificar(conn, umbral_filas=UMBRAL_FILAS_SEQ_SCAN):
+    resultados = []
+    with conn.cursor() as cursor:
+        muestras = obtener_muestras(cursor)
+        filas_por_tabla = tamanos_tablas(cursor)
+        costo_referencia = costo_seq_scan_facturas(cursor)
+        for nombre, sql, parametros in sentencias_catalogadas(muestras):
+            plan = explicar(cursor, sql, parametros)
+            resultados.append({
+                'consulta': nombre,
+                'costo_total': plan['Total Cost'],
+                'fallas': evaluar_plan(nombre, plan, filas_por_tabla, costo_referencia, umbral_filas),
+            })
+        conn.rollback()
+    return {
+        'filas_facturas': filas_por_tabla.get('facturas'),
+        'costo_seq_scan_facturas': costo_referencia,
+        'consultas': resultados,
+        'sin_catalogar': sentencias_sin_catalogar(),
+        'expectativas_huerfanas': sorted(set(EXPECTATIVAS) - {r['consulta'] for r in resultados}),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Falla si algún plan de consulta del catálogo se degrada.")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN"), help="Base PostgreSQL local de pruebas (o BENCH_DSN).")
+    parser.add_argument("--filas", type=int, default=FILAS_POR_DEFECTO,
+                        help="Facturas sintéticas a cargar antes de verificar (0 = usar los datos existentes).")
+    parser.add_argument("--semilla", type=int, default=2025)
+    parser.add_argument("--umbral-filas", type=int, default=UMBRAL_FILAS_SEQ_SCAN)
+    parser.add_argument("--json", dest="salida_json", default=None, help="Guarda el resultado en este archivo JSON.")
+    args = parser.parse_args(argv)
+
+    if not args.dsn:
+        parser.error("Indique --dsn o la variable BENCH_DSN; nunca use la base de producción.")
+    if not migraciones.aplicar_migraciones(dsn=args.dsn):
+        return 1
+    conn = db_ops.abrir_conexion_dedicada(args.dsn)
+    if conn is None:
+        return 1
+    try:
+        if args.filas:
+            cargar_facturas_sinteticas(conn, args.filas, args.semilla)
+        resultado = verificar(conn, args.umbral_filas)
+    finally:
+        conn.close()
+
+    fallidas = [r for r in resultado['consultas'] if r['fallas']]
+    for consulta in resultado['consultas']:
+        estado = "FALLA" if consulta['fallas'] else "ok"
+        print(f"[{estado:>5}] {consulta['consulta']:<55} costo {consulta['costo_total']:>12.1f}")
+        for falla in consulta['fallas']:
+            print(f"          - {falla}")
+    if resultado['sin_catalogar']:
+        print("\nSentencias sin entrada en benchmarks/catalogo_consultas.py (agréguelas):")
+        for nombre in resultado['sin_catalogar']:
+            print(f"  - {nombre}")
+    if resultado['expectativas_huerfanas']:
+        print("\nExpectativas sin sentencia en el catálogo (¿se renombró?):")
+        for nombre in resultado['expectativas_huerfanas']:
+            print(f"  - {nombre}")
+
+    if args.salida_json:
+        with open(args.salida_json, 'w', encoding='utf-8') as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        logging.info(f"Resultado guardado en {args.salida_json}")
+
+    if fallidas or resultado['sin_catalogar'] or resultado['expectativas_huerfanas']:
+        print(f"\n{len(fallidas)} de {len(resultado['consultas'])} planes no cumplen su expectativa.")
+        return 1
+    print(f"\nLos {len(resultado['consultas'])} planes cumplen sus expectativas.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""
+Pruebas contra una base PostgreSQL local de pruebas (la misma de los benchmarks).
+Sin BENCH_DSN se omiten; nunca apunte BENCH_DSN a la base de producción.
+"""
+import os
+
+import pytest
+
+BENCH_DSN = os.environ.get("BENCH_DSN")
+
+def pytest_collection_modifyitems(config, items):
+    if BENCH_DSN:
+        return
+    omitir = pytest.mark.skip(reason="Defina BENCH_DSN con una base PostgreSQL local de pruebas.")
+    for item in items:
+        item.add_marker(omitir)
+
+@pytest.fixture(scope="session")
+def dsn_pruebas():
+    # La conexión cacheada de la app lee DB_DSN al abrirse.
+    os.environ["DB_DSN"] = BENCH_DSN
+    from backend import migraciones
+    assert migraciones.aplicar_migraciones(dsn=BENCH_DSN), "No se pudieron aplicar las migraciones."
+    return BENCH_DSN
@@ -0,0 +1,37 @@
+"""
+El archivo copia facturas y detalles_soat a sus históricos por nombre de columna:
+las tres listas (tabla activa, histórico y la del archivo) deben coincidir.
+"""
+import pytest
+
+pytest.importorskip("psycopg2")
+
+SQL_COLUMNAS = """
+    SELECT column_name FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = %s;
+"""
+
+@pytest.fixture
+def columnas(dsn_pruebas):
+    from backend import database_operations as db_ops
+    conn = db_ops.abrir_conexion_dedicada(dsn_pruebas)
+
+    def columnas_de(tabla):
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_COLUMNAS, (tabla,))
+            return {fila[0] for fila in cursor.fetchall()}
+    yield columnas_de
+    conn.close()
+
+def _lista(columnas_archivo):
+    return {columna.strip() for columna in columnas_archivo.split(",")}
+
+def test_columnas_facturas_historico(columnas):
+    from backend.database_operations import COLUMNAS_FACTURAS_ARCHIVO
+    assert columnas("facturas") == _lista(COLUMNAS_FACTURAS_ARCHIVO)
+    assert columnas("facturas_historico") == _lista(COLUMNAS_FACTURAS_ARCHIVO) | {"archivada_en"}
+
+def test_columnas_detalles_soat_historico(columnas):
+    from backend.database_operations import COLUMNAS_DETALLES_SOAT_ARCHIVO
+    assert columnas("detalles_soat") == _lista(COLUMNAS_DETALLES_SOAT_ARCHIVO)
+    assert columnas("detalles_soat_historico") == _lista(COLUMNAS_DETALLES_SOAT_ARCHIVO)
@@ -0,0 +1,14 @@
+"""
+Regresiones de planes de consulta: ejecuta benchmarks/verificar_planes.py sobre la base de
+pruebas. BENCH_FILAS ajusta las facturas sintéticas que se cargan antes de verificar.
+"""
+import os
+
+import pytest
+
+pytest.importorskip("psycopg2")
+from benchmarks import verificar_planes
+
+def test_planes_cumplen_expectativas(dsn_pruebas):
+    filas = int(os.environ.get("BENCH_FILAS", verificar_planes.FILAS_POR_DEFECTO))
+    assert verificar_planes.main(["--dsn", dsn_pruebas, "--filas", str(filas)]) == 0
@@ -0,0 +1,51 @@
+"""
+Las rutas por lotes deben emitir un número constante de sentencias, sin importar
+cuántas facturas procesen (una regresión a un bucle por factura falla aquí).
+"""
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("psycopg2")
+from backend.instrumentacion import afirmar_sin_n_mas_1
+
+FILAS = 2_000
+TAMANO_LOTE = 200
+
+@pytest.fixture
+def db_ops(dsn_pruebas):
+    from backend import database_operations as db_ops
+    from benchmarks.datos_sinteticos import cargar_facturas_sinteticas
+    conn = db_ops.abrir_conexion_dedicada(dsn_pruebas)
+    try:
+        cargar_facturas_sinteticas(conn, FILAS)
+    finally:
+        conn.close()
+    return db_ops
+
+def _ids(inicio=1, cantidad=TAMANO_LOTE):
+    return list(range(inicio, inicio + cantidad))
+
+def test_estados_auditoria_por_ids(db_ops):
+    with afirmar_sin_n_mas_1(max_sentencias=1):
+        estados = db_ops.obtener_estados_auditoria_por_ids(_ids())
+    assert len(estados) == TAMANO_LOTE
+
+def test_reporte_carga_masiva(db_ops):
+    import pandas as pd
+    from utils.io_utils import generar_reporte_carga_masiva
+    ids = _ids()
+    df = pd.DataFrame({'numero_factura': [str(i) for i in ids], 'fecha_generacion': ['2025-01-01'] * len(ids)})
+    with afirmar_sin_n_mas_1(max_sentencias=1):
+        html = generar_reporte_carga_masiva("001", "Legalizador", "EPS", "SOAT", df, datetime.now(), ids)
+    assert html.count("<tr>") == len(ids) + 1
+
+def test_entrega_masiva_radicador(db_ops):
+    with afirmar_sin_n_mas_1(max_sentencias=1):
+        db_ops.entregar_facturas_radicador(_ids(), datetime.now())
+
+def test_auditoria_masiva(db_ops):
+    aprobadas = _ids(1)
+    devoluciones = [(factura_id, 'TARIFA', 'Revisión') for factura_id in _ids(1 + TAMANO_LOTE)]
+    with afirmar_sin_n_mas_1(max_sentencias=2):
+        db_ops.aplicar_auditoria_masiva(aprobadas, devoluciones)
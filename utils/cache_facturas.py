@@ -0,0 +1,117 @@
+# utils/cache_facturas.py
+"""
+Listado de facturas en caché que se actualiza con el feed de cambios (updated_at y
+facturas_eliminadas) en lugar de recargarse completo.
+
+La primera lectura carga todo y guarda la marca de tiempo del servidor; después, como
+mucho cada INTERVALO_REFRESCO_S segundos (o enseguida tras una escritura de la app), se
+piden solo las filas cambiadas desde la marca y se fusionan por ID en el listado crudo y
+en el procesado para mostrar. El procesado completo solo se repite al cambiar el día,
+porque 'Días Restantes' depende de la fecha actual.
+"""
+import os
+import threading
+import time
+from datetime import date
+
+import pandas as pd
+
+from backend import database_operations as db_ops
+from utils.df_utils import process_factura_for_display_df
+
+INTERVALO_REFRESCO_S = float(os.environ.get("FACTURAS_INTERVALO_REFRESCO_S", "15"))
+
+# Momento (monotónico) de la última escritura hecha desde este proceso.
+_ultima_escritura = 0.0
+
+def marcar_cambios():
+    """Hace que todos los cachés pidan los cambios en su próxima lectura."""
+    global _ultima_escritura
+    _ultima_escritura = time.monotonic()
+
+def _fusionar(nuevas, existentes, columna_id, ids_afectados):
+    """Reemplaza en `existentes` las filas de `ids_afectados` por `nuevas`, en orden de ID descendente."""
+    if columna_id in existentes.columns:
+        existentes = existentes[~existentes[columna_id].isin(ids_afectados)]
+    partes = [df for df in (nuevas, existentes) if columna_id in df.columns]
+    if not partes:
+        return existentes
+    return pd.concat(partes, ignore_index=True).sort_values(columna_id, ascending=False).reset_index(drop=True)
+
+class CacheIncrementalFacturas:
+    def __init__(self, search_term=None, search_column=None):
+        self.search_term = search_term
+        self.search_column = search_column
+        self.crudo = pd.DataFrame()
+        self.procesado = process_factura_for_display_df(None)
+        self.marca = None
+        self.fecha_proceso = None
+        self.refrescado_en = None
+        self.cargas_completas = 0
+        self.refrescos = 0
+        self.filas_refrescadas = 0
+        self._bloqueo = threading.Lock()
+
+    def obtener(self):
+        """Listado procesado para mostrar, al día según el intervalo de refresco."""
+        with self._bloqueo:
+            if self.marca is None:
+                self._cargar_completo()
+            elif (self.refrescado_en <= _ultima_escritura
+                  or time.monotonic() - self.refrescado_en >= INTERVALO_REFRESCO_S):
+                self._aplicar_cambios()
+            if self.fecha_proceso != date.today():
+                self.procesado = self._procesar(self.crudo)
+            return self.procesado
+
+    def _procesar(self, crudo):
+        self.fecha_proceso = date.today()
+        procesado = process_factura_for_display_df(crudo)
+        return procesado.sort_values('ID', ascending=False).reset_index(drop=True)
+
+    def _cargar_completo(self):
+        facturas, marca = db_ops.cargar_facturas_con_marca(self.search_term, self.search_column)
+        self.refrescado_en = time.monotonic()
+        if marca is None:
+            return
+        self.crudo = pd.DataFrame(facturas)
+        self.procesado = self._procesar(self.crudo)
+        self.marca = marca
+        self.cargas_completas += 1
+
+    def _coincide_busqueda(self, crudo):
+        """Equivalente a `columna ILIKE '%termino%'` de la carga completa."""
+        if not (self.search_term and self.search_column) or crudo.empty:
+            return pd.Series(True, index=crudo.index)
+        return crudo[self.search_column].astype(str).str.contains(self.search_term, case=False, regex=False, na=False)
+
+    def _aplicar_cambios(self):
+        cambios = db_ops.cargar_cambios_facturas(self.marca)
+        self.refrescado_en = time.monotonic()
+        if cambios is None:
+            return
+        self.marca = cambios['marca']
+        self.refrescos += 1
+        if not cambios['facturas'] and not cambios['eliminadas']:
+            return
+
+        cambiadas = pd.DataFrame(cambios['facturas'])
+        ids_afectados = set(cambios['eliminadas'])
+        if not cambiadas.empty:
+            ids_afectados |= set(cambiadas['id'].tolist())
+            # Una fila que dejó de coincidir con la búsqueda sale del listado como si se hubiera eliminado.
+            cambiadas = cambiadas[self._coincide_busqueda(cambiadas)]
+        self.filas_refrescadas += len(cambiadas)
+
+        self.crudo = _fusionar(cambiadas, self.crudo, 'id', ids_afectados)
+        if self.fecha_proceso == date.today():
+            self.procesado = _fusionar(process_factura_for_display_df(cambiadas), self.procesado, 'ID', ids_afectados)
+
+    def resumen(self):
+        return {
+            'filas': len(self.crudo),
+            'marca': self.marca,
+            'cargas_completas': self.cargas_completas,
+            'refrescos': self.refrescos,
+            'filas_refrescadas': self.filas_refrescadas,
+        }
@@ -34,6 +34,12 @@ def sumar_dias_habiles(fecha_inicio, dias):
             dias_sumados += 1
     return fecha_actual
 
+def dia_habil_anterior(fecha):
+    fecha_actual = fecha - timedelta(days=1)
+    while not es_dia_habil(fecha_actual):
+        fecha_actual -= timedelta(days=1)
+    return fecha_actual
+
 def calcular_dias_habiles_entre_fechas(fecha_inicio, fecha_fin):
     if fecha_inicio > fecha_fin:
         return -calcular_dias_habiles_entre_fechas(fecha_fin, fecha_inicio) # Manejar orden inverso
@@ -0,0 +1,163 @@
+# utils/df_utils.py
+import pandas as pd
+import numpy as np
+from utils.date_utils import sumar_dias_habiles, DIAS_FESTIVOS_2025
+
+FESTIVOS = np.array(DIAS_FESTIVOS_2025, dtype='datetime64[D]')
+
+def process_factura_for_display_df(df_raw):
+    if df_raw is None or len(df_raw) == 0:
+        return pd.DataFrame(columns=[
+            'ID', 'Lote', 'Área de Servicio', 'Facturador', 'EPS', 'Número de Factura',
+            'Número Reemplazo Factura', 'Fecha Generación', 'Fecha Reemplazo Factura',
+            'Fecha de Entrega', 'Días Restantes', 'Estado', 'Estado Auditoria',
+            'Tipo de Error', 'Observación Auditor', 'Fecha Entrega Radicador'
+        ])
+
+    if not isinstance(df_raw, pd.DataFrame):
+        df = pd.DataFrame(df_raw)
+    else:
+        df = df_raw.copy()
+
+    hoy = pd.Timestamp('today').normalize()
+
+    date_columns = ['fecha_generacion', 'fecha_reemplazo', 'fecha_hora_entrega', 'fecha_entrega_radicador', 'fecha_gen_original_linked']
+    for col in date_columns:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce').dt.normalize()
+
+    df['fecha_base_calculo'] = df['fecha_reemplazo'].combine_first(df['fecha_generacion'])
+
+    if 'fecha_limite_liquidacion' in df.columns:
+        # Calculada por la base (trigger de la migración 5) con los mismos festivos.
+        df['fecha_limite_liquidacion_obj'] = pd.to_datetime(df['fecha_limite_liquidacion'], errors='coerce')
+    else:
+        df['fecha_limite_liquidacion_obj'] = df['fecha_base_calculo'].apply(
+            lambda x: sumar_dias_habiles(x, 21) if not pd.isnull(x) else None
+        )
+
+    # Días hábiles de hoy a la fecha límite, como calcular_dias_habiles_entre_fechas pero por columna:
+    # busday_count cuenta [hoy, límite) y es negativo si la fecha límite ya pasó.
+    limites = pd.to_datetime(df['fecha_limite_liquidacion_obj'], errors='coerce').dt.normalize()
+    validas = limites.notna().to_numpy()
+    dias_restantes = np.full(len(df), np.nan)
+    if validas.any():
+        dias_restantes[validas] = np.busday_count(
+            hoy.to_datetime64().astype('datetime64[D]'),
+            limites.to_numpy()[validas].astype('datetime64[D]'),
+            holidays=FESTIVOS,
+        )
+    df['Días Restantes'] = pd.Series(dias_restantes, index=df.index)
+
+    cond_vencidas = (
+        (df['Días Restantes'] < 0) |  # Cualquier valor negativo
+        (df['Días Restantes'].astype(str).str.contains('Refacturar', na=False))  # Incluir textos existentes
+    )
+
+    cond_hoy_vence = (df['Días Restantes'] == 0)
+
+    df.loc[cond_vencidas, 'Días Restantes'] = "Refacturar"
+    df.loc[cond_hoy_vence, 'Días Restantes'] = "Hoy Vence"
+
+    cond_estado_vencidas = (df['Días Restantes'].isin(["Refacturar", "Hoy Vence"]))
+    df.loc[cond_estado_vencidas, 'Estado'] = "Vencidas"
+
+    df['Número de Factura'] = np.where(
+        df['factura_original_id'].notnull(),
+        df['num_fact_original_linked'],
+        df['numero_factura']
+    )
+
+    df['Número Reemplazo Factura'] = np.where(
+        df['factura_original_id'].notnull(),
+        df['numero_factura'],
+        np.where(
+            df['estado'] == 'Reemplazada',
+            df['reemplazada_por_numero_factura'],
+            ""
+        )
+    )
+
+    df['Fecha Generación'] = np.where(
+        df['factura_original_id'].notnull(),
+        df['fecha_gen_original_linked'],
+        df['fecha_generacion']
+    )
+
+    df['Fecha Reemplazo Factura'] = np.where(
+        df['factura_original_id'].notnull(),
+        df['fecha_generacion'].dt.strftime('%Y-%m-%d'),
+        np.where(
+            df['estado'] == 'Reemplazada',
+            df['fecha_reemplazo'].dt.strftime('%Y-%m-%d'),
+            ""
+        )
+    )
+
+    df['Estado'] = np.where(df['factura_original_id'].notnull(), "Reemplazada", df['estado'])
+    df.loc[cond_estado_vencidas, 'Estado'] = "Vencidas"
+
+    df['Fecha Generación'] = df['Fecha Generación'].dt.strftime('%Y-%m-%d').fillna('')
+    df['Fecha de Entrega'] = df['fecha_hora_entrega'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+    df['Fecha Entrega Radicador'] = df['fecha_entrega_radicador'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+
+    if 'lote_carga_masiva' in df.columns:
+        df['Lote'] = df['lote_carga_masiva']
+    else:
+        df['Lote'] = None
+
+    df = df.rename(columns={
+        'id': 'ID',
+        'area_servicio': 'Área de Servicio',
+        'facturador': 'Facturador',
+        'eps': 'EPS',
+        'estado_auditoria': 'Estado Auditoria',
+        'tipo_error': 'Tipo de Error',
+        'observacion_auditor': 'Observación Auditor'
+    })
+
+    columnas_finales = [
+        'ID', 'Lote', 'Área de Servicio', 'Facturador', 'EPS', 'Número de Factura',
+        'Número Reemplazo Factura', 'Fecha Generación', 'Fecha Reemplazo Factura',
+        'Fecha de Entrega', 'Días Restantes', 'Estado', 'Estado Auditoria',
+        'Tipo de Error', 'Observación Auditor', 'Fecha Entrega Radicador'
+    ]
+
+    for col in columnas_finales:
+        if col not in df.columns:
+            df[col] = None
+
+    return df[columnas_finales]
+
+COLUMNAS_RESALTADAS = ['Días Restantes', 'Estado', 'Estado Auditoria', 'Tipo de Error', 'Observación Auditor']
+
+def calcular_color_filas(df):
+    """
+    Color de fondo de cada fila, calculado por columnas: devueltas, corregidas, por refacturar
+    y el resto según los días restantes. El orden por urgencia lo da la base (prioridad_urgencia).
+    """
+    estado_auditoria = df['Estado Auditoria']
+    dias_texto = df['Días Restantes'].astype(str)
+    dias = pd.to_numeric(df['Días Restantes'], errors='coerce')
+    condiciones = [
+        estado_auditoria == 'Devuelta por Auditor',
+        estado_auditoria == 'Corregida por Legalizador',
+        dias_texto == 'Refacturar',
+        (dias >= 1) & (dias <= 3),
+        dias > 3,
+    ]
+    color = np.select(condiciones, ['lightblue', 'lightsalmon', 'salmon', 'yellow', 'lightgreen'], default='')
+    return pd.Series(color, index=df.index, name='color')
+
+def estilos_resaltado(df):
+    """DataFrame de estilos CSS con la forma de `df`, para `df.style.apply(..., axis=None)`."""
+    color = calcular_color_filas(df)
+    css = np.where(color != '', 'background-color: ' + color, '')
+    estilos = pd.DataFrame('', index=df.index, columns=df.columns)
+    for columna in COLUMNAS_RESALTADAS:
+        if columna in estilos.columns:
+            estilos[columna] = css
+    return estilos
+
+def resaltar_filas(df):
+    return df.style.apply(estilos_resaltado, axis=None)
@@ -71,10 +71,8 @@ def generar_reporte_carga_masiva(numero_lote, facturador, eps, area_servicio, da
     else:
         columna_fecha = 'fecha_generacion'
 
-    estados_auditoria = []
-    for factura_id in ids_facturas:
-        factura_data = db_ops.obtener_factura_por_id(factura_id)
-        estados_auditoria.append(factura_data['estado_auditoria'] if factura_data else 'N/A')
+    estados_por_id = db_ops.obtener_estados_auditoria_por_ids(ids_facturas)
+    estados_auditoria = [estados_por_id.get(factura_id, 'N/A') for factura_id in ids_facturas]
 
     for i, (_, row) in enumerate(dataframe_facturas.iterrows(), 1):
         html += f"""
@@ -0,0 +1,144 @@
+# utils/perf_utils.py
+"""
+Perfilado por rerun de la app de Streamlit.
+
+Se activa con PERFILADO_APP=1 o agregando ?perfil=1 a la URL. En cada rerun mide
+las secciones marcadas (funciones display_*, cachés, transformaciones de DataFrame
+y renderizado de estilos), el tiempo en la base de datos por operación, muestra
+el desglose en la barra lateral y agrega una línea JSON a data/perfilado_reruns.jsonl.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+import pandas as pd
+import streamlit as st
+
+from backend import instrumentacion
+
+RUTA_LOG_PERFILADO = os.environ.get("PERFILADO_ARCHIVO", os.path.join('data', 'perfilado_reruns.jsonl'))
+
+_CLAVE_RERUN = '_perfil_rerun_actual'
+_CLAVE_ULTIMO = '_perfil_ultimo_rerun'
+
+# ejecutar_en_paralelo corre secciones y sentencias en hilos del pool: la profundidad va en el
+# contexto (cada tarea parte de una copia del que la lanzó) y el perfil compartido se modifica
+# bajo un bloqueo.
+_profundidad = contextvars.ContextVar('perfil_profundidad', default=0)
+_bloqueo_perfil = threading.Lock()
+
+def perfilado_activo():
+    if os.environ.get("PERFILADO_APP") == "1":
+        return True
+    try:
+        return st.query_params.get("perfil") == "1"
+    except Exception:
+        return False
+
+def _perfil_actual():
+    return st.session_state.get(_CLAVE_RERUN)
+
+@contextmanager
+def seccion(nombre, categoria="render"):
+    perfil = _perfil_actual()
+    if perfil is None:
+        yield
+        return
+    # Se agrega al iniciar para que el desglose respete el orden de ejecución y el anidamiento.
+    profundidad = _profundidad.get()
+    entrada = {'seccion': nombre, 'categoria': categoria, 'profundidad': profundidad, 'ms': None}
+    with _bloqueo_perfil:
+        perfil['secciones'].append(entrada)
+    token = _profundidad.set(profundidad + 1)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _profundidad.reset(token)
+        entrada['ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+
+def perfilar(nombre=None, categoria="render"):
+    """Decorador: mide cada llamada como una sección del rerun actual."""
+    def decorador(funcion):
+        etiqueta = nombre or funcion.__name__
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with seccion(etiqueta, categoria):
+                return funcion(*args, **kwargs)
+
+        # Conserva .clear() de las funciones decoradas con st.cache_data.
+        if hasattr(funcion, 'clear'):
+            envoltura.clear = funcion.clear
+        return envoltura
+    return decorador
+
+@contextmanager
+def perfilar_rerun():
+    if not perfilado_activo():
+        yield
+        return
+
+    perfil = {'inicio': time.perf_counter(), 'secciones': [], 'bd': {}}
+    st.session_state[_CLAVE_RERUN] = perfil
+
+    def observar_sentencia(operacion, sql, duracion_ms, filas):
+        with _bloqueo_perfil:
+            datos = perfil['bd'].setdefault(operacion, {'sentencias': 0, 'ms': 0.0, 'filas': 0})
+            datos['sentencias'] += 1
+            datos['ms'] += duracion_ms
+            if filas and filas > 0:
+                datos['filas'] += filas
+
+    completo = False
+    try:
+        with instrumentacion.observar_sentencias(observar_sentencia):
+            yield
+        completo = True
+    finally:
+        # Un st.rerun() interrumpe el script; el rerun se registra igualmente, marcado como incompleto.
+        st.session_state.pop(_CLAVE_RERUN, None)
+        registro = {
+            'fecha_hora': datetime.now().isoformat(timespec='seconds'),
+            'usuario': st.session_state.get('username'),
+            'completo': completo,
+            'total_ms': round((time.perf_counter() - perfil['inicio']) * 1000, 2),
+            'bd_ms': round(sum(d['ms'] for d in perfil['bd'].values()), 2),
+            'secciones': perfil['secciones'],
+            'bd': {operacion: {**datos, 'ms': round(datos['ms'], 2)} for operacion, datos in perfil['bd'].items()},
+        }
+        st.session_state[_CLAVE_ULTIMO] = registro
+        _agregar_a_log(registro)
+
+def _agregar_a_log(registro):
+    try:
+        directorio = os.path.dirname(RUTA_LOG_PERFILADO)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with open(RUTA_LOG_PERFILADO, 'a', encoding='utf-8') as archivo:
+            archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logging.warning(f"No se pudo escribir el log de perfilado: {e}")
+
+def mostrar_panel_perfilado():
+    if not perfilado_activo():
+        return
+    registro = st.session_state.get(_CLAVE_ULTIMO)
+    if not registro:
+        return
+    with st.sidebar.expander(f"⏱️ Perfil del rerun: {registro['total_ms']:.0f} ms", expanded=False):
+        st.caption(f"{registro['fecha_hora']} · BD: {registro['bd_ms']:.0f} ms · Log: {RUTA_LOG_PERFILADO}")
+        if registro['secciones']:
+            df_secciones = pd.DataFrame(registro['secciones'])
+            df_secciones['seccion'] = df_secciones.apply(lambda fila: "  " * fila['profundidad'] + fila['seccion'], axis=1)
+            df_secciones['% rerun'] = (df_secciones['ms'] / registro['total_ms'] * 100).round(1)
+            st.dataframe(df_secciones[['seccion', 'categoria', 'ms', '% rerun']], hide_index=True, use_container_width=True)
+        if registro['bd']:
+            df_bd = pd.DataFrame([{'operacion': operacion, **datos} for operacion, datos in registro['bd'].items()])
+            st.dataframe(df_bd.sort_values('ms', ascending=False), hide_index=True, use_container_width=True)